@@ -10,6 +10,7 @@ import datetime
 import grass.script as gs
 import grass.script.setup as gsetup
 import re
+from def_network import network_join
 
 # _____________START GRASS SESSION & INPUT DEFINITION_____________
 # # Start the GRASS session:
@@ -72,63 +73,30 @@ stretch_min = 1
 stretch_max = 255
 
 
-# for each of the maps in your list do...
-for map in data:
-    begin_time = datetime.datetime.now()
-    # ...set the computational region
-    gs.run_command('g.region', raster=map)
-
-    # ...get min and max values of the map
-    # r.univar
-    stats = gs.parse_command('r.univar',
-                             map=map,
-                             # output=, # Name for output file (if omitted or "-" output to stdout)
-                             separator='comma',
-                             flags='g'  # -t flag prints in tabular format; -g flag prints in shell script style
-                             )
-
-    print('Stats:\n', *stats, sep='\n')
-    map_min = stats['min']
-    map_max = stats['max']
-
-    # ...stretch the map to 0-255 values using the above formula
-    # r.mapcalc
-    outraster = f'{map.split("@")[0]}_stretch_{stretch_min}{stretch_max}'  # name of output raster
-    gs.mapcalc(f'{outraster} = ({map}-{map_min})*({stretch_max}-{stretch_min})/({map_max}-{map_min}) + {stretch_min}')
-
-    runtime_stretch = (datetime.datetime.now() - begin_time).total_seconds()
-    print(f'Stretching took {runtime_stretch/60} mins.')
-
-
-# _____________JOIN STRETCHED RASTER_____________
-# join raster using r.mapcalc
+# _____________STRETCH AND JOIN RASTER IN ONE PASS_____________
+# Stretch, join using nmin(), multiply by 100 and round are done by a single r.mapcalc run (see def_network.py).
+# Every corridor is read once and only the rounded integer raster is written.
+# min and max of each map are taken from the range stored with the raster.
 # minimum r.mapcalc nmin() excludes NULL values and therefore does not require NULL-value conversion!
+# (check here for details on the integer output: https://grasswiki.osgeo.org/wiki/Large_raster_data_processing)
 
-# get all stretched maps
-filepattern = '*stretch*'
-excludepattern = ''
-corridors = gs.list_strings(type='raster',
-                           pattern=filepattern,
-                           exclude=excludepattern,
-                           mapset='PERMANENT'
-                           )
-
-
-rastbase = corridors[0].split("@")[0]
+rastbase = data[0].split("@")[0]
 # get the part of the raster name to be replaced for renaming
 rast_root = re.findall('corridor_[0-9]{3,4}_[0-9]{3,4}_costdist', rastbase)
 out_min = f'{rastbase.replace(rast_root[0], "corridors_mid4th_wY")}_minjoined' #name of output raster
-
-minmaps = ','.join(corridors) # creates a single string in which the rasters to be combined are separated by a comma and can be fed into r.mapcalc
-gs.mapcalc(f'{out_min} = nmin({minmaps})') #joins the stretched raster based on selecting the minimum value across all rasters, excluding NULL cells
-
-# Transform joined raster into Byte format (check here for details: https://grasswiki.osgeo.org/wiki/Large_raster_data_processing)
-# set up the variables
-out_mult100 = f'{out_min}_mult100'
-out_byte = f'{out_mult100}_rounded'
-# run gs.mapcalc 2x
-gs.mapcalc(f'{out_mult100} = {out_min}@PERMANENT * 100') # multiply by 100
-gs.mapcalc(f'{out_byte} = round({out_mult100}@PERMANENT)') # then round to integer
+out_byte = f'{out_min}_mult100_rounded'
+
+begin_time = datetime.datetime.now()
+network_join(data,
+             out_byte,
+             stretch_min=stretch_min,
+             stretch_max=stretch_max,
+             scale=100,
+             argmin=None, # e.g. f'{out_min}_argmin' to also get which corridor holds the minimum in each cell
+             coverage=None # e.g. f'{out_min}_coverage' to also get the number of corridors in each cell
+             )
+runtime_join = (datetime.datetime.now() - begin_time).total_seconds()
+print(f'Stretching and joining took {runtime_join/60} mins.')
 
 # run r.out.gdal to output the final result for check in QGIS
 outloc = 'FOLDER' #folder location for export
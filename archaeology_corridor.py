@@ -5,11 +5,22 @@ import grass.script as gs
 import grass.script.setup as gsetup
 from def_rcost_checki import costdistcheck
 from def_rcost_run import costdist
-from def_corridors import corridors
 from def_corridors import tenperc
+from def_corridors import corridors_batch
+from def_corridors import corridor_perc
+from def_tiled import corridors_tiled
+from def_bidir import corridors_bidir
+from def_multires import corridors_multires
+from def_quantrecode import quantrecode_batch
+from def_precision import Precision
 from def_lcp import lcp
 from def_ringdal import ringdal
 from def_routgdal import routgdal
+from def_catalog import RasterCatalog
+from def_manifest import Manifest
+from def_trace import Tracer
+from def_windows import Windows, near_pairs
+from def_async import ModuleRunner
 
 
 '''
@@ -27,6 +38,32 @@ print(f'The whole process starts now: {begin_time_whole}')
 # Get the start date as a string to feed to txt file name.
 today = begin_time_whole.strftime('%Y-%m-%d')
 
+# Optionally record every GRASS module call with its stage, region size, wall and CPU time and peak memory
+# (see def_trace.py), e.g. tracelog = f'/path/trace_{today}'. None records nothing.
+tracelog = None # HERE USER INPUT location and name of the trace files
+tracer = Tracer(f'{tracelog}.jsonl') if tracelog else None
+if tracer is not None:
+    tracer.install()
+
+
+def begin(stage):
+    # Stages are only recorded if there is a tracer.
+    if tracer is not None:
+        tracer.begin(stage)
+
+
+def end():
+    if tracer is not None:
+        tracer.end()
+
+
+# Optionally run the r.quantile (tenperc), r.out.gdal (routgdal) and r.path (lcp) calls concurrently, each in the
+# region of its raster, with streamed output and retries (see def_async.py), e.g. runlimit = 4.
+# None runs them one after the other.
+runlimit = None # HERE USER INPUT number of modules at the same time
+runretries = 1 # HERE USER INPUT number of retries of a failed module
+runner = ModuleRunner(limit=runlimit, retries=runretries, tracer=tracer) if runlimit else None
+
 # Set the string that you want to identify your files by.
 envfact = 'seas_snow_surfw_dam_wat01_noconvol_dsrt005excl' # HERE USER INPUT TO ONLY TAKE THOSE FILES OF ONE ENVIRONMENTAL FACTOR/FILE PATTERN
 
@@ -48,9 +85,25 @@ gs.run_command('v.in.ascii',
 
 begin_time = datetime.datetime.now()
 print(f'Reading in TIFFs starts now: {begin_time}')
+begin('ringdal')
+
+# List the PERMANENT mapset once. The catalog is passed to every step and kept up to date by them.
+catalog = RasterCatalog()
+
+# Record of all outputs and the inputs they were created from. On a rerun only outputs whose inputs changed,
+# or that were not complete, are created again (see def_manifest.py).
+# Outputs that exist but are not in the manifest are removed and created again (adopt = False). adopt = True keeps
+# them and records them as up to date without any check, e.g. on the first run with a manifest on existing outputs.
+adopt = False # HERE USER INPUT
+manifest = Manifest('/export/home/fkj22/rcostconvol/corridor_manifest.json', adopt=adopt) # HERE USER INPUT path of the manifest
+# Storage of cost dist, corridors and 10% corridors (see def_precision.py): Precision('double') keeps DCELL;
+# 'float' (FCELL) or 'int' (CELL of the values times scale) halve the size of every raster but round the values.
+precision = Precision('double') # HERE USER INPUT
 
 folder = '/export/home/fkj22/rcostconvol/in'
-ringdal(folder, envfact) # Read in files from a particular pattern using a r.in.gdal
+readmode = 'copy' # HERE USER INPUT 'copy' imports the tifs (r.in.gdal), 'link' registers them without copying (r.external)
+ringdal(folder, envfact, catalog=catalog, mode=readmode, nprocs=4, manifest=manifest) # Read in files from a particular pattern using a r.in.gdal
+end()
 
 # _____________GET INPUTS FOR R.COST_____________
 # Step 1: get a list of costsurfaces to calculate costdist from
@@ -80,12 +133,35 @@ print('from start points: ', *cststarts, sep='\n')
 
 # _____________RUN COSTDIST_____________
 # Step 3: check memory requirements for cost dist calculation
-costdistcheck(costsurfs,cststarts)
+# The estimates are used to pick the memory of each r.cost run and how many run at the same time.
+begin('costdistcheck')
+estimates = costdistcheck(costsurfs,cststarts, catalog=catalog)
+end()
 
 # Step 4: calculate cost dist
 begin_time = datetime.datetime.now()
 print(f'Cost dist calculation starts now: {begin_time}')
-costdist(costsurfs,cststarts)
+begin('costdist')
+nprocs_cost = 1 # HERE USER INPUT number of r.cost runs at the same time
+ram_budget = 64000 # HERE USER INPUT RAM in MB all r.cost runs together may use
+# Cropped regions (see def_windows.py): each r.cost run and corridor only covers the bounding box of its sites plus
+# 'buffer', and/or r.cost stops at 'max_cost'. None uses the full cost surface.
+buffer = None # HERE USER INPUT buffer around the sites in map units, e.g. 20000
+max_cost = None # HERE USER INPUT accumulated cost at which r.cost stops
+# Corridors are created between all pairs of sites, or only between sites closer than 'pairdist'. The window of each
+# r.cost run covers the site and the sites it is paired with, so with all pairs it covers all sites.
+pairdist = None # HERE USER INPUT largest distance between the sites of a corridor in map units, e.g. 50000
+pairs = near_pairs(cststarts, pairdist) if pairdist else None
+windows = Windows(cststarts, buffer, pairs=pairs) if buffer else None
+# Scenario runs: with a base cost surface the others were edited from (e.g. without a dam), the other cost surfaces
+# are only searched again where they differ from it (numpy engine, see def_rcost_numpy.py). None runs r.cost.
+# The numpy engine searches in Python: only the cells updated from the base are fast, a full search of a cost surface
+# is much slower than r.cost.
+base = None # HERE USER INPUT e.g. 'costsurf_slope_seas_snow_surfw_noconvol_mean@PERMANENT'
+costdist(costsurfs,cststarts, catalog=catalog, nprocs=nprocs_cost, estimates=estimates, ram_mb=ram_budget,
+         manifest=manifest, windows=windows, max_cost=max_cost, precision=precision,
+         engine='numpy' if base else 'rcost', base=base)
+end()
 runtime_costdist = (datetime.datetime.now() - begin_time).total_seconds()
 print(f'The runtime to calculate all cost distance raster is {runtime_costdist} seconds.\n')
 
@@ -107,22 +183,62 @@ combosall = list(combinations(costdists, 2))
 
 # Step 3: check that only those raster are connected that have the same root and put them into a new list
 combos = []
+pairsets = [set(p) for p in pairs] if pairs is not None else None
 for i, comb in enumerate(combosall):
     roota = comb[0].split("_", 1)[1]
     # print(roota)
     rootb = comb[1].split("_", 1)[1]
     if roota == rootb:
-        combos.append(comb)
+        # Only the pairs the windows were built for.
+        if pairs is None or {comb[0].split("_")[0], comb[1].split("_")[0]} in pairsets:
+            combos.append(comb)
     elif roota == rootb:
         pass
 
 print(f'{len(combos)} corridors will be created from: ', *combos, sep='\n  ')
 
-# Step 4: run corridor analysis; corridors function also has inbuilt check for if the two raster roots are the same so no useless corridors are created
+# Step 4: run corridor analysis; corridors_batch function also has inbuilt check for if the two raster roots are the same so no useless corridors are created
+# All corridors of one cost surface are created by a few r.mapcalc runs of up to 'batchsize' corridors each.
+# Use corridors(comb[0], comb[1], catalog=catalog) of def_corridors.py in a loop over combos to create them one by one instead.
+batchsize = 20 # HERE USER INPUT more corridors per r.mapcalc run means fewer passes over the data but more memory
+# With fused = True only the 10% corridors are created, directly from the cost dist raster (see corridor_perc) and tenperc is skipped.
+fused = False # HERE USER INPUT
+# With tiled = True (and fused = True) the cost dist raster are streamed in blocks of rows instead of being read into memory,
+# so memory does not depend on the raster size and several pairs can run at the same time (see def_tiled.py).
+tiled = False # HERE USER INPUT
+nprocs_corr = 4 # HERE USER INPUT number of pairs at the same time with tiled = True
+# With bidir = True (and fused = True) the 10% corridors are created directly from the cost surfaces by a search from
+# both sites that stops at the percentile (see def_bidir.py); the cost dist raster are not read. Not used with tiled = True.
+bidir = False # HERE USER INPUT
+# With multires = True (and fused = True) the 10% corridors are calculated on a cost surface coarsened by 'factor' first
+# and refined at the native resolution only within a band around the coarse corridor (see def_multires.py).
+# compare_full = True also runs the full resolution and prints the differences. Not used with tiled or bidir = True.
+multires = False # HERE USER INPUT
+factor = 10 # HERE USER INPUT number of native cells per coarse cell side
+compare_full = False # HERE USER INPUT
+# With crop = True each corridor only covers the cells reached from both sites (use with max_cost). Not used with tiled = True.
+crop = max_cost is not None # HERE USER INPUT
 begin_time = datetime.datetime.now()
 print(f'Corridor calculation starts now: {begin_time}')
-for i, comb in enumerate(combos):
-    corridors(comb[0], comb[1])
+begin('corridors')
+if fused and tiled:
+    corridors_tiled(combos, percentile=10, keep_full=False, nprocs=nprocs_corr, catalog=catalog, manifest=manifest,
+                    precision=precision, windows=windows)
+elif fused and bidir:
+    for raster in costsurfs:
+        corridors_bidir(raster, cststarts, percentile=10, catalog=catalog, manifest=manifest, precision=precision)
+elif fused and multires:
+    for raster in costsurfs:
+        corridors_multires(raster, cststarts, percentile=10, factor=factor, compare=compare_full, catalog=catalog,
+                           manifest=manifest, precision=precision)
+elif fused:
+    for comb in combos:
+        corridor_perc(comb[0], comb[1], percentile=10, keep_full=False, catalog=catalog, manifest=manifest,
+                      windows=windows, crop=crop, precision=precision)
+else:
+    corridors_batch(combos, batchsize=batchsize, catalog=catalog, manifest=manifest, windows=windows, crop=crop,
+                    precision=precision)
+end()
 runtime_corr = (datetime.datetime.now() - begin_time).total_seconds()
 print(f'The runtime to calculate all corridors is {runtime_corr} seconds.\n')
 
@@ -141,7 +257,10 @@ corridors = gs.list_strings(type='raster',
 # Step 2: get all 10% value corridors to reduce file size
 begin_time = datetime.datetime.now()
 print(f'10%-corridor calculation starts now: {begin_time}')
-tenperc(corridors)
+begin('tenperc')
+if not fused:
+    tenperc(corridors, catalog=catalog, manifest=manifest, precision=precision, runner=runner)
+end()
 runtime_tenperc = (datetime.datetime.now() - begin_time).total_seconds()
 print(f'The runtime to calculate all ten percentile corridors is {runtime_tenperc} seconds.\n')
 
@@ -160,9 +279,11 @@ files = gs.list_strings(type='raster', # Only list raster files
 percs = list(range(0,99))
 filepath = '/export/home/fkj22/rcostconvol/out'
 
-# This is where the action happens
-for rast in files:
-    quantrecode(rast,percs,filepath)
+# This is where the action happens; one r.quantile and one r.recode run per raster (see def_quantrecode.py)
+nprocs_recode = 4 # HERE USER INPUT number of rasters recoded at the same time
+begin('quantrecode')
+quantrecode_batch(files, percs, filepath, nprocs=nprocs_recode, catalog=catalog, manifest=manifest)
+end()
 
 # Export all recoded corridors
 exportpattern = 'corridor*recoded*'
@@ -174,6 +295,8 @@ data = gs.list_strings(type='raster', # Only list raster files
                        exclude=excludepattern,
                        mapset='PERMANENT') # Specify the mapset in which to search for the files to be listed.
 
+# number of exports at the same time; use driver='COG' and compress='ZSTD' etc. in routgdal for other formats
+nprocs_out = 4 # HERE USER INPUT
 outtype = 'Byte'
 # choose from: Byte, Int16, UInt16, Int32, UInt32, Float32, Float64, CInt16, CInt32, CFloat32, CFloat64
 
@@ -181,7 +304,9 @@ outtype = 'Byte'
 outloc = '/export/home/fkj22/rcostconvol/out'
 
 begin_time = datetime.datetime.now()
-routgdal(data, outtype, outloc)
+begin(f'routgdal_{outtype}')
+routgdal(data, outtype, outloc, catalog=catalog, nprocs=nprocs_out, manifest=manifest, runner=runner)
+end()
 runtime_outgdal = (datetime.datetime.now() - begin_time).total_seconds()
 print(f'It took {runtime_outgdal} seconds to export all files of pattern {filepattern}.\n')
 
@@ -193,16 +318,13 @@ for rast in data:
     substring = rast.split("@")[0]
     cleanraster.append(substring)
 
-# If they are exported then remove them from GRASS.
+# If they are exported then remove them from GRASS. List the output location only once.
+# The manifest keeps their records, so a rerun does not recode them again while the exported files exist.
+exported = os.listdir(outloc)
 for raster in cleanraster:
-    if any(raster in file for file in os.listdir(outloc)):
+    if any(raster in file for file in exported):
         print(f'YEY, {raster} exits and will be removed from GRASS')
-        gs.run_command('g.remove',
-                       type='raster',
-                       pattern=raster,
-                       exclude='',
-                       flags='f'
-                       )
+        manifest.release(raster, f'{outloc}/{raster}_{outtype}.tif', catalog=catalog)
     else:
         print(f'NEY, {raster} does not exist. Check what happened.')
         pass
@@ -221,12 +343,18 @@ data = gs.list_strings(type='raster', # Only list raster files
 
 outtype = 'Float32'
 # choose from: Byte, Int16, UInt16, Int32, UInt32, Float32, Float64, CInt16, CInt32, CFloat32, CFloat64
+# With sparse = True tiles holding only NULL cells are not written, so each file is about the size of its corridor,
+# and the exported corridors are joined into a network file (needs GDAL). The join needs all corridors on the same
+# grid, so it is skipped for corridors cropped by buffer or max_cost.
+sparse = False # HERE USER INPUT
 
 # output location
 outloc = '/export/home/fkj22/rcostconvol/out'
 
 begin_time = datetime.datetime.now()
-routgdal(data, outtype, outloc)
+begin(f'routgdal_{outtype}')
+routgdal(data, outtype, outloc, catalog=catalog, nprocs=nprocs_out, manifest=manifest, sparse=sparse, runner=runner)
+end()
 runtime_outgdal = (datetime.datetime.now() - begin_time).total_seconds()
 print(f'It took {runtime_outgdal} seconds to export all files of pattern {filepattern}.\n')
 
@@ -238,9 +366,21 @@ for rast in data:
     substring = rast.split("@")[0]
     cleanraster.append(substring)
 
-# If they are exported then remove them from GRASS.
+# Join the exported 10% corridors into the network, reading only the tiles that hold data (see def_sparse.py).
+if sparse and (windows is not None or crop):
+    print('The corridors are cropped to different extents and are not joined from the sparse files.')
+elif sparse:
+    # GDAL is only needed for the sparse join
+    from def_sparse import network_join_sparse
+    begin('network_join_sparse')
+    network_join_sparse([f'{outloc}/{raster}_{outtype}.tif' for raster in cleanraster],
+                        f'{outloc}/network_slope_{envfact}_Int16.tif')
+    end()
+
+# If they are exported then remove them from GRASS. List the output location only once.
+exported = os.listdir(outloc)
 for raster in cleanraster:
-    if any(raster in file for file in os.listdir(outloc)):
+    if any(raster in file for file in exported):
         print(f'YEY, {raster} exits and will be removed from GRASS')
         gs.run_command('g.remove',
                        type='raster',
@@ -278,7 +418,9 @@ print(rcostpoint)
 outdirectory = '/export/home/fkj22/rcostconvol/out'
 
 # run your lcp function
-lcp(list_costsurf, rcostpoint, cststart, outdirectory)
+begin('lcp')
+lcp(list_costsurf, rcostpoint, cststart, outdirectory, catalog=catalog, manifest=manifest, runner=runner)
+end()
 
 
 
@@ -286,4 +428,11 @@ lcp(list_costsurf, rcostpoint, cststart, outdirectory)
 # _____________CLEAN UP AFTER YOURSELF_____________
 runtime_whole = (datetime.datetime.now() - begin_time_whole).total_seconds()
 print(f'The whole process for {len(costsurfs)} cost surfaces takes {runtime_whole} seconds.\n')
+if tracer is not None:
+    tracer.chrome(f'{tracelog}.json') # open in chrome://tracing or https://ui.perfetto.dev
+    tracer.summary()
+precision.summary()
+manifest.flush()
+if runner is not None:
+    runner.close()
 gsetup.finish()
\ No newline at end of file
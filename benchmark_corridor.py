@@ -0,0 +1,303 @@
+'''
+Reproducible benchmark of the corridor pipeline.
+Synthetic cost surfaces and sites are generated from a fixed seed for every combination of surface size and number
+of sites, and each stage of the pipeline is timed: ringdal, costdist, corridors, tenperc, the network join,
+routgdal and lcp. Where GDAL writes real GeoTIFFs (not on the stand-in), the sparse export and network_join_sparse()
+are timed as well and their network is checked against that of network_join().
+Backends (--backends, see def_backend.py):
+ - standin: GRASS module calls answered by the GRASS-free stand-in (def_standin.py), runs on any machine with NumPy;
+ - array: the in-process ArrayBackend, chained stages stay in memory (reads .npz files if GRASS is not installed);
+ - grass: GRASS modules, run inside a GRASS session (needs GDAL to write the synthetic tifs).
+
+Every run appends one JSON line per stage to the results file, with the commit, backend, engine, size and number
+of sites, so that runs of different commits can be compared:
+
+    python benchmark_corridor.py --sizes 100 200 --sites 3 6 --out bench.jsonl
+    python benchmark_corridor.py --sizes 100 200 --sites 3 6 --out bench_new.jsonl --compare bench.jsonl
+    python benchmark_corridor.py --backends standin array --compare bench.jsonl
+'''
+
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from itertools import combinations
+import numpy as np
+
+STAGES = ['ringdal', 'costdist', 'corridors', 'tenperc', 'network', 'routgdal', 'sparse', 'lcp']
+
+
+# _____________SYNTHETIC DATA_____________
+def synthetic_surface(size, seed=0, res=100.0):
+    '''
+    Creates a square cost surface: a smooth random field of positive costs with a few null (water) patches.
+    :param size: Number of rows and columns.
+    :param seed: Seed of the random generator.
+    :param res: Resolution in map units.
+    :return: Tuple (array, region); region is a dictionary with n, s, e, w, nsres and ewres.
+    '''
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[0:size, 0:size] / size
+    cost = np.ones((size, size))
+    # Sum of random waves: hills and valleys at several scales.
+    for scale in (1, 2, 4, 8):
+        for _ in range(3):
+            ky, kx = rng.normal(0, scale * np.pi, 2)
+            cost += rng.uniform(0.5, 1.0) / scale * (1 + np.cos(ky * rows + kx * cols + rng.uniform(0, 2 * np.pi)))
+    cost += rng.uniform(0, 0.1, (size, size))
+    # Lakes
+    for _ in range(3):
+        cy, cx = rng.uniform(0.1, 0.9, 2)
+        radius = rng.uniform(0.02, 0.06)
+        cost[(rows - cy) ** 2 + (cols - cx) ** 2 < radius ** 2] = np.nan
+    region = {'n': size * res, 's': 0.0, 'e': size * res, 'w': 0.0, 'nsres': res, 'ewres': res}
+    return cost, region
+
+
+def synthetic_sites(cost, region, nsites, seed=0):
+    '''
+    Picks sites at random cells that are not null.
+    :param cost: Cost surface as returned by synthetic_surface().
+    :param region: Region as returned by synthetic_surface().
+    :param nsites: Number of sites.
+    :param seed: Seed of the random generator.
+    :return: List of sites of pattern [x, y, sid], coordinates of the cell centres, sid from 1.
+    '''
+    rng = np.random.default_rng(seed + 1)
+    valid = np.flatnonzero(~np.isnan(cost))
+    cells = rng.choice(valid, size=nsites, replace=False)
+    sites = []
+    for sid, cell in enumerate(cells, start=1):
+        row, col = divmod(int(cell), cost.shape[1])
+        sites.append([str(region['w'] + (col + 0.5) * region['ewres']),
+                      str(region['n'] - (row + 0.5) * region['nsres']),
+                      str(sid)])
+    return sites
+
+
+def write_tif(path, cost, region):
+    '''
+    Writes a cost surface as GeoTIFF, for runs in a GRASS session.
+    :return: None
+    '''
+    from osgeo import gdal
+    ds = gdal.GetDriverByName('GTiff').Create(path, cost.shape[1], cost.shape[0], 1, gdal.GDT_Float32)
+    ds.SetGeoTransform((region['w'], region['ewres'], 0, region['n'], 0, -region['nsres']))
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(-9999)
+    band.WriteArray(np.where(np.isnan(cost), -9999, cost))
+    ds = None
+
+
+# _____________RUN_____________
+def sparse_check(percs, network, outloc, catalog, backend):
+    '''
+    Exports the corridors as sparse GeoTIFFs, joins them with network_join_sparse() and compares the result with the
+    network raster created by network_join(). Values may differ by 1 (rounding of the Float32 export).
+    :param percs: List of the thresholded corridors.
+    :param network: Name of the network raster of network_join().
+    :param outloc: Directory for the sparse files.
+    :param catalog: RasterCatalog of the run.
+    :param backend: Backend of the run, None for GRASS module calls.
+    :return: None. Raises ValueError if the networks differ.
+    '''
+    from osgeo import gdal
+    from def_backend import GrassBackend
+    from def_routgdal import routgdal
+    from def_sparse import network_join_sparse
+
+    routgdal(percs, 'Float32', outloc, catalog=catalog, backend=backend, sparse=True)
+    joined = os.path.join(outloc, 'network_sparse_Int16.tif')
+    network_join_sparse([os.path.join(outloc, f'{p.split("@")[0]}_Float32.tif') for p in percs], joined)
+
+    ds = gdal.Open(joined)
+    values = ds.GetRasterBand(1).ReadAsArray().astype(np.float64)
+    values[values == ds.GetRasterBand(1).GetNoDataValue()] = np.nan
+    ds = None
+    if backend is None:
+        backend = GrassBackend()
+    backend.region(network)
+    expected = backend.read(network)
+    if (np.isnan(values) != np.isnan(expected)).any() or np.nanmax(np.abs(values - expected)) > 1:
+        raise ValueError(f'The network of network_join_sparse() differs from {network}.')
+
+
+def run(size, nsites, engine, workdir, backend, standin, seed=0):
+    '''
+    Runs the pipeline once on a synthetic cost surface and times each stage.
+    :param size: Number of rows and columns of the cost surface.
+    :param nsites: Number of sites.
+    :param engine: Engine of costdist(), 'rcost' or 'numpy'.
+    :param workdir: Directory for the input tif and the exported files.
+    :param backend: Backend passed to the stages, None for GRASS module calls.
+    :param standin: True if grass.script is the stand-in (def_standin.py), the input is written as .npz then.
+    :param seed: Seed of the synthetic data.
+    :return: Dictionary {stage: seconds}.
+    '''
+    import grass.script as gs
+    from def_backend import GrassBackend
+    from def_catalog import RasterCatalog
+    from def_ringdal import ringdal
+    from def_rcost_run import costdist
+    from def_corridors import corridors_batch, tenperc
+    from def_network import network_join
+    from def_routgdal import routgdal
+    from def_lcp import lcp
+
+    namestring = f'bench{size}'
+    surface = f'costsurf_{namestring}'
+    folder = os.path.join(workdir, 'in')
+    outloc = os.path.join(workdir, 'out')
+    os.makedirs(folder)
+    os.makedirs(outloc)
+
+    cost, region = synthetic_surface(size, seed)
+    sites = synthetic_sites(cost, region, nsites, seed)
+    if standin:
+        import def_standin
+        def_standin.save(os.path.join(folder, f'{surface}.tif'), cost, region)
+    else:
+        write_tif(os.path.join(folder, f'{surface}.tif'), cost, region)
+
+    times = {}
+
+    def timed(stage, func, *args, **kwargs):
+        begin = time.perf_counter()
+        result = func(*args, **kwargs)
+        times[stage] = time.perf_counter() - begin
+        return result
+
+    catalog = RasterCatalog(backend=backend)
+    timed('ringdal', ringdal, folder, namestring, catalog=catalog, backend=backend)
+    timed('costdist', costdist, [f'{surface}@PERMANENT'], sites, engine=engine, catalog=catalog, backend=backend)
+    costdists = [f'{sid}_costdist_{namestring}@PERMANENT' for x, y, sid in sites]
+    timed('corridors', corridors_batch, list(combinations(costdists, 2)), catalog=catalog, backend=backend)
+    corridorlist = [c for c in catalog if c.startswith('corridor_')]
+    timed('tenperc', tenperc, corridorlist, catalog=catalog, backend=backend)
+    percs = [f'{c}_10perc' for c in corridorlist]
+    timed('network', network_join, percs, f'network_{namestring}', backend=backend)
+    timed('routgdal', routgdal, percs, 'Float32', outloc, catalog=catalog, backend=backend)
+    # The sparse join reads GeoTIFFs through GDAL; the stand-in writes .npz files.
+    gdal = importlib.util.find_spec('osgeo') is not None
+    if gdal and not standin:
+        sparseloc = os.path.join(workdir, 'sparse')
+        os.makedirs(sparseloc)
+        timed('sparse', sparse_check, percs, f'network_{namestring}', sparseloc, catalog, backend)
+    else:
+        times['sparse'] = None
+    gpkg = gdal and not standin
+    timed('lcp', lcp, [surface], [sid for x, y, sid in sites], sites, outloc, catalog=catalog, gpkg=gpkg,
+          backend=backend)
+
+    # Remove the rasters and vectors of the run
+    if backend is None or isinstance(backend, GrassBackend):
+        for element in ('raster', 'vector'):
+            gs.run_command('g.remove', type=element, pattern=f'*{namestring}*', flags='f')
+    return times
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+# _____________COMPARE_____________
+def medians(records):
+    groups = {}
+    for r in records:
+        if r['seconds'] is None:
+            continue
+        groups.setdefault((r['backend'], r['engine'], r['size'], r['sites'], r['stage']), []).append(r['seconds'])
+    return {key: statistics.median(values) for key, values in groups.items()}
+
+
+def compare(base, new):
+    '''
+    Prints the median time per stage of two sets of results and their ratio (new / base).
+    :param base: List of result records, e.g. read from the results file of an older commit.
+    :param new: List of result records.
+    :return: None
+    '''
+    old, now = medians(base), medians(new)
+    print(f'{"backend":<8} {"engine":<6} {"size":>6} {"sites":>6} {"stage":<10} {"base [s]":>10} {"new [s]":>10} {"ratio":>7}')
+    for key in sorted(now, key=lambda k: (k[0], k[1], k[2], k[3], STAGES.index(k[4]))):
+        if key in old:
+            ratio = now[key] / old[key] if old[key] else float('nan')
+            print(f'{key[0]:<8} {key[1]:<6} {key[2]:>6} {key[3]:>6} {key[4]:<10} {old[key]:>10.3f} {now[key]:>10.3f} {ratio:>7.2f}')
+
+
+def read_results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the corridor pipeline on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200], help='rows (= columns) of the cost surfaces')
+    parser.add_argument('--sites', type=int, nargs='+', default=[3, 6], help='numbers of sites')
+    parser.add_argument('--engines', nargs='+', default=['numpy'], choices=['rcost', 'numpy'], help='costdist() engines')
+    parser.add_argument('--backends', nargs='+', default=['standin'], choices=['standin', 'array', 'grass'],
+                        help='standin and array run without GRASS, grass needs a GRASS session')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per combination')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='bench_results.jsonl', help='results file, one JSON line per stage and run')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    # Without GRASS everything runs on the stand-in.
+    standin = importlib.util.find_spec('grass') is None
+    if standin:
+        import def_standin
+        def_standin.install()
+    if standin and 'grass' in args.backends:
+        parser.error('GRASS is not available, use --backends standin array')
+    from def_backend import ArrayBackend
+
+    meta = {'run': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine()}
+
+    records = []
+    for name in args.backends:
+        for size in args.sizes:
+            for nsites in args.sites:
+                for engine in args.engines:
+                    for repeat in range(args.repeat):
+                        if standin:
+                            def_standin.reset()
+                        if name == 'array':
+                            backend = def_standin.StandinBackend() if standin else ArrayBackend()
+                        else:
+                            backend = None
+                        with tempfile.TemporaryDirectory() as workdir:
+                            times = run(size, nsites, engine, workdir, backend, standin, args.seed)
+                        for stage in STAGES:
+                            record = dict(meta, backend=name, engine=engine, size=size, cells=size * size,
+                                          sites=nsites, pairs=nsites * (nsites - 1) // 2, repeat=repeat,
+                                          stage=stage, seconds=times[stage])
+                            records.append(record)
+                        print(f'{name}, size {size}, {nsites} sites, {engine}: ' +
+                              ', '.join(f'{stage} {times[stage]:.3f}s' if times[stage] is not None else
+                                        f'{stage} skipped' for stage in STAGES))
+
+    with open(args.out, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    print(f'{len(records)} results written to {args.out}')
+
+    if args.compare:
+        compare(read_results(args.compare), records)
+
+
+if __name__ == '__main__':
+    main()
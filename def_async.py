@@ -0,0 +1,245 @@
+'''
+Asynchronous runner for GRASS modules.
+The stages of the pipeline run GRASS modules one after the other (gs.run_command, p.communicate()), so a module
+that waits for the disk (r.out.gdal) and one that keeps a core busy (r.path, r.quantile) take turns. A ModuleRunner
+starts the module calls as subprocesses of an asyncio event loop in a background thread:
+ - at most 'limit' modules run at the same time, further calls wait for a free slot;
+ - stdout and stderr of every call are read line by line while it runs and printed with the name of the module;
+ - a call that fails is started again up to 'retries' times, after 'delay' seconds (doubled every time);
+ - cancelling a call (Future.cancel(), or cancel() for all of them) terminates its process.
+submit() can be called from the (synchronous) pipeline and returns a concurrent.futures.Future of the result, so a
+stage can start all its module calls first and wait for them where it needs the results. tenperc(), routgdal() and
+lcp() take an optional runner.
+
+Every call needs its own region, e.g. env=backend.region_env(raster) (GRASS_REGION), as calls running at the same
+time must not change the region of the mapset.
+
+Usage:
+    runner = ModuleRunner(limit=4, retries=1)
+    future = runner.submit('r.quantile', input=rast, percentiles=10, env=backend.region_env(rast))
+    stdout, stderr = future.result()
+    runner.close()
+'''
+
+import asyncio
+import os
+import signal
+import threading
+import time
+from concurrent.futures import wait, FIRST_EXCEPTION
+
+# grass.script is only needed to build the command lines
+try:
+    import grass.script as gs
+except ImportError:
+    gs = None
+
+
+class ModuleError(Exception):
+    '''
+    A GRASS module call that failed, after all retries.
+    '''
+
+    def __init__(self, module, returncode, stderr):
+        super().__init__(f'{module} failed with exit code {returncode}:\n{stderr}')
+        self.module = module
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class ModuleRunner:
+    '''
+    Runs GRASS module calls concurrently in a background event loop.
+    :param limit: Number of module calls running at the same time.
+    :param retries: Number of times a failed call is started again.
+    :param delay: Seconds to wait before the first retry, doubled for each further one.
+    :param stream: Print stdout and stderr of the calls line by line while they run.
+    :param tracer: Optional Tracer (see def_trace.py) the calls are recorded by, as the calls through grass.script.
+    CPU time and peak memory are not recorded.
+    '''
+
+    def __init__(self, limit=4, retries=0, delay=1.0, stream=True, tracer=None):
+        self.limit = limit
+        self.retries = retries
+        self.delay = delay
+        self.stream = stream
+        self.tracer = tracer
+        self.loop = None
+        self.thread = None
+        self.semaphore = None
+        # Futures of all calls not finished yet, for cancel().
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    # _____________EVENT LOOP_____________
+    def start(self):
+        '''
+        Starts the event loop in a background thread, if not running yet.
+        :return: The event loop.
+        '''
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name='ModuleRunner', daemon=True)
+                self.thread.start()
+        return self.loop
+
+    def close(self):
+        '''
+        Cancels all calls not finished yet and stops the event loop.
+        :return: None
+        '''
+        if self.loop is None:
+            return
+        self.cancel()
+        # Wait until the cancelled modules are terminated.
+        asyncio.run_coroutine_threadsafe(self.drain(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.thread = None
+        self.semaphore = None
+
+    async def drain(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # _____________MODULE CALLS_____________
+    async def read(self, stream, label, lines):
+        # Collects (and prints) the output of a call line by line, while the module runs.
+        async for line in stream:
+            text = line.decode('UTF-8', errors='replace').rstrip('\n')
+            lines.append(text)
+            if self.stream:
+                print(f'[{label}] {text}')
+
+    async def run(self, module, flags='', overwrite=False, env=None, stdin=None, retries=None, **options):
+        '''
+        Runs one module call, waiting for a free slot first.
+        :param module: Name of the module, e.g. 'r.quantile'.
+        :param flags: Flags of the module.
+        :param overwrite: Overwrite existing outputs (--overwrite).
+        :param env: Optional environment, e.g. from backend.region_env().
+        :param stdin: Optional text written to the standard input of the module.
+        :param retries: Number of retries of this call, default that of the runner.
+        :param options: Options of the module, as for gs.run_command().
+        :return: Tuple (stdout, stderr) of the last run, as text.
+        '''
+        if self.semaphore is None:
+            # Created here, in the thread of the event loop.
+            self.semaphore = asyncio.Semaphore(self.limit)
+        if retries is None:
+            retries = self.retries
+        command = gs.make_command(module, flags=flags, overwrite=overwrite, **options)
+        label = module
+
+        for attempt in range(retries + 1):
+            async with self.semaphore:
+                process = await asyncio.create_subprocess_exec(*command,
+                                                               stdin=asyncio.subprocess.PIPE if stdin else None,
+                                                               stdout=asyncio.subprocess.PIPE,
+                                                               stderr=asyncio.subprocess.PIPE,
+                                                               env=env,
+                                                               # Own process group, see stop().
+                                                               start_new_session=True)
+                begin = time.time()
+                stdout, stderr = [], []
+                try:
+                    if stdin:
+                        process.stdin.write(stdin.encode('UTF-8'))
+                        await process.stdin.drain()
+                        process.stdin.close()
+                    await asyncio.gather(self.read(process.stdout, label, stdout),
+                                         self.read(process.stderr, label, stderr))
+                    returncode = await process.wait()
+                except asyncio.CancelledError:
+                    # Do not leave the module running.
+                    await self.stop(process)
+                    print(f'[{label}] cancelled')
+                    raise
+            if self.tracer is not None:
+                self.trace(command, env, begin, process, returncode)
+            if returncode == 0:
+                return '\n'.join(stdout), '\n'.join(stderr)
+            if attempt < retries:
+                wait_s = self.delay * 2 ** attempt
+                print(f'[{label}] failed with exit code {returncode}, retry {attempt + 1} of {retries} in {wait_s} s')
+                await asyncio.sleep(wait_s)
+        raise ModuleError(module, returncode, '\n'.join(stderr))
+
+    def trace(self, command, env, begin, process, returncode):
+        # Same fields as the records of Tracer.install(); the process id separates calls running at the same time.
+        from def_trace import region_cells
+        self.tracer.write({'type': 'module',
+                           'module': command[0],
+                           'params': [str(a) for a in command[1:]],
+                           'stage': self.tracer.current_stage(),
+                           'cells': region_cells(env),
+                           'begin': begin,
+                           'thread': process.pid,
+                           'wall': time.time() - begin,
+                           'returncode': returncode})
+
+    async def stop(self, process):
+        '''
+        Terminates a module together with the processes it started (GRASS modules written in Python run further
+        modules), killing them if they do not end within 5 seconds.
+        '''
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(process.pid, sig)
+            except ProcessLookupError:
+                break
+            try:
+                await asyncio.wait_for(process.wait(), timeout=5)
+                break
+            except asyncio.TimeoutError:
+                continue
+
+    def submit(self, module, **kwargs):
+        '''
+        Starts a module call from synchronous code, see run().
+        :return: concurrent.futures.Future of (stdout, stderr). Future.cancel() terminates the module.
+        '''
+        future = asyncio.run_coroutine_threadsafe(self.run(module, **kwargs), self.start())
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def map(self, calls):
+        '''
+        Runs many module calls and waits for all of them. If one fails, the others are cancelled.
+        :param calls: List of (module, dictionary of keyword arguments of run()) tuples.
+        :return: List of (stdout, stderr), in the order of calls.
+        '''
+        futures = [self.submit(module, **kwargs) for module, kwargs in calls]
+        finished, running = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = [future for future in futures if future in finished and future.exception() is not None]
+        if failed:
+            for future in running:
+                future.cancel()
+            raise failed[0].exception()
+        return [future.result() for future in futures]
+
+    def cancel(self):
+        '''
+        Cancels all calls not finished yet, terminating their modules.
+        :return: Number of calls cancelled.
+        '''
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+        return len(pending)
@@ -0,0 +1,870 @@
+'''
+Backends for the operations of the corridor pipeline.
+All functions of the pipeline take an optional backend. The operations they need (list, exists, region, import,
+mapcalc expressions, quantile, univar, cost, path, export, ...) are methods with the same names and arguments on
+both backends:
+ - GrassBackend (the default) runs GRASS modules in the current mapset, as the functions always did.
+ - ArrayBackend keeps rasters as NumPy arrays in the Python process, runs cost distance with the NumPy engine of
+   def_rcost_numpy.py, translates r.mapcalc expressions to NumPy and reads and writes files through GDAL.
+   Chained steps such as corridor -> threshold -> export stay in memory, without starting a module and writing a
+   raster to the GRASS database at every step. All rasters have to be on the same grid (no resampling) and have to
+   fit into memory.
+
+Usage:
+    backend = ArrayBackend()
+    catalog = RasterCatalog(backend=backend)
+    ringdal(folder, envfact, catalog=catalog, backend=backend)
+    costdist(costsurfaces, cststart, catalog=catalog, backend=backend)
+
+The manifest (def_manifest.py), the tracer (def_trace.py) and the parallel r.cost runs (def_rcost_parallel.py)
+work with GRASS only.
+'''
+
+import fnmatch
+import functools
+import re
+import numpy as np
+from def_rcost_numpy import accumulate, coord_to_cell, moves
+from def_region import region_dict, region_env, region_string, window_params
+
+# grass.script is only needed by GrassBackend
+try:
+    import grass.script as gs
+    from grass.script import core as gscore
+    from grass.script import array as garray
+except ImportError:
+    gs = None
+
+
+def base(name):
+    return str(name).split('@')[0]
+
+
+def as_list(value):
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return str(value).split(',')
+
+
+def parse_quantiles(stdout):
+    '''
+    :return: List of the values printed by r.quantile, lines of pattern [number]:[percentile]:[value].
+    '''
+    values = []
+    for line in stdout.splitlines():
+        if line.strip():
+            val1, val2, value = line.split(':')
+            values.append(float(value))
+    return values
+
+
+# _____________GRASS_____________
+class GrassBackend:
+    '''
+    Runs the operations as GRASS modules in the current mapset.
+    The region set by region() is passed to the module calls through GRASS_REGION (see def_region.py), the region of
+    the mapset is not changed. Backends of stages running at the same time therefore each keep their own region.
+    '''
+
+    def __init__(self):
+        # Environment of the module calls, None for the region of the mapset until region() is called.
+        self.env = None
+
+    # _____________RASTERS_____________
+    def list(self, pattern=None, exclude=None, mapset='PERMANENT'):
+        '''
+        :return: List of raster names without '@MAPSET'.
+        '''
+        kwargs = {'pattern': pattern} if pattern else {}
+        if exclude:
+            kwargs['exclude'] = exclude
+        return [base(rast) for rast in gs.list_strings(type='raster', mapset=mapset, **kwargs)]
+
+    def exists(self, name, element='raster'):
+        return bool(gs.find_file(name=name, element='cell' if element == 'raster' else element)['file'])
+
+    def remove(self, names, element='raster'):
+        gs.run_command('g.remove',
+                       type=element,
+                       name=names,
+                       flags='f'
+                       )
+
+    def import_raster(self, path, name, mode='copy', flags=''):
+        '''
+        Reads a raster file using r.in.gdal (mode='copy') or registers it using r.external (mode='link').
+        '''
+        if mode == 'link':
+            gs.run_command('r.external',
+                           input=path,
+                           output=name,
+                           flags=flags
+                           )
+        else:
+            gs.run_command('r.in.gdal',
+                           input=path,
+                           output=name,
+                           flags=flags,
+                           memory=1000
+                           )
+
+    def export(self, name, path, datatype, driver='GTiff', createopt='', nodata=0, env=None):
+        gs.run_command('r.out.gdal', env=env or self.env, **self.export_options(name, path, datatype, driver, createopt, nodata))
+
+    def export_options(self, name, path, datatype, driver='GTiff', createopt='', nodata=0):
+        '''
+        :return: Options of r.out.gdal for export(), also for running it through a ModuleRunner (see def_async.py).
+        '''
+        return {'input': name,
+                'output': path,
+                'createopt': createopt,
+                'format': driver,
+                'type': datatype,
+                'nodata': nodata,
+                'flags': 'f'}  # Force the output to the chosen datatype.
+
+    def read(self, name):
+        '''
+        :return: Raster of the current region as 2D float array, NaN for NULL cells.
+        '''
+        return np.asarray(garray.array(name, null=np.nan, env=self.env), dtype=np.float64)
+
+    def write(self, name, array, overwrite=False, mtype='DCELL'):
+        '''
+        :param array: 2D array of the size of the region, NaN for NULL cells.
+        :param mtype: Type of the raster; 'DCELL', 'FCELL' or 'CELL' (values are rounded, see def_precision.py).
+        '''
+        if mtype == 'CELL':
+            null = -2147483648
+            out = garray.array(dtype=np.int32, env=self.env)
+            out[...] = np.where(np.isnan(array), null, np.round(array))
+            out.write(mapname=name, null=null, overwrite=overwrite)
+            return
+        out = garray.array(dtype=np.float32 if mtype == 'FCELL' else np.float64, env=self.env)
+        out[...] = array
+        out.write(mapname=name, overwrite=overwrite)
+
+    def rename(self, name, new):
+        gs.run_command('g.rename', raster=(name, new))
+
+    # _____________REGION_____________
+    def region(self, rasters=None, flags='', window=None, zoom=None):
+        '''
+        Sets the computational region of the following module calls of the backend to the given raster(s).
+        The region strings are cached per raster (see def_region.py), so g.region is run only once per raster.
+        :param flags: 'p' prints the region.
+        :param window: Optional dictionary with n, s, e and w (see def_windows.py); the region is clipped to it and
+        aligned to the grid of the first raster.
+        :param zoom: Optional list of raster the region is zoomed to one after the other (g.region zoom=).
+        :return: The region as dictionary.
+        '''
+        if rasters is not None:
+            env = region_env(raster=rasters)
+            if window is not None:
+                env = region_env(env=env, **window_params(as_list(rasters)[0], window))
+            for rast in zoom or []:
+                env = region_env(env=env, zoom=rast)
+            self.env = env
+        if self.env is None:
+            return gs.region()
+        region = region_dict(self.env['GRASS_REGION'])
+        if 'p' in flags:
+            print('\n'.join(f'{key}: {value}' for key, value in region.items()))
+        return region
+
+    def region_env(self, raster):
+        '''
+        Environment to run a single module call in the region of a raster, without changing the region of the mapset
+        or of the backend.
+        '''
+        return region_env(raster=raster)
+
+    def extend_region(self, rasters):
+        '''
+        Extends the current region to the extent of the given raster, the same as the -e flag of r.in.gdal does for a
+        single raster. Updates the default region if used in PERMANENT mapset. The only operation that changes the
+        region of the mapset (WIND file).
+        '''
+        old = gs.region()
+        new = region_dict(region_string(raster=rasters))
+        flags = 's' if gs.gisenv()['MAPSET'] == 'PERMANENT' else ''
+        gs.run_command('g.region',
+                       n=max(old['n'], new['n']),
+                       s=min(old['s'], new['s']),
+                       e=max(old['e'], new['e']),
+                       w=min(old['w'], new['w']),
+                       nsres=old['nsres'],
+                       ewres=old['ewres'],
+                       flags=flags
+                       )
+
+    # _____________STATISTICS_____________
+    def info(self, name):
+        '''
+        :return: Dictionary as returned by r.info, incl. 'min' and 'max' stored with the raster.
+        '''
+        return gs.raster_info(name)
+
+    def univar(self, name):
+        return {key: float(value)
+                for key, value in gs.parse_command('r.univar', map=name, flags='g', env=self.env).items()}
+
+    def quantile(self, name, percentiles, env=None):
+        '''
+        All percentiles are taken by one r.quantile run.
+        :param percentiles: List of percentiles, or a single one.
+        :param env: Optional environment, e.g. from region_env(). Default the region set by region().
+        :return: List of values, one per percentile.
+        '''
+        p = gscore.pipe_command('r.quantile',
+                                input=name,
+                                percentiles=percentiles,
+                                env=env or self.env)
+        values = parse_quantiles(p.stdout.read().decode('UTF-8'))
+        p.wait()
+        return values
+
+    # _____________MAP ALGEBRA_____________
+    def mapcalc(self, expressions):
+        '''
+        Runs r.mapcalc expressions of pattern '[output] = [expression]'. Several expressions are run by a single
+        r.mapcalc, which reads every input row only once.
+        :param expressions: An expression, or a list of them.
+        '''
+        if isinstance(expressions, str):
+            expressions = [expressions]
+        if len(expressions) == 1:
+            gs.mapcalc(expressions[0], env=self.env)
+        else:
+            # Several expressions can be fed to r.mapcalc from stdin, one expression per line.
+            gs.write_command('r.mapcalc',
+                             file='-',
+                             stdin='\n'.join(expressions),
+                             env=self.env
+                             )
+
+    def categories(self, name, labels):
+        '''
+        :param labels: Dictionary {value: label}.
+        '''
+        gs.write_command('r.category',
+                         map=name,
+                         rules='-',
+                         separator=':',
+                         stdin='\n'.join(f'{value}:{label}' for value, label in labels.items())
+                         )
+
+    def recode(self, name, output, rules, env=None):
+        '''
+        Recodes ranges of values into integer classes using r.recode (output CELL).
+        :param rules: List of tuples (low, high, value); low or high None for an open end. A value within several
+        rules gets the value of the last of them, as in r.recode.
+        :param env: Optional environment, e.g. from region_env(). Default the region set by region().
+        '''
+        def bound(value):
+            # repr() keeps all digits of the breakpoints.
+            return '*' if value is None else repr(float(value))
+
+        gs.write_command('r.recode',
+                         input=name,
+                         output=output,
+                         rules='-',
+                         stdin='\n'.join(f'{bound(low)}:{bound(high)}:{value}' for low, high, value in rules),
+                         env=env or self.env
+                         )
+
+    # _____________COST DISTANCE_____________
+    def cost(self, surface, coordinates, outdist, outdir, flags='kn', memory=3000, max_cost=None):
+        options = {'max_cost': max_cost} if max_cost else {}
+        gs.run_command('r.cost',
+                       input=surface,
+                       output=outdist,
+                       start_coordinates=coordinates,
+                       outdir=outdir,
+                       memory=memory,
+                       flags=flags,
+                       env=self.env,
+                       **options
+                       )
+
+    # _____________VECTORS_____________
+    def points(self, name, points):
+        '''
+        Writes points to a vector.
+        :param points: List of (x, y, cat).
+        '''
+        gs.write_command('v.in.ascii',
+                         input='-',
+                         output=name,
+                         format='point',
+                         separator='comma',
+                         x=1,
+                         y=2,
+                         cat=3,
+                         overwrite=True,
+                         stdin='\n'.join(f'{x},{y},{cat}' for x, y, cat in points)
+                         )
+
+    def path(self, movdir, costdist, output, coordinates=None, points=None):
+        '''
+        Traces least cost paths using r.path, from coordinates (x, y) or from all points of a vector.
+        Each path gets the category of the point it was traced from.
+        :return: Tuple (stdout, stderr) of r.path.
+        '''
+        import subprocess
+        p = gs.start_command('r.path',
+                             stderr=subprocess.PIPE,
+                             stdout=subprocess.PIPE,
+                             env=self.env,
+                             **self.path_options(movdir, costdist, output, coordinates, points)
+                             )
+        return p.communicate()
+
+    def path_options(self, movdir, costdist, output, coordinates=None, points=None):
+        '''
+        :return: Options of r.path for path(), also for running it through a ModuleRunner (see def_async.py).
+        '''
+        start = {'start_points': points} if points is not None else {'start_coordinates': coordinates}
+        return {'input': movdir,  # name of input direction raster
+                'format': 'degree',  # of input direction map; options: auto, degree, 45degree, bitmask
+                'values': costdist,  # name of input raster map with cost values
+                'vector_path': output,  # name for output vector path map
+                'overwrite': True,
+                **start}
+
+    def extract(self, vector, cats, output):
+        gs.run_command('v.extract',
+                       input=vector,
+                       cats=cats,
+                       type='line',
+                       output=output,
+                       overwrite=True
+                       )
+
+    def lines(self, vector):
+        '''
+        Reads the lines of a vector using v.out.ascii (standard format).
+        :return: List of tuples (category, [(x, y), ...]). Category is None for lines without category.
+        '''
+        ascii = gs.read_command('v.out.ascii',
+                                input=vector,
+                                type='line',
+                                format='standard'
+                                ).splitlines()
+        # Skip the header, the geometries start after 'VERTI:'.
+        start = next((i for i, line in enumerate(ascii) if line.startswith('VERTI:')), len(ascii))
+        lines = []
+        i = start + 1
+        while i < len(ascii):
+            header = ascii[i].split()
+            i += 1
+            if not header:
+                continue
+            # Pattern: [type] [number of vertices] [number of categories]
+            kind, nverts = header[0], int(header[1])
+            ncats = int(header[2]) if len(header) > 2 else 0
+            coords = [tuple(float(v) for v in ascii[i + n].split()[:2]) for n in range(nverts)]
+            cats = [int(ascii[i + nverts + n].split()[1]) for n in range(ncats)]
+            i += nverts + ncats
+            if kind.upper() == 'L':
+                lines.append((cats[0] if cats else None, coords))
+        return lines
+
+    def what(self, name, points):
+        '''
+        Reads the values of a raster at several points using one r.what run.
+        :param points: List of points of pattern [x, y, sid].
+        :return: Dictionary {sid: value}; value is None for NULL cells.
+        '''
+        coords = [coord for x, y, sid in points for coord in (x, y)]
+        out = gs.read_command('r.what',
+                              map=name,
+                              coordinates=coords,
+                              separator='pipe',
+                              env=self.env
+                              ).splitlines()
+        values = {}
+        # Output pattern: east|north|label|value, in the order of the coordinates
+        for (x, y, sid), line in zip(points, out):
+            value = line.split('|')[-1].strip()
+            values[str(sid)] = None if value in ('*', '') else float(value)
+        return values
+
+    def projection(self):
+        '''
+        :return: Projection of the location as WKT.
+        '''
+        return gs.read_command('g.proj', flags='wf')
+
+
+# _____________NUMPY_____________
+def mc_round(x):
+    # r.mapcalc rounds half away from zero
+    return np.sign(x) * np.floor(np.abs(x) + 0.5)
+
+
+# Types of r.mapcalc values; a result has the highest type of its operands.
+MC_TYPES = ['CELL', 'FCELL', 'DCELL']
+
+# Tokens of r.mapcalc expressions: numbers, names (raster, variables and functions) and operators.
+MC_TOKEN = re.compile(r'\s*(?:(?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)(?![\w@])'
+                      r'|(?P<name>[\w.]+(?:@[\w.]+)?)'
+                      r'|(?P<op>&&&|\|\|\||&&|\|\||==|!=|<=|>=|>>>|<<|>>|[-+*/%^<>!=(),?:~&|]))')
+
+# Binding power of the binary operators, by the precedence of the r.mapcalc manual. Unary -, ! bind tighter.
+MC_BINARY = {'||': 20, '|||': 20, '&&': 30, '&&&': 30, '==': 60, '!=': 60, '<': 70, '>': 70, '<=': 70, '>=': 70,
+             '+': 90, '-': 90, '*': 100, '/': 100, '%': 100, '^': 110}
+MC_UNARY = 120
+
+MC_COMPARE = {'==': np.equal, '!=': np.not_equal, '<': np.less, '>': np.greater, '<=': np.less_equal,
+              '>=': np.greater_equal}
+
+
+def mc_type(*types):
+    return max(types, key=MC_TYPES.index)
+
+
+def mc_value(values, mtype):
+    '''
+    Values as r.mapcalc holds them in a type: FCELL in single precision. NaN for NULL.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    if mtype == 'FCELL':
+        return values.astype(np.float32).astype(np.float64)
+    return values
+
+
+def mc_binary(op, left, right):
+    '''
+    Applies a binary operator of r.mapcalc. NULL in either operand gives NULL, except for &&& (false if either is
+    false) and ||| (true if either is true). Comparisons and logical operators give CELL 1 or 0; division and
+    modulus by zero give NULL; CELL / CELL is an integer division.
+    :param left: Tuple (values, type).
+    :param right: Tuple (values, type).
+    :return: Tuple (values, type).
+    '''
+    (x, tx), (y, ty) = left, right
+    null = np.isnan(x) | np.isnan(y)
+    with np.errstate(all='ignore'):
+        if op in ('&&&', '|||'):
+            true = (~np.isnan(x) & (x != 0)) | (~np.isnan(y) & (y != 0))
+            false = (~np.isnan(x) & (x == 0)) | (~np.isnan(y) & (y == 0))
+            if op == '&&&':
+                return np.where(false, 0.0, np.where(null, np.nan, 1.0)), 'CELL'
+            return np.where(true, 1.0, np.where(null, np.nan, 0.0)), 'CELL'
+        if op in ('&&', '||'):
+            values = ((x != 0) & (y != 0)) if op == '&&' else ((x != 0) | (y != 0))
+            return np.where(null, np.nan, values), 'CELL'
+        if op in MC_COMPARE:
+            return np.where(null, np.nan, MC_COMPARE[op](x, y)), 'CELL'
+
+        mtype = mc_type(tx, ty)
+        if op == '+':
+            values = x + y
+        elif op == '-':
+            values = x - y
+        elif op == '*':
+            values = x * y
+        elif op == '/':
+            values = np.where(y == 0, np.nan, np.trunc(x / y) if mtype == 'CELL' else x / y)
+        elif op == '%':
+            values = np.where(y == 0, np.nan, np.fmod(x, y))
+        else:
+            # A negative integer exponent has no integer result.
+            values = np.where((y < 0) if mtype == 'CELL' else False, np.nan, np.power(x, y))
+    return mc_value(values, mtype), mtype
+
+
+def mc_if(args):
+    '''
+    if() of r.mapcalc: if(x) 1 if x is not 0, else 0; if(x, a) a, else 0; if(x, a, b) a, else b;
+    if(x, a, b, c) a if x > 0, b if x is 0, c if x < 0. NULL if x is NULL.
+    '''
+    x, rest = args[0][0], args[1:]
+    if len(rest) > 3:
+        raise ValueError('if() takes one to four arguments.')
+    if not rest:
+        values, mtype = (x != 0).astype(np.float64), 'CELL'
+    elif len(rest) == 1:
+        values, mtype = np.where(x != 0, rest[0][0], 0.0), rest[0][1]
+    elif len(rest) == 2:
+        values, mtype = np.where(x != 0, rest[0][0], rest[1][0]), mc_type(rest[0][1], rest[1][1])
+    else:
+        values = np.where(x > 0, rest[0][0], np.where(x == 0, rest[1][0], rest[2][0]))
+        mtype = mc_type(*(t for v, t in rest))
+    return mc_value(np.where(np.isnan(x), np.nan, values), mtype), mtype
+
+
+def mc_function(name, args):
+    '''
+    Applies a function of r.mapcalc.
+    :param args: List of tuples (values, type).
+    :return: Tuple (values, type).
+    '''
+    values = [v for v, t in args]
+    types = [t for v, t in args]
+    with np.errstate(all='ignore'):
+        if name == 'if':
+            return mc_if(args)
+        if name == 'null' and not args:
+            return np.float64(np.nan), 'CELL'
+        if name == 'isnull' and len(args) == 1:
+            return np.isnan(values[0]).astype(np.float64), 'CELL'
+        if name in ('nmin', 'nmax') and args:
+            # NULL values are left out
+            return functools.reduce(np.fmin if name == 'nmin' else np.fmax, values), mc_type(*types)
+        if name in ('min', 'max') and args:
+            return functools.reduce(np.minimum if name == 'min' else np.maximum, values), mc_type(*types)
+        if name == 'round' and len(args) == 1:
+            return mc_round(values[0]), 'CELL'
+        if name == 'int' and len(args) == 1:
+            return np.trunc(values[0]), 'CELL'
+        if name == 'float' and len(args) == 1:
+            return mc_value(values[0], 'FCELL'), 'FCELL'
+        if name == 'double' and len(args) == 1:
+            return values[0], 'DCELL'
+        if name == 'abs' and len(args) == 1:
+            return np.abs(values[0]), types[0]
+        if name in ('sqrt', 'exp', 'log') and len(args) == 1:
+            result = getattr(np, name)(values[0])
+            # Results that are not finite (e.g. log(0), sqrt(-1)) are NULL.
+            return np.where(np.isfinite(result), result, np.nan), 'DCELL'
+    raise ValueError(f'{name}() with {len(args)} arguments is not supported by ArrayBackend.')
+
+
+def mc_evaluate(expr, lookup):
+    '''
+    Evaluates the right hand side of a r.mapcalc expression on NumPy arrays, with the NULL handling and result types
+    of r.mapcalc. Supports numbers, raster, the arithmetic, comparison and logical operators (incl. &&& and |||)
+    with their precedence, if(), null(), isnull(), eval() with variables, nmin(), nmax(), min(), max(), round(),
+    int(), float(), double(), abs(), sqrt(), exp() and log(). Bitwise operators and ?: are not supported.
+    :param expr: Expression.
+    :param lookup: Function returning the tuple (values, type) of a raster name; values are a float array with NaN
+    for NULL.
+    :return: Tuple (values, type); type is 'CELL', 'FCELL' or 'DCELL'.
+    '''
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        match = MC_TOKEN.match(expr, pos)
+        if match is None:
+            raise ValueError(f'Cannot read {expr[pos:]!r} of {expr!r}.')
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    tokens.append((None, None))
+    index = [0]
+    # Variables defined within eval()
+    variables = {}
+
+    def peek(offset=0):
+        return tokens[min(index[0] + offset, len(tokens) - 1)]
+
+    def take(text=None):
+        token = peek()
+        if text is not None and token[1] != text:
+            raise ValueError(f'Expected {text!r} instead of {token[1]!r} in {expr!r}.')
+        index[0] += 1
+        return token
+
+    def call(name):
+        take('(')
+        args = []
+        while peek()[1] != ')':
+            if name == 'eval' and peek()[0] == 'name' and peek(1)[1] == '=':
+                variable = take()[1]
+                take('=')
+                variables[variable] = parse()
+                args.append(variables[variable])
+            else:
+                args.append(parse())
+            if peek()[1] != ',':
+                break
+            take(',')
+        take(')')
+        if name == 'eval':
+            return args[-1]
+        return mc_function(name, args)
+
+    def parse(power=0):
+        kind, text = take()
+        if kind == 'number':
+            left = np.float64(text), 'DCELL' if re.search('[.eE]', text) else 'CELL'
+        elif kind == 'name' and peek()[1] == '(':
+            left = call(text)
+        elif kind == 'name':
+            left = variables[text] if text in variables else lookup(base(text))
+        elif text == '(':
+            left = parse()
+            take(')')
+        elif text in ('-', '!'):
+            x, mtype = parse(MC_UNARY)
+            left = (-x, mtype) if text == '-' else (np.where(np.isnan(x), np.nan, x == 0), 'CELL')
+        else:
+            raise ValueError(f'{text!r} in {expr!r} is not supported by ArrayBackend.')
+        while True:
+            kind, text = peek()
+            if kind != 'op' or text in (')', ','):
+                return left
+            if text not in MC_BINARY:
+                raise ValueError(f'{text!r} in {expr!r} is not supported by ArrayBackend.')
+            if MC_BINARY[text] <= power:
+                return left
+            take()
+            # ^ is right associative
+            right = parse(MC_BINARY[text] - 1 if text == '^' else MC_BINARY[text])
+            left = mc_binary(text, left, right)
+
+    result = parse()
+    if peek()[0] is not None:
+        raise ValueError(f'Unexpected {peek()[1]!r} in {expr!r}.')
+    return result
+
+
+# GDAL data types of r.out.gdal type=
+GDAL_TYPES = {'Byte': 1, 'UInt16': 2, 'Int16': 3, 'UInt32': 4, 'Int32': 5, 'Float32': 6, 'Float64': 7}
+
+
+class ArrayBackend:
+    '''
+    Keeps rasters as NumPy arrays (NaN for NULL cells) and vectors as lists in the Python process.
+    All rasters share one grid, the region is the grid of the raster it was last set to.
+    '''
+
+    def __init__(self):
+        self.rasters = {}
+        self.vectors = {}
+        self.grid = {}
+        self.wkt = ''
+        # Rasters written as CELL; FCELL rasters are kept as float32 arrays, everything else as float64 (DCELL).
+        self.cells = set()
+
+    # _____________FILES_____________
+    def read_file(self, path):
+        '''
+        Reads the first band of a raster file through GDAL.
+        :return: Tuple (array, grid); grid is a dictionary with n, s, e, w, nsres and ewres.
+        '''
+        from osgeo import gdal
+        ds = gdal.Open(path)
+        band = ds.GetRasterBand(1)
+        array = band.ReadAsArray().astype(np.float64)
+        nodata = band.GetNoDataValue()
+        if nodata is not None:
+            array[array == nodata] = np.nan
+        w, ewres, _, n, _, nsres = ds.GetGeoTransform()
+        self.wkt = ds.GetProjection() or self.wkt
+        grid = {'n': n, 's': n + nsres * ds.RasterYSize, 'e': w + ewres * ds.RasterXSize, 'w': w,
+                'nsres': -nsres, 'ewres': ewres}
+        ds = None
+        return array, grid
+
+    def write_file(self, path, array, grid, datatype='Float32', driver='GTiff', createopt='', nodata=0):
+        '''
+        Writes a raster file through GDAL. NULL cells are written as nodata.
+        '''
+        from osgeo import gdal
+        options = [o for o in createopt.split(',') if o]
+        mem = gdal.GetDriverByName('MEM').Create('', array.shape[1], array.shape[0], 1, GDAL_TYPES[datatype])
+        mem.SetGeoTransform((grid['w'], grid['ewres'], 0, grid['n'], 0, -grid['nsres']))
+        mem.SetProjection(self.wkt)
+        band = mem.GetRasterBand(1)
+        band.SetNoDataValue(nodata)
+        band.WriteArray(np.where(np.isnan(array), nodata, array))
+        # CreateCopy works for drivers that cannot write block by block, e.g. COG.
+        gdal.GetDriverByName(driver).CreateCopy(path, mem, options=options)
+        mem = None
+
+    # _____________RASTERS_____________
+    def list(self, pattern=None, exclude=None, mapset='PERMANENT'):
+        names = sorted(self.rasters)
+        if pattern:
+            names = [n for n in names if fnmatch.fnmatch(n, pattern)]
+        if exclude:
+            names = [n for n in names if not fnmatch.fnmatch(n, exclude)]
+        return names
+
+    def exists(self, name, element='raster'):
+        return base(name) in (self.rasters if element == 'raster' else self.vectors)
+
+    def remove(self, names, element='raster'):
+        storage = self.rasters if element == 'raster' else self.vectors
+        for name in as_list(names):
+            storage.pop(base(name), None)
+
+    def import_raster(self, path, name, mode='copy', flags=''):
+        array, grid = self.read_file(path)
+        self.grid = grid
+        self.rasters[base(name)] = array
+
+    def export(self, name, path, datatype, driver='GTiff', createopt='', nodata=0, env=None):
+        self.write_file(path, self.rasters[base(name)], self.grid, datatype, driver, createopt, nodata)
+
+    def read(self, name):
+        return self.rasters[base(name)].astype(np.float64)
+
+    def write(self, name, array, overwrite=False, mtype='DCELL'):
+        shape = (self.region()['rows'], self.region()['cols'])
+        dtype = np.float32 if mtype == 'FCELL' else np.float64
+        array = np.asarray(array, dtype=dtype)
+        if mtype == 'CELL':
+            array = mc_round(array)
+            self.cells.add(base(name))
+        else:
+            self.cells.discard(base(name))
+        self.rasters[base(name)] = np.broadcast_to(array, shape).copy()
+
+    def rename(self, name, new):
+        self.rasters[base(new)] = self.rasters.pop(base(name))
+        if base(name) in self.cells:
+            self.cells.discard(base(name))
+            self.cells.add(base(new))
+
+    # _____________REGION_____________
+    def region(self, rasters=None, flags='', window=None, zoom=None):
+        region = dict(self.grid)
+        region['rows'] = int(round((region['n'] - region['s']) / region['nsres']))
+        region['cols'] = int(round((region['e'] - region['w']) / region['ewres']))
+        return region
+
+    def region_env(self, raster):
+        return None
+
+    def extend_region(self, rasters):
+        pass
+
+    # _____________STATISTICS_____________
+    def info(self, name):
+        array = self.rasters[base(name)]
+        info = self.region()
+        datatype = self.datatype(name)
+        # r.info gives no range for a raster of NULL cells only.
+        empty = np.isnan(array).all()
+        info.update({'min': None if empty else float(np.nanmin(array)),
+                     'max': None if empty else float(np.nanmax(array)), 'datatype': datatype,
+                     'north': info['n'], 'south': info['s'], 'east': info['e'], 'west': info['w']})
+        return info
+
+    def univar(self, name):
+        values = self.rasters[base(name)]
+        values = values[~np.isnan(values)]
+        return {'n': values.size, 'min': values.min(), 'max': values.max(), 'mean': values.mean(),
+                'sum': values.sum()}
+
+    def quantile(self, name, percentiles, env=None):
+        '''
+        Percentiles using linear interpolation between the closest ranks (numpy.percentile), which can differ slightly
+        from r.quantile for rasters with few cells. All percentiles are taken from one sort of the values.
+        '''
+        values = self.rasters[base(name)]
+        values = values[~np.isnan(values)]
+        return [float(v) for v in np.percentile(values, [float(p) for p in as_list(percentiles)])]
+
+    # _____________MAP ALGEBRA_____________
+    def datatype(self, name):
+        array = self.rasters[base(name)]
+        return 'CELL' if base(name) in self.cells else 'FCELL' if array.dtype == np.float32 else 'DCELL'
+
+    def evaluate(self, expr):
+        '''
+        Evaluates the right hand side of a r.mapcalc expression as r.mapcalc does, see mc_evaluate().
+        :return: Tuple (values, type); values broadcast to the size of the region.
+        '''
+        def lookup(name):
+            if name not in self.rasters:
+                raise ValueError(f'Raster {name} of {expr!r} does not exist.')
+            return self.rasters[name].astype(np.float64), self.datatype(name)
+
+        return mc_evaluate(expr, lookup)
+
+    def mapcalc(self, expressions):
+        if isinstance(expressions, str):
+            expressions = [expressions]
+        for expression in expressions:
+            for statement in expression.replace(';', '\n').splitlines():
+                if statement.strip():
+                    name, expr = re.split(r'(?<![=!<>])=(?!=)', statement, maxsplit=1)
+                    # The output has the type of the result, as in r.mapcalc.
+                    value, mtype = self.evaluate(expr)
+                    self.write(name.strip(), value, mtype=mtype)
+
+    def categories(self, name, labels):
+        pass
+
+    def recode(self, name, output, rules, env=None):
+        values = self.rasters[base(name)]
+        out = np.full(values.shape, np.nan)
+        # Later rules win, as in r.recode.
+        for low, high, value in rules:
+            inside = ~np.isnan(values)
+            if low is not None:
+                inside &= values >= low
+            if high is not None:
+                inside &= values <= high
+            out[inside] = value
+        self.rasters[base(output)] = out
+
+    # _____________COST DISTANCE_____________
+    def cost(self, surface, coordinates, outdist, outdir, flags='kn', memory=3000, max_cost=None):
+        region = self.region()
+        x, y = coordinates[:2]
+        dist, direction = accumulate(self.rasters[base(surface)], [coord_to_cell(x, y, region)],
+                                     region['nsres'], region['ewres'], knight='k' in flags, keep_nulls='n' in flags,
+                                     max_cost=max_cost)
+        # r.cost writes the cost distance in the type of the cost surface.
+        if base(surface) in self.cells:
+            dist = mc_round(dist)
+            self.cells.add(base(outdist))
+        else:
+            self.cells.discard(base(outdist))
+            if self.rasters[base(surface)].dtype == np.float32:
+                dist = dist.astype(np.float32)
+        self.rasters[base(outdist)] = dist
+        self.rasters[base(outdir)] = direction
+
+    # _____________VECTORS_____________
+    def points(self, name, points):
+        self.vectors[base(name)] = [(int(cat), float(x), float(y)) for x, y, cat in points]
+
+    def path(self, movdir, costdist, output, coordinates=None, points=None):
+        '''
+        Follows the movement directions from every start point back to the start of the cost distance raster.
+        '''
+        region = self.region()
+        direction = self.rasters[base(movdir)]
+        back = {m[3]: (-m[0], -m[1]) for m in moves(knight=True)}
+        starts = self.vectors[base(points)] if points is not None else [(1, coordinates[0], coordinates[1])]
+        lines = []
+        for cat, x, y in starts:
+            cell = coord_to_cell(x, y, region)
+            path = []
+            while cell is not None and len(path) <= direction.size:
+                path.append((region['w'] + (cell[1] + 0.5) * region['ewres'],
+                             region['n'] - (cell[0] + 0.5) * region['nsres']))
+                degree = direction[cell]
+                if np.isnan(degree) or degree == 0:
+                    break
+                dr, dc = back[float(degree)]
+                cell = (cell[0] + dr, cell[1] + dc)
+            lines.append((int(cat), path))
+        self.vectors[base(output)] = lines
+        return b'', b''
+
+    def extract(self, vector, cats, output):
+        cats = [int(c) for c in as_list(cats)]
+        self.vectors[base(output)] = [line for line in self.vectors[base(vector)] if line[0] in cats]
+
+    def lines(self, vector):
+        return list(self.vectors[base(vector)])
+
+    def what(self, name, points):
+        region = self.region()
+        array = self.rasters[base(name)]
+        values = {}
+        for x, y, sid in points:
+            cell = coord_to_cell(x, y, region)
+            values[str(sid)] = None if cell is None or np.isnan(array[cell]) else float(array[cell])
+        return values
+
+    def projection(self):
+        return self.wkt
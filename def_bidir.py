@@ -0,0 +1,199 @@
+'''
+Lower percentile corridors straight from the cost surface, with a bounded search from both sites.
+corridors() and tenperc() need the full cost distance raster of both sites and the full corridor (A + B)/2, and
+then keep only the cells below the 10th percentile. Here the accumulated cost is spread from both sites at once
+(the Dijkstra search of def_rcost_numpy.py), up to a common limit L that is raised step by step:
+ - every cell with A <= L and B <= L is settled by both searches, so its corridor value (A + B)/2 is exact;
+ - every other cell has A > L or B > L, so its corridor value is above L/2.
+All cells with a corridor value up to L/2 are therefore known. Once there are more of them than the rank of the
+percentile, the percentile is the same as over the full corridor and the search stops. Only the thresholded
+corridor is written, with the same values as if(corridor >= perc, null(), corridor) in tenperc().
+
+The search covers the cells within about 2 * percentile value of both sites, i.e. the area of the corridor rather
+than the area of the raster. Reading the cost surface and writing the output still cover the region.
+The rank of the percentile is taken from the number of non-NULL cells of the cost surface. Cells that cannot be
+reached from the sites (NULL in the cost distance raster) are counted as well, so the percentile can differ from
+that of the full corridor if the cost surface has such islands; pass ncells to correct this.
+
+Usage:
+    corridors_bidir('costsurf_slope_1@PERMANENT', cststart, percentile=10, catalog=catalog)
+'''
+
+import datetime
+import math
+from itertools import combinations
+import numpy as np
+from def_backend import GrassBackend
+from def_catalog import RasterCatalog
+from def_corridors import corridor_name, precision_options
+from def_rcost_numpy import coord_to_cell, moves, spread
+
+
+# _____________BIDIRECTIONAL SEARCH_____________
+def bidir_percentile(cost, start_a, start_b, percentile, shape, nsres, ewres, movelist, ncells, step=1.25):
+    '''
+    Spreads the accumulated cost from two cells until the lower percentile of the corridor between them is known.
+    :param cost: Flat list of cell costs, NaN for NULL cells (barriers).
+    :param start_a: Flat index of the first start cell.
+    :param start_b: Flat index of the second start cell.
+    :param percentile: Percentile (0-100).
+    :param shape: (rows, cols) of the grid.
+    :param nsres: North-south resolution in map units.
+    :param ewres: East-west resolution in map units.
+    :param movelist: List of moves as created by moves().
+    :param ncells: Number of cells of the full corridor the percentile is taken over.
+    :param step: Factor the limit of the search is raised by in every round.
+    :return: Tuple (percentile, cells, values, searched). percentile is None if the start cells are not connected;
+    cells is the list of flat indices of all cells settled by both searches, values their corridor values; searched
+    is the number of cells settled by either search.
+    '''
+    fronts = []
+    for start in (start_a, start_b):
+        dist = [math.inf] * len(cost)
+        dist[start] = 0.0
+        fronts.append((dist, [-1] * len(cost), [(0.0, start)], []))
+    (dist_a, pred_a, heap_a, settled_a), (dist_b, pred_b, heap_b, settled_b) = fronts
+
+    # Cells settled by both searches and their corridor values
+    cells = []
+    values = []
+    # Number of settled cells of each search already checked
+    seen_a = seen_b = 0
+    limit = previous = 0.0
+
+    while True:
+        for dist, pred, heap, settled in fronts:
+            spread(cost, dist, pred, heap, shape, nsres, ewres, movelist, limit=limit, settled=settled)
+
+        # Cells settled by both searches in this round. Cells settled by the second search in an earlier round are
+        # taken from the cells of the first search and vice versa, so that every cell is taken once.
+        for i in settled_a[seen_a:]:
+            if dist_b[i] <= limit:
+                cells.append(i)
+                values.append((dist_a[i] + dist_b[i]) / 2)
+        for i in settled_b[seen_b:]:
+            if dist_a[i] <= previous:
+                cells.append(i)
+                values.append((dist_a[i] + dist_b[i]) / 2)
+        seen_a, seen_b = len(settled_a), len(settled_b)
+        searched = seen_a + seen_b - len(cells)
+
+        # A search that ran out of cells without reaching the other start cell: not connected.
+        if (not heap_a and math.isinf(dist_a[start_b])) or (not heap_b and math.isinf(dist_b[start_a])):
+            return None, [], [], searched
+
+        if not heap_a and not heap_b:
+            # All connected cells are settled, the percentile is taken over all of them.
+            known = np.sort(np.array(values))
+            ncells = len(known)
+        else:
+            # All corridor values up to limit/2 are known.
+            known = np.sort(np.array([v for v in values if v <= limit / 2]))
+
+        # Ranks of the two values to interpolate between, as numpy.percentile (linear).
+        rank = percentile / 100 * (ncells - 1)
+        low, high = math.floor(rank), math.ceil(rank)
+        if len(known) > high:
+            vlow, vhigh = known[low], known[high]
+            return float(vlow + (vhigh - vlow) * (rank - low)), cells, values, searched
+
+        # Raise the limit, at least to the lowest accumulated cost not settled yet.
+        previous = limit
+        limit = max(limit * step, min(heap[0][0] for heap in (heap_a, heap_b) if heap))
+
+
+# _____________CORRIDORS_____________
+def corridors_bidir(raster, cststart, pairs=None, percentile=10, knight=True, ncells=None, step=1.25, catalog=None,
+                    manifest=None, backend=None, precision=None):
+    '''
+    Creates the lower percentile corridors between pairs of sites directly from a cost surface, without cost
+    distance raster and full corridors. The cost surface is read once for all pairs.
+    Output names follow corridor_perc(): 'corridor_[a]_[b]_[costdist root]_[percentile]perc', where the costdist root
+    is the name of the cost surface with 'costsurf' replaced by 'costdist', as created by costdist().
+    Values are the same as those of corridors() and tenperc() over cost distance raster of the numpy engine
+    (costdist(engine='numpy'), flags 'kn'); r.cost can differ in the last digits.
+    :param raster: Name of the cost surface.
+    :param cststart: List of sites of pattern [x, y, sid].
+    :param pairs: Optional list of tuples (sid, sid). Default all pairs of sites, in the order of cststart.
+    :param percentile: Percentile at and above which cells are promoted to NULL.
+    :param knight: Use the knight's move (r.cost -k).
+    :param ncells: Number of cells the percentile is taken over. Default the number of non-NULL cells of the cost
+    surface.
+    :param step: Factor the limit of the search is raised by in every round. Larger steps mean fewer rounds but
+    more cells beyond the percentile are searched.
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param manifest: Optional Manifest (see def_manifest.py). A corridor created from another cost surface or other
+    site coordinates, or not recorded as complete, is created again.
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :param precision: Optional Precision (see def_precision.py) the corridors are stored in. They are calculated in
+    double precision from the cost surface and rounded once when written; in mode 'int' they are in scaled units.
+    :return: None. Writes the corridors into the current mapset.
+    '''
+    if backend is None:
+        backend = GrassBackend()
+    if catalog is None:
+        catalog = RasterCatalog(backend=backend)
+
+    coords = {str(sid): (x, y) for x, y, sid in cststart}
+    if pairs is None:
+        pairs = list(combinations(coords, 2))
+    rast = raster.split("@")[0].replace("costsurf", "costdist")
+    flags = 'kn' if knight else 'n'
+
+    # ________Pairs still to create________
+    todo = []
+    keys = {}
+    for a, b in pairs:
+        out = f'{corridor_name(a, b, rast)}_{percentile}perc'
+        # Remove the corridor if it is out of date, so that it is created again below.
+        if manifest is not None:
+            keys[out] = manifest.key('corridor_bidir', [raster], coordinates=(coords[str(a)], coords[str(b)]),
+                                     percentile=percentile, flags=flags, **precision_options(precision))
+            manifest.needs([out], keys[out], catalog)
+        if out in catalog:
+            print(f'!!! {out}\n  already exists and will not be created.')
+            continue
+        todo.append((str(a), str(b), out))
+    if not todo:
+        return
+
+    # ________Read the cost surface once________
+    region = backend.region(raster)
+    surface = backend.read(raster)
+    shape = surface.shape
+    cost = surface.astype(np.float64).ravel().tolist()
+    if ncells is None:
+        ncells = int(np.count_nonzero(~np.isnan(surface)))
+    movelist = moves(knight)
+
+    for a, b, out in todo:
+        starts = [coord_to_cell(*coords[sid], region) for sid in (a, b)]
+        if None in starts:
+            print(f'Site {a} or {b} is outside of the region of {raster}. Nothing happens.')
+            continue
+        start_a, start_b = (row * shape[1] + col for row, col in starts)
+
+        print(f'Creating the {percentile}th percentile corridor between sites {a} and {b} over\n {raster}')
+        begin_time = datetime.datetime.now()
+        perc, cells, values, searched = bidir_percentile(cost, start_a, start_b, percentile, shape,
+                                                         region['nsres'], region['ewres'], movelist, ncells, step)
+        if perc is None:
+            print(f'Sites {a} and {b} are not connected over {raster}. Nothing happens.')
+            continue
+        print(f'{percentile}th percentile: {perc}, {searched} of {ncells} cells searched')
+
+        # Promote all cells at or above the percentile to NULL, as if(corridor >= perc, null(), corridor) in tenperc().
+        corridor = np.full(len(cost), np.nan)
+        corridor[cells] = values
+        corridor[corridor >= perc] = np.nan
+        corridor = corridor.reshape(shape)
+        if precision is not None:
+            backend.write(out, precision.encode_array(corridor), overwrite=True, mtype=precision.mtype)
+            precision.check(out, backend)
+        else:
+            backend.write(out, corridor, overwrite=True)
+        catalog.add(out)
+        if manifest is not None:
+            manifest.record(out, keys[out], 'corridor_bidir')
+        runtime = (datetime.datetime.now() - begin_time).total_seconds()
+        print(f'It took {runtime} seconds to create: \n', out)
@@ -0,0 +1,56 @@
+'''
+Catalog of the raster maps in a mapset.
+The mapset is listed once using gs.list_strings and the names (without '@MAPSET') are kept in a set, so checking
+whether a raster exists does not need another GRASS call and does not scan a list.
+Pass the same catalog to all steps of the pipeline and it stays up to date: the functions add the rasters they
+create and remove the ones they delete.
+'''
+
+from def_backend import GrassBackend
+
+
+class RasterCatalog:
+    '''
+    Set of the raster names in one mapset.
+    :param mapset: Mapset to list, default PERMANENT.
+    :param backend: Backend to list (see def_backend.py), default GRASS.
+    '''
+
+    def __init__(self, mapset='PERMANENT', backend=None):
+        self.mapset = mapset
+        self.backend = backend if backend is not None else GrassBackend()
+        self.names = set()
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Lists the mapset again, e.g. after rasters were created or removed outside of the pipeline.
+        :return: None
+        '''
+        # Names without the mapset information.
+        self.names = set(self.backend.list(mapset=self.mapset))
+
+    def add(self, name):
+        '''
+        Registers a raster that was created.
+        :param name: Raster name, with or without '@MAPSET'.
+        :return: None
+        '''
+        self.names.add(name.split("@")[0])
+
+    def remove(self, name):
+        '''
+        Unregisters a raster that was removed.
+        :param name: Raster name, with or without '@MAPSET'.
+        :return: None
+        '''
+        self.names.discard(name.split("@")[0])
+
+    def __contains__(self, name):
+        return name.split("@")[0] in self.names
+
+    def __iter__(self):
+        return iter(sorted(self.names))
+
+    def __len__(self):
+        return len(self.names)
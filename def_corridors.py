@@ -1,7 +1,9 @@
-import grass.script as gs
-from grass.script import core as gscore
+import numpy as np
 import datetime
 from itertools import combinations, product
+from def_catalog import RasterCatalog
+from def_backend import GrassBackend, parse_quantiles
+from def_windows import pair_options, pair_region
 
 # _________________THE BELOW FUNCTION IS NOT NEEDED AND SHOULD BE DELETED___________________
 def pairs(*lists):
@@ -26,15 +28,55 @@ def pairs(*lists):
 
 
 
-def corridors(site1, site2):
+def corridor_expression(corridor, site1, site2, precision=None):
+    '''
+    :return: r.mapcalc expression of the corridor between two cost distance raster, stored in the given precision.
+    '''
+    if precision is None:
+        return f'{corridor} = ({site1} + {site2})/2'
+    # 2.0: the sum of two CELL raster would be divided as integer.
+    return f'{corridor} = {precision.cast(f"({site1} + {site2})/2.0")}'
+
+
+def corridor_name(a, b, rast):
+    '''
+    Name of the corridor between two sites. The sites are ordered as gs.list_strings() lists their cost distance
+    raster ('[site]_[costdist]'), whatever order they are given in, so that every corridor function gives a pair the
+    same name.
+    :param a: sid of one site.
+    :param b: sid of the other site.
+    :param rast: Root of the cost distance raster without mapset information, e.g. 'costdist_slope_...'.
+    :return: Name of pattern 'corridor_[a]_[b]_[rast]'.
+    '''
+    a, b = sorted((str(a), str(b)), key=lambda sid: f'{sid}_')
+    return f'corridor_{a}_{b}_{rast}'
+
+
+def precision_options(precision):
+    # Parameters of the manifest keys, none without a precision so that existing outputs keep their keys.
+    return precision.options() if precision is not None else {}
+
+
+def corridors(site1, site2, catalog=None, manifest=None, backend=None, windows=None, crop=False, precision=None):
     '''
     Function to create corridors using r.mapcalc. Takes two cost distance raster file names (str) as input.
     Can be used in a for loop, when looping through a list of tuples where each tuple is composed of two raster names.
     For further information on r.mapcalc including NULL handling, see: https://grass.osgeo.org/grass78/manuals/r.mapcalc.html
     :param site1: A cost distance raster from one site of pattern '[site]_[costdist]@[MAPSET]'.
     :param site2: A cost distance raster from one site of pattern '[site]_[costdist]@[MAPSET]'.
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param manifest: Optional Manifest (see def_manifest.py). A corridor created from other cost distance raster,
+    or not recorded as complete, is created again.
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :param windows: Optional Windows (see def_windows.py); the corridor only covers the window of the pair. GRASS only.
+    :param crop: If True the corridor only covers the cells that are not NULL in both inputs, e.g. cost distance
+    raster created with max_cost (see def_windows.py). GRASS only.
+    :param precision: Optional Precision (see def_precision.py) the corridors are stored in; the expected error is
+    reported.
     :return: A raster representing the corridor between site1 and site2.
     '''
+    if backend is None:
+        backend = GrassBackend()
 
     # Get the root of the file names, to check both cost dist raster were created from the same cost surface.
     # Requires file name to be of pattern '[site]_[costdist]@[MAPSET]' where [costdist]@[MAPSET] will be the root to check.
@@ -51,11 +93,11 @@ def corridors(site1, site2):
               f' {raster_a} \n'
               f' {raster_b}')
 
-        # Set region extent based on both input raster.
-        gs.run_command('g.region',
-                       raster=[site1, site2],
-                       flags='p'
-                       )
+        # Set region extent based on both input raster, or on the window of the pair.
+        if windows is not None or crop:
+            pair_region(site1, site2, windows, crop, backend=backend)
+        else:
+            backend.region([site1, site2], flags='p')
 
         # ________Create output string________
         # Get raster name to pass to output string.
@@ -67,24 +109,30 @@ def corridors(site1, site2):
         b = raster_b.split("_")[0]
 
         # Create output string.
-        corridor = f'corridor_{a}_{b}_{rast}'
+        corridor = corridor_name(a, b, rast)
 
         #________Check corridor does not already exist________
-        # Get a list of all rasters in PERMANENT mapset.
-        rasts = gs.list_strings(type='raster',
-                                mapset='PERMANENT'
-                                )
-        # Create a list of rasters without mapset information. GRASS will print out the raster names of pattern [name]@[MAPSET].
-        cleanrasts = []
-        for rast in rasts:
-            substring = rast.split("@")[0]
-            cleanrasts.append(substring)
+        if catalog is None:
+            catalog = RasterCatalog(backend=backend)
+
+        # Remove the corridor if it is out of date, so that it is created again below.
+        if manifest is not None:
+            key = manifest.key('corridor', [raster_a, raster_b], **pair_options(site1, site2, windows, crop),
+                               **precision_options(precision))
+            manifest.needs([corridor], key, catalog)
 
         # Check that the corridor does not already exist in the PERMANENT mapset.
-        if corridor not in cleanrasts:
+        if corridor not in catalog:
             # ________Run r.mapcalc to create corridors________
             begin_time = datetime.datetime.now()
-            gs.mapcalc(f'{corridor} = ({raster_a} + {raster_b})/2')
+            backend.mapcalc(corridor_expression(corridor, raster_a, raster_b, precision))
+            catalog.add(corridor)
+            if precision is not None:
+                info = backend.info(corridor)
+                precision.report(corridor, max(abs(info['min']), abs(info['max'])),
+                                 steps=precision.inherited(raster_a, raster_b) + 1)
+            if manifest is not None:
+                manifest.record(corridor, key, 'corridor')
             runtime_corr = (datetime.datetime.now() - begin_time).total_seconds()
             # Print when operation is finished.
             print(f'It took {runtime_corr} seconds to create: \n', corridor)
@@ -101,7 +149,105 @@ def corridors(site1, site2):
 
 
 
-def tenperc(rasterlist):
+def corridors_batch(combos, batchsize=20, catalog=None, manifest=None, backend=None, windows=None, crop=False,
+                    precision=None):
+    '''
+    Function to create many corridors with few r.mapcalc runs. Takes a list of tuples of two cost distance raster
+    file names (str) as input, e.g. the list of combinations used to loop over corridors().
+    The pairs are grouped by the root of the cost distance raster (i.e. the cost surface) and every group is written
+    by r.mapcalc runs holding up to batchsize expressions of pattern 'corridor_[a]_[b]_[root] = (A + B)/2'.
+    r.mapcalc reads each input row only once per run, no matter how many expressions use it.
+    Every expression keeps one row buffer per input and output raster open, so batchsize trades memory (and open
+    files) for fewer passes over the data.
+    :param combos: List of tuples of two cost distance raster of pattern '[site]_[costdist]@[MAPSET]'.
+    :param batchsize: Maximum number of corridors created by one r.mapcalc run.
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param manifest: Optional Manifest (see def_manifest.py), as in corridors().
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :param windows: Optional Windows, as in corridors(). Every corridor has its own region then, so each is created
+    by its own r.mapcalc run.
+    :param crop: As in corridors(), one r.mapcalc run per corridor as well.
+    :param precision: Optional Precision, as in corridors().
+    :return: Rasters representing the corridors between each pair of sites.
+    '''
+    if backend is None:
+        backend = GrassBackend()
+    if catalog is None:
+        catalog = RasterCatalog(backend=backend)
+
+    # ________Group the pairs by the root of their file names________
+    groups = {}
+    # Keys of the corridors in the manifest
+    keys = {}
+    for site1, site2 in combos:
+        roota = site1.split("_", 1)[1]
+        rootb = site2.split("_", 1)[1]
+        if roota != rootb:
+            # Don't do anything if the raster roots are not the same.
+            print(f'Cost distance raster do not have the same root! Nothing happens for: \n {site1} \n {site2}')
+            continue
+
+        # Create output string of pattern corridor_[a]_[b]_[rast] as in corridors().
+        rast = roota.split("@")[0]
+        a = site1.split("_")[0]
+        b = site2.split("_")[0]
+        corridor = corridor_name(a, b, rast)
+
+        # Remove the corridor if it is out of date, so that it is created again below.
+        if manifest is not None:
+            keys[corridor] = manifest.key('corridor', [site1, site2], **pair_options(site1, site2, windows, crop),
+                                          **precision_options(precision))
+            manifest.needs([corridor], keys[corridor], catalog)
+
+        # Check that the corridor does not already exist in the PERMANENT mapset.
+        if corridor in catalog:
+            print(f'!!! {corridor}\n  already exists and will not be created.')
+            continue
+        groups.setdefault(rast, []).append((corridor, site1, site2))
+
+    # ________Run r.mapcalc once per pair, in the region of the pair________
+    if windows is not None or crop:
+        for rast, group in groups.items():
+            for corridor, site1, site2 in group:
+                pair_region(site1, site2, windows, crop, backend=backend)
+                print(f'Creating {corridor}')
+                backend.mapcalc(corridor_expression(corridor, site1, site2, precision))
+                catalog.add(corridor)
+                if manifest is not None:
+                    manifest.record(corridor, keys[corridor], 'corridor')
+    else:
+        # ________Run r.mapcalc once per batch________
+        for rast, group in groups.items():
+            # Set region extent based on all input raster of this root.
+            inputs = sorted({site for corridor, site1, site2 in group for site in (site1, site2)})
+            backend.region(inputs)
+
+            for i in range(0, len(group), batchsize):
+                batch = group[i:i + batchsize]
+                expressions = [corridor_expression(corridor, site1, site2, precision)
+                               for corridor, site1, site2 in batch]
+                print(f'Creating {len(batch)} corridors over {rast} in one r.mapcalc run.')
+
+                begin_time = datetime.datetime.now()
+                # Several expressions are run by one r.mapcalc.
+                backend.mapcalc(expressions)
+                runtime_corr = (datetime.datetime.now() - begin_time).total_seconds()
+                print(f'It took {runtime_corr} seconds to create: \n', *[corridor for corridor, site1, site2 in batch], sep='\n ')
+
+                for corridor, site1, site2 in batch:
+                    catalog.add(corridor)
+                    if manifest is not None:
+                        manifest.record(corridor, keys[corridor], 'corridor')
+
+    if precision is not None:
+        for rast, group in groups.items():
+            for corridor, site1, site2 in group:
+                info = backend.info(corridor)
+                precision.report(corridor, max(abs(info['min']), abs(info['max'])),
+                                 steps=precision.inherited(site1, site2) + 1)
+
+
+def tenperc(rasterlist, catalog=None, manifest=None, backend=None, precision=None, runner=None):
     '''
     This function calculates the 10th percentile of a raster map and creates a new raster where all cells above
     the 10th percentile are promoted to NULL. It uses GRASS r.quantile to calculate the 10th percentile and
@@ -117,44 +263,191 @@ def tenperc(rasterlist):
          https://gis.stackexchange.com/questions/266375/problem-with-r-quantile
     :type rasterlist: List
     :param rasterlist: List of raster files from which to calculate the 10th percentile.
+    :param catalog: Optional RasterCatalog shared by the pipeline, the new rasters are added to it.
+    :param manifest: Optional Manifest (see def_manifest.py). 10% raster that are up to date are not created again.
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :param precision: Optional Precision (see def_precision.py) the 10% raster are stored in. Without it they have
+    the type of the input.
+    :param runner: Optional ModuleRunner (see def_async.py, GRASS only). The r.quantile runs of all raster are
+    started at once, each in the region of its raster, and run while the 10% raster of the previous ones are created.
     :return: A raster with only 10% of values.
     '''
+    if backend is None:
+        backend = GrassBackend()
+
+    todo = []
     for rast in rasterlist:
+        name = rast.split("@")[0]
+        out = f'{name}_10perc'
+
+        # Skip 10% raster that are up to date, remove the ones that are not.
+        key = None
+        if manifest is not None:
+            key = manifest.key('tenperc', [rast], percentile=10, **precision_options(precision))
+            if not manifest.needs([out], key, catalog):
+                print(f'!!! {out}\n  is up to date and will not be created.')
+                continue
+        todo.append((rast, out, key))
+
+    # Percentiles of all raster at once, at most runner.limit runs at the same time.
+    quantiles = {}
+    if runner is not None:
+        for rast, out, key in todo:
+            quantiles[rast] = runner.submit('r.quantile', input=rast, percentiles=10, env=backend.region_env(rast))
+
+    for rast, out, key in todo:
         # Set the computational region to the current raster.
-        gs.run_command('g.region', raster=rast)
+        backend.region(rast)
         print(f'\n10 percent corridor will be created for: \n {rast}')
 
         # ________Run r.quantile________
         # Get the start time of the quantile calculation
         begin_time = datetime.datetime.now()
         # Calculate the 10th percentile of each raster using r.quantile
-        p = gscore.pipe_command('r.quantile',
-                                input=rast,
-                                percentiles=10)
-        # Feed the output of r.quantile into a list
-        perc = []
-        for line in p.stdout:
-            result = line.decode('UTF-8')
-            val1, val2, percs = result.split(':')
-            # put the result of
-            perc.append(float(percs))
+        if rast in quantiles:
+            # Wait for the run started above.
+            stdout, stderr = quantiles[rast].result()
+            perc = parse_quantiles(stdout)
+        else:
+            perc = backend.quantile(rast, 10)
+        if not perc:
+            print(f'{rast} has no values, no 10th percentile. Nothing happens.')
+            continue
         # Print some info about the variable.
         print(f'10th percentile: {perc[0]}')
-        p.wait()
+        # Cells below the percentile are kept; if the smallest value is the percentile, nothing would be.
+        minimum = backend.info(rast)['min']
+        if minimum is None or minimum >= perc[0]:
+            print(f'{rast} has no values below its 10th percentile. Nothing happens.')
+            continue
         # Tell me how long it took to calculate the 10th percentile using r.quantile.
         runtime_perc = (datetime.datetime.now() - begin_time).total_seconds()
         print(f'The runtime to calculate the 10th percentile is {runtime_perc} seconds.\n')
 
         # ________Create mapcalc output string________
-        name = rast.split("@")[0]
-        out = f'{name}_10perc'  #
         print('\nRunning r.mapcalc to create: \n', out)
 
         # ________Run r.mapcalc to create corridors________
         # Start time calculations for the mapcalc operation.
         begin_time_mapcalc = datetime.datetime.now()
         # Calculate the new raster only containing the upper 10% of values using r.mapcalc.
-        gs.mapcalc(f'{out} = if({rast}>={perc[0]}, null(), {rast})')  # taken from here: https://gis.stackexchange.com/a/81730
+        expression = f'if({rast}>={perc[0]}, null(), {rast})'  # taken from here: https://gis.stackexchange.com/a/81730
+        if precision is not None:
+            expression = precision.cast(expression)
+        backend.mapcalc(f'{out} = {expression}')
+        if precision is not None:
+            # Values are those of the corridor, no further rounding.
+            precision.report(out, max(abs(perc[0]), abs(backend.info(out)['min'])), steps=precision.inherited(rast))
+        if catalog is not None:
+            catalog.add(out)
+        if manifest is not None:
+            manifest.record(out, key, 'tenperc')
         # Tell me how long it took to create the new raster.
         runtime_mapcalc = (datetime.datetime.now() - begin_time_mapcalc).total_seconds()
-        print(f'The runtime to promote all cells above 10th percentile to NULL is {runtime_mapcalc} seconds.')
\ No newline at end of file
+        print(f'The runtime to promote all cells above 10th percentile to NULL is {runtime_mapcalc} seconds.')
+
+
+
+def corridor_perc(site1, site2, percentile=10, keep_full=False, catalog=None, manifest=None, backend=None,
+                  windows=None, crop=False, precision=None):
+    '''
+    Function to create the lower percentile of a corridor in a single pass, combining corridors() and tenperc().
+    Both cost distance raster are read once, the corridor (A + B)/2 is calculated in memory, the percentile is
+    taken from those values and only the thresholded corridor is written, i.e. all cells at or above the percentile
+    are NULL as in tenperc(). Avoids writing the full corridor and reading it back twice (r.quantile and r.mapcalc).
+    The percentile is calculated using linear interpolation between the closest ranks (numpy.percentile), which can
+    differ slightly from r.quantile for rasters with few cells.
+    Needs memory for about four rasters of the size of the computational region.
+    :param site1: A cost distance raster from one site of pattern '[site]_[costdist]@[MAPSET]'.
+    :param site2: A cost distance raster from one site of pattern '[site]_[costdist]@[MAPSET]'.
+    :param percentile: Percentile at and above which cells are promoted to NULL.
+    :param keep_full: If True the full corridor is written as well.
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param manifest: Optional Manifest (see def_manifest.py), as in corridors().
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :param windows: Optional Windows, as in corridors(). Only the cells of the window are read and are part of the
+    percentile.
+    :param crop: As in corridors().
+    :param precision: Optional Precision, as in corridors(). The percentile is taken from the stored values.
+    :return: A raster of pattern 'corridor_[a]_[b]_[root]_[percentile]perc', and the full corridor if keep_full is True.
+    '''
+    if backend is None:
+        backend = GrassBackend()
+
+    roota = site1.split("_", 1)[1]
+    rootb = site2.split("_", 1)[1]
+    if roota != rootb:
+        # Don't do anything if the raster roots are not the same.
+        print('Cost distance raster do not have the same root! Nothing happens.')
+        return
+
+    # ________Create output strings________
+    rast = roota.split("@")[0]
+    a = site1.split("_")[0]
+    b = site2.split("_")[0]
+    corridor = corridor_name(a, b, rast)
+    out = f'{corridor}_{percentile}perc'
+
+    if catalog is None:
+        catalog = RasterCatalog(backend=backend)
+
+    # Remove outputs that are out of date, so that they are created again below.
+    if manifest is not None:
+        key = manifest.key('corridor_perc', [site1, site2], percentile=percentile,
+                           **pair_options(site1, site2, windows, crop), **precision_options(precision))
+        manifest.needs([out, corridor] if keep_full else [out], key, catalog)
+
+    # Check that the outputs do not already exist in the PERMANENT mapset.
+    if out in catalog and (corridor in catalog or not keep_full):
+        print(f'!!! {out}\n  already exists and will not be created.')
+        return
+
+    # Set region extent based on both input raster, or on the window of the pair.
+    if windows is not None or crop:
+        pair_region(site1, site2, windows, crop, backend=backend)
+    else:
+        backend.region([site1, site2])
+    print(f'Proceeding to combine raster: \n'
+          f' {site1} \n'
+          f' {site2} \n'
+          f'into the {percentile}th percentile corridor: \n'
+          f' {out}')
+
+    # ________Calculate corridor and percentile in memory________
+    begin_time = datetime.datetime.now()
+    values = backend.read(site1)
+    values += backend.read(site2)
+    values /= 2
+    if precision is not None:
+        # The values as stored, as tenperc() would read them from the stored corridor.
+        values = precision.array(values)
+    mtype = precision.mtype if precision is not None else 'DCELL'
+    # NULL cells in either input are NaN and are not part of the percentile, as in r.quantile.
+    valid = ~np.isnan(values)
+    if not valid.any():
+        print(f'{corridor} has no values. Nothing happens.')
+        return
+    perc = float(np.percentile(values[valid], percentile))
+    print(f'{percentile}th percentile: {perc}')
+
+    # ________Write outputs________
+    if keep_full and corridor not in catalog:
+        backend.write(corridor, values, mtype=mtype)
+        catalog.add(corridor)
+        if manifest is not None:
+            manifest.record(corridor, key, 'corridor_perc')
+
+    # Promote all cells at or above the percentile to NULL, as if(corridor >= perc, null(), corridor) in tenperc().
+    if not (values[valid] < perc).any():
+        print(f'{corridor} has no values below its {percentile}th percentile. Nothing happens.')
+        return
+    values[values >= perc] = np.nan
+    backend.write(out, values, overwrite=True, mtype=mtype)
+    if precision is not None:
+        precision.report(out, max(abs(perc), abs(np.nanmin(values))), steps=precision.inherited(site1, site2) + 1)
+    catalog.add(out)
+    if manifest is not None:
+        manifest.record(out, key, 'corridor_perc')
+
+    runtime = (datetime.datetime.now() - begin_time).total_seconds()
+    print(f'It took {runtime} seconds to create: \n', out)
@@ -1,16 +1,103 @@
-import subprocess
-import grass.script as gs
+from concurrent.futures import ThreadPoolExecutor
+from def_catalog import RasterCatalog
+from def_backend import GrassBackend
 
-def lcp(costsurf, rcostpoint, startpoint, outpath):
+
+def lcp_batch(movdir, costdist, point, startpoint, root, split=False, manifest=None, backend=None, runner=None):
+    '''
+    Generates all LCPs back to one point with a single r.path run.
+    The start points are written to a temporary vector using their sid as category. r.path gives each path the
+    category of the start point it was traced from, so the combined output can be split by category.
+    :param movdir: movement direction raster created by r.cost from point.
+    :param costdist: cost distance raster created by r.cost from point.
+    :param point: sid of the point the movdir and costdist raster were created from.
+    :param startpoint: list of points of pattern [x, y, sid] from which lcps are to be calculated.
+    :param root: root of the cost surface name, without mapset information.
+    :param split: If True the combined vector is split into one vector per path named 'lcp_[sid]_[point]_[root]'.
+    This takes one v.extract run per path; the GPKG export (see def_lcpgpkg.py) reads the combined vector.
+    :param manifest: Optional Manifest (see def_manifest.py). Paths that are up to date are not traced again.
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :param runner: Optional ModuleRunner (see def_async.py, GRASS only) r.path is run by, with streamed output and
+    retries, in the region of movdir.
+    :return: Name of the vector 'lcps_[point]_[root]' with all paths to point (category = sid of the start point),
+    and one vector per path if split is True. None if there are no start points other than point.
+    '''
+    if backend is None:
+        backend = GrassBackend()
+
+    # sids other than the point itself
+    starts = [(x, y, sid) for x, y, sid in startpoint if sid != point]
+    if not starts:
+        print(f'No start points other than {point}. Nothing happens.')
+        return None
+
+    combined = f'lcps_{point}_{root}'
+
+    # skip paths that are up to date, remove the ones that are not
+    if manifest is not None:
+        key = manifest.key('lcp', [movdir, costdist], starts=starts, split=split)
+        if not manifest.needs([combined], key, None, element='vector'):
+            print(f'{combined} is up to date and will not be created.')
+            return combined
+
+    # write the start points to a temporary vector, category = sid
+    startvect = f'tmp_lcpstart_{point}'
+    backend.points(startvect, starts)
+
+    # run r.path once for all start points
+    print(f'r.path from {len(starts)} start points will be run on {point}_costdist')
+    print(f'output: {combined}')
+    if runner is not None:
+        # The output is printed while r.path runs, in the region of the movdir raster passed through GRASS_REGION.
+        runner.submit('r.path', env=backend.region_env(movdir),
+                      **backend.path_options(movdir, costdist, combined, points=startvect)).result()
+    else:
+        backend.region(movdir)
+        stdoutdata, stderrdata = backend.path(movdir, costdist, combined, points=startvect)
+        print(stdoutdata)
+        print(stderrdata)
+
+    # split the paths by category, keeping the names of the single r.path runs
+    if split:
+        for x, y, sid in starts:
+            namevect = f'lcp_{sid}_{point}_{root}'
+            backend.extract(combined, sid, namevect)
+
+    backend.remove(startvect, element='vector')
+
+    if manifest is not None:
+        manifest.record(combined, key, 'lcp')
+    return combined
+
+
+def lcp(costsurf, rcostpoint, startpoint, outpath, catalog=None, batch=True, split=False, gpkg=True, manifest=None,
+        backend=None, runner=None):
     '''
     Generates LCPs using r.path.
     :param costsurf: List of costsurfaces, assumed to be the base name for the costdist and movdir raster created using r.cost
     :param rcostpoint: list of start points from which costdist were created using r.cost
     :param startpoint: list of points from which lcps are to be calculated using r.path
     :param outpath: directory path where the gpkg with your LCPs will be stored; e.g.: '/export/home/fkj22/rcostconvol/out'
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param batch: If True all LCPs back to one point are traced by a single r.path run (see lcp_batch),
+    otherwise r.path is run once per start point.
+    :param split: Only used with batch. If True one vector per LCP is created, named as without batch, by one
+    v.extract run per LCP.
+    :param gpkg: If True all LCPs of a cost surface are exported to one GPKG in outpath (see def_lcpgpkg.py).
+    :param manifest: Optional Manifest (see def_manifest.py), only used with batch.
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :param runner: Optional ModuleRunner (see def_async.py, GRASS only). The r.path runs of all points of a cost
+    surface (with batch, the lcp_batch() of all points) are started at once, at most runner.limit at the same time.
     :return: A GPKG file (per costdist raster) with all lcps from several points back to a single start point.
     '''
 
+    if backend is None:
+        backend = GrassBackend()
+
+    # create a catalog of raster against which to check if your movdir and costdist exist
+    if catalog is None:
+        catalog = RasterCatalog(backend=backend)
+
     # for every file in your list of cost surfaces get the root of the cost surface raster
 
     for file in costsurf:
@@ -19,6 +106,12 @@ def lcp(costsurf, rcostpoint, startpoint, outpath):
 
         print(f'\n\n{root}')
 
+        # vectors to export to the GPKG of this cost surface, as (vector, point, sid)
+        vectors = []
+        # r.path runs and lcp_batch() calls started through the runner, waited for below
+        paths = []
+        batches = []
+
         # for every point in your list of rcostpoints check if r.cost has been run from the rcostpoint
         for point in rcostpoint:
             # create the names of the movdir and costdist raster
@@ -26,10 +119,6 @@ def lcp(costsurf, rcostpoint, startpoint, outpath):
             costdist = f'{point}_costdist_{root}'
 
 
-            # create a list of raster against which to check if your movdir and costdist exist
-            rasterdata = gs.list_strings(type='raster',
-                                         mapset='PERMANENT')
-
             # for testing purposes here's a list of movdir and costdist raster:
             # rasterdata = ['167_movdir_convol227_00jan_maxcost40_dsrt005_wat02_220121_3395@PERMANENT',
             #               '167_costdist_convol227_00jan_maxcost40_dsrt005_wat02_220121_3395@PERMANENT',
@@ -42,11 +131,21 @@ def lcp(costsurf, rcostpoint, startpoint, outpath):
             #               '1003_costdist_convol227_01feb_maxcost40_dsrt005_wat02_220121_3395@PERMANENT']
 
             # here you do the actual checking if the movdir and costdist are in your list of GRASS raster
-            if (movdir in rasterdata) and (costdist in rasterdata):
+            if (movdir in catalog) and (costdist in catalog):
                 print('\n')
                 print(f'movdir: {movdir}')
                 print(f'costdist: {costdist}')
 
+                if batch:
+                    if runner is not None:
+                        batches.append(point)
+                    else:
+                        combined = lcp_batch(movdir, costdist, point, startpoint, root.split("@")[0], split=split,
+                                             manifest=manifest, backend=backend)
+                        if combined is not None:
+                            vectors.append((combined, point, None))
+                    continue
+
                 for x, y, sid in startpoint:
                     # # for test purposes
                     # list_vectors = []
@@ -58,45 +157,17 @@ def lcp(costsurf, rcostpoint, startpoint, outpath):
                         print(f'output: {namevect}')
 
                         # run r.path
-                        p = gs.start_command('r.path',
-                                             input = movdir, # name of input direction raster
-                                             format = 'degree',  # of input direction map; options: auto, degree, 45degree, bitmask
-                                             values = costdist, # name of input raster map with cost values
-                                             # raster_path=, #name for output raster path map
-                                             vector_path = namevect,  # name for output vector path map
-                                             start_coordinates = (x, y),  # coordinates of starting points(s) (E,N)
-                                             overwrite = True,
-                                             stderr=subprocess.PIPE,
-                                             stdout=subprocess.PIPE
-                                             # start_points=point #name of starting vector points map
-                                             )
-                        stdoutdata, stderrdata = p.communicate()
-                        print(stdoutdata)
-                        print(stderrdata)
-
-                        # # for test purposes
-                        # list_vectors.append(namevect)
-
-                        # # get all your LCPs in a vector list
-                        # vectordata = gs.list_strings(type='vector',
-                        #                              pattern=f'lcp_*_{point}_*')
-                        #
-                        # # output all your LCPs according to the costdist raster on which they were created to a single GPKG
-                        # for vect in vectordata:
-                        #     print(f'Input layer for v.out.ogr is: {vect}')
-                        #     out_path = outpath
-                        #     out_file = f'{vect.split("@")[0].split("_", 2)[2]}.gpkg'
-                        #     out_loc = f'{out_path}/{out_file}'
-                        #     print(f'{vect} will be saved to GPKG named {out_file}')
-                        #
-                        #     gs.run_command('v.out.ogr',
-                        #                    input=vect,
-                        #                    type='line',
-                        #                    output=out_loc,
-                        #                    output_layer=vect,
-                        #                    format='GPKG',
-                        #                    flags='a'
-                        #                    )
+                        if runner is not None:
+                            paths.append(runner.submit('r.path', env=backend.region_env(movdir),
+                                                       **backend.path_options(movdir, costdist, namevect,
+                                                                              coordinates=(x, y))))
+                        else:
+                            backend.region(movdir)
+                            stdoutdata, stderrdata = backend.path(movdir, costdist, namevect, coordinates=(x, y))
+                            print(stdoutdata)
+                            print(stderrdata)
+
+                        vectors.append((namevect, point, sid))
 
                     elif sid == point:
                         print(f'r.path will not be run from startpoint {sid} for costdist {point}')
@@ -104,4 +175,23 @@ def lcp(costsurf, rcostpoint, startpoint, outpath):
 
             else:
                 print(f'WARNING: CANNOT CALCULATE LCP \n {movdir} or {costdist} are not in list of rasters.')
-                pass
\ No newline at end of file
+                pass
+
+        # wait for the paths started through the runner
+        if batches:
+            def run(point):
+                return lcp_batch(f'{point}_movdir_{root}', f'{point}_costdist_{root}', point, startpoint,
+                                 root.split("@")[0], split=split, manifest=manifest, backend=backend, runner=runner)
+
+            with ThreadPoolExecutor(max_workers=runner.limit) as pool:
+                # Only the vectors that were created
+                vectors += [(combined, point, None) for point, combined in zip(batches, pool.map(run, batches))
+                            if combined is not None]
+        for future in paths:
+            future.result()
+
+        # output all your LCPs according to the cost surface on which they were created to a single GPKG
+        if gpkg:
+            # GDAL/OGR is only needed for the export
+            from def_lcpgpkg import lcp_gpkg
+            lcp_gpkg(vectors, startpoint, root.split("@")[0], outpath, backend=backend)
@@ -0,0 +1,76 @@
+'''
+Export of LCPs created by lcp() into a single GeoPackage per cost surface.
+All paths are written into one layer within one transaction, instead of calling v.out.ogr with append for every
+vector, which rewrites the GeoPackage each time. The spatial index is created once after all paths are written.
+Attributes: sid of the start point of the path (source_sid), sid of the point it leads to (target_sid),
+root of the cost surface (root) and the accumulated cost from source to target read from the costdist raster (cost).
+'''
+
+import os
+from osgeo import ogr, osr
+from def_backend import GrassBackend
+
+
+def lcp_gpkg(vectors, startpoint, root, outpath, backend=None):
+    '''
+    Writes all LCPs of one cost surface into one GeoPackage within one transaction.
+    :param vectors: List of tuples (vector, point, sid). 'point' is the sid the paths lead to (the costdist raster
+    was created from), 'sid' the start point of the path. If sid is None the vector holds several paths (as created by
+    lcp_batch) and the category of each path is taken as its sid.
+    :param startpoint: list of points of pattern [x, y, sid] the paths were created from.
+    :param root: root of the cost surface name, without mapset information.
+    :param outpath: directory path where the gpkg will be stored; e.g.: '/export/home/fkj22/rcostconvol/out'
+    :param backend: Backend the paths and costs are read from (see def_backend.py), default GRASS.
+    :return: A GPKG file 'lcp_[root].gpkg' with one layer 'lcp_[root]'. An existing file is replaced.
+    '''
+    if backend is None:
+        backend = GrassBackend()
+
+    if not vectors:
+        print(f'No LCPs for {root}. Nothing happens.')
+        return
+
+    name = f'lcp_{root}'
+    out_loc = f'{outpath}/{name}.gpkg'
+    if os.path.exists(out_loc):
+        os.remove(out_loc)
+
+    # Projection of the GRASS location
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(backend.projection())
+
+    ds = ogr.GetDriverByName('GPKG').CreateDataSource(out_loc)
+    # The spatial index is created once at the end instead of being updated with every feature.
+    layer = ds.CreateLayer(name, srs, ogr.wkbLineString, options=['SPATIAL_INDEX=NO'])
+    for field, kind in (('source_sid', ogr.OFTString), ('target_sid', ogr.OFTString),
+                        ('root', ogr.OFTString), ('cost', ogr.OFTReal)):
+        layer.CreateField(ogr.FieldDefn(field, kind))
+    defn = layer.GetLayerDefn()
+
+    # Accumulated costs, one r.what run per costdist raster
+    costs = {}
+
+    ds.StartTransaction()
+    count = 0
+    for vect, point, sid in vectors:
+        if point not in costs:
+            costs[point] = backend.what(f'{point}_costdist_{root}', startpoint)
+        for cat, coords in backend.lines(vect):
+            source = str(sid if sid is not None else cat)
+            geom = ogr.Geometry(ogr.wkbLineString)
+            for x, y in coords:
+                geom.AddPoint_2D(x, y)
+            feature = ogr.Feature(defn)
+            feature.SetGeometry(geom)
+            feature.SetField('source_sid', source)
+            feature.SetField('target_sid', str(point))
+            feature.SetField('root', root)
+            if costs[point].get(source) is not None:
+                feature.SetField('cost', costs[point][source])
+            layer.CreateFeature(feature)
+            count += 1
+    ds.CommitTransaction()
+
+    ds.ExecuteSQL(f"SELECT CreateSpatialIndex('{name}', '{layer.GetGeometryColumn()}')")
+    ds = None
+    print(f'{count} LCPs saved to GPKG named {out_loc}')
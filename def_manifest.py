@@ -0,0 +1,310 @@
+'''
+Checkpoint manifest for the corridor pipeline.
+Outputs used to be reused by name only ("if the output exists, skip it"), so a changed cost surface with the same
+name silently reused old results and a map half-written during a crash counted as done.
+The manifest is a JSON file that records for every output of a stage a key: a hash of the stage name, its
+parameters (site coordinates, flags, percentile, ...) and the digests of its inputs. The digest of a raster created
+by the pipeline is its key, the digest of anything else (imported cost surfaces, tifs) is a hash of its content.
+Content hashes are kept in the manifest with the size and modification time of the files hashed, and only
+calculated again if one of them changed, so a rerun does not read every input.
+Changing an input therefore changes the keys of everything downstream of it, and only those outputs are recreated.
+Outputs are recorded once they are complete, so interrupted outputs are recreated as well.
+Outputs that exist but were never recorded (e.g. created before the manifest was used) are removed and recreated,
+unless adopt=True: then they are recorded with their current key and kept without any check.
+Outputs removed from GRASS after their export by release() keep their record and count as done as long as the
+exported file exists, so a rerun does not create them (and what they were created from) again.
+The file is saved every 'every' records and when the process ends, not after every output.
+'''
+
+import atexit
+import datetime
+import hashlib
+import json
+import os
+import threading
+import grass.script as gs
+from def_backend import GrassBackend
+
+# Database elements that make up a raster map.
+RASTER_ELEMENTS = ['cell', 'fcell', 'cellhd', 'cell_misc']
+
+# Entry of the manifest file holding the content hashes of the inputs, not an output.
+DIGESTS = '_digests'
+
+
+def hash_file(path, h=None):
+    '''
+    Hashes the content of a file.
+    :param path: Path of the file.
+    :param h: Optional hashlib object to update.
+    :return: The hashlib object.
+    '''
+    if h is None:
+        h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h
+
+
+def raster_files(name):
+    '''
+    Lists the files of a GRASS raster in the GRASS database. For rasters linked using r.external the linked file is
+    listed as well.
+    :param name: Raster name, with or without '@MAPSET'.
+    :return: List of tuples (label, path) in the order they are hashed; label is hashed before the file, None for
+    the linked file. None if the raster does not exist.
+    '''
+    found = gs.find_file(name=name, element='cellhd')
+    if not found['file']:
+        return None
+    mapset_path = os.path.dirname(os.path.dirname(found['file']))
+    base = name.split('@')[0]
+
+    files = []
+    for element in RASTER_ELEMENTS:
+        path = os.path.join(mapset_path, element, base)
+        if os.path.isdir(path):
+            for entry in sorted(os.listdir(path)):
+                files.append((entry, os.path.join(path, entry)))
+                # r.external keeps the path of the linked file in cell_misc/[name]/gdal
+                if entry == 'gdal':
+                    with open(os.path.join(path, entry)) as link:
+                        for line in link:
+                            if line.startswith('file:'):
+                                files.append((None, line.split(':', 1)[1].strip()))
+        elif os.path.isfile(path):
+            files.append((element, path))
+    return files
+
+
+def hash_raster(name, files=None):
+    '''
+    Hashes the content of a GRASS raster, i.e. the files of the raster in the GRASS database.
+    For rasters linked using r.external the linked file is hashed as well.
+    :param name: Raster name, with or without '@MAPSET'.
+    :param files: Optional files of the raster as listed by raster_files().
+    :return: Hex digest, None if the raster does not exist.
+    '''
+    if files is None:
+        files = raster_files(name)
+    if files is None:
+        return None
+
+    h = hashlib.sha256()
+    for label, path in files:
+        if label is not None:
+            h.update(label.encode())
+        hash_file(path, h)
+    return h.hexdigest()
+
+
+def stats(files):
+    '''
+    Size and modification time of files, to tell if a content hash is still valid.
+    :param files: List of tuples (label, path) as returned by raster_files().
+    :return: List of [path, size, modification time in ns].
+    '''
+    result = []
+    for label, path in files:
+        stat = os.stat(path)
+        result.append([path, stat.st_size, stat.st_mtime_ns])
+    return result
+
+
+class Manifest:
+    '''
+    Persistent record of the outputs of the pipeline and the keys they were created with.
+    :param path: Path of the JSON file. Created if it does not exist.
+    :param adopt: What to do with outputs that exist but are not in the manifest. False removes them so that they are
+    created again. True records them with the current key and keeps them, e.g. for the first run with a manifest on
+    an existing database. Adopted outputs are trusted: they are not checked against their inputs, so only set it if
+    they are known to be up to date (not after a lost manifest with outputs of changed inputs).
+    :param every: Number of records after which the file is saved. It is also saved by flush() and when the
+    process ends.
+    :param backend: Backend outputs that are out of date are removed through (see def_backend.py), default GRASS.
+    '''
+
+    def __init__(self, path, adopt=False, every=100, backend=None):
+        self.path = path
+        self.entries = {}
+        # Content hashes of this run
+        self.hashes = {}
+        # Content hashes of all runs with the stats of the files hashed, {name: {'stats': [...], 'digest': digest}}
+        self.digests = {}
+        # Outputs can be recorded by parallel runs
+        self.lock = threading.Lock()
+        self.adopt = adopt
+        self.every = every
+        # Number of records not saved yet
+        self.unsaved = 0
+        self.backend = backend if backend is not None else GrassBackend()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+            self.digests = self.entries.pop(DIGESTS, {})
+        atexit.register(self.flush)
+
+    def save(self):
+        '''
+        Writes the manifest. The file is replaced in one step, so a crash does not leave it half-written.
+        :return: None
+        '''
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({**self.entries, DIGESTS: self.digests}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.unsaved = 0
+
+    def flush(self):
+        '''
+        Saves the manifest if outputs were recorded since the last save, e.g. at the end of a stage.
+        :return: None
+        '''
+        with self.lock:
+            if self.unsaved:
+                self.save()
+
+    def digest(self, name):
+        '''
+        Digest of an input: the key of a recorded output, otherwise the hash of its content. The hash is taken from
+        an earlier run if the size and modification time of its files did not change since.
+        :param name: Raster name (with or without '@MAPSET') or path of a file.
+        :return: Hex digest, None for a raster that does not exist.
+        '''
+        base = name.split('@')[0]
+        if base in self.entries:
+            return self.entries[base]['key']
+        if name not in self.hashes:
+            isfile = os.path.isfile(name)
+            files = [(None, name)] if isfile else raster_files(name)
+            if files is None:
+                self.hashes[name] = None
+                return None
+            current = stats(files)
+            cached = self.digests.get(name)
+            if cached is not None and cached['stats'] == current:
+                self.hashes[name] = cached['digest']
+            else:
+                self.hashes[name] = hash_file(name).hexdigest() if isfile else hash_raster(name, files)
+                with self.lock:
+                    self.digests[name] = {'stats': current, 'digest': self.hashes[name]}
+                    self.unsaved += 1
+        return self.hashes[name]
+
+    def key(self, stage, inputs, **params):
+        '''
+        Creates the key of an output.
+        :param stage: Name of the stage; e.g. 'costdist'.
+        :param inputs: List of input rasters or files.
+        :param params: Parameters of the stage, must be serialisable to JSON.
+        :return: Hex digest.
+        '''
+        content = {'stage': stage,
+                   'inputs': [self.digest(i) for i in inputs],
+                   'params': params}
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def current(self, output, key):
+        '''
+        Checks if an output was recorded with the given key.
+        :param output: Name of the output raster or vector, or path of an exported file.
+        :param key: Key as returned by key().
+        :return: True if the output is up to date.
+        '''
+        return self.entries.get(output.split('@')[0], {}).get('key') == key
+
+    def record(self, output, key, stage=''):
+        '''
+        Records a complete output. The manifest is saved every 'every' records, see flush().
+        :param output: Name of the output raster or vector, or path of an exported file.
+        :param key: Key as returned by key().
+        :param stage: Name of the stage, for information only.
+        :return: None
+        '''
+        with self.lock:
+            self.entries[output.split('@')[0]] = {'key': key,
+                                                   'stage': stage,
+                                                   'time': datetime.datetime.now().isoformat()}
+            self.unsaved += 1
+            if self.unsaved >= self.every:
+                self.save()
+
+    def release(self, output, path, catalog=None, element='raster'):
+        '''
+        Removes an output from GRASS after it was exported, keeping its record. needs() counts it as done as long as
+        the exported file exists.
+        :param output: Name of the output raster or vector.
+        :param path: Path of the exported file.
+        :param catalog: Optional RasterCatalog the output is removed from.
+        :param element: 'raster' or 'vector'.
+        :return: None
+        '''
+        name = output.split('@')[0]
+        with self.lock:
+            if name in self.entries:
+                self.entries[name]['exported'] = path
+                self.unsaved += 1
+        self.backend.remove(name, element=element)
+        if catalog is not None:
+            catalog.remove(name)
+
+    def needs(self, outputs, key, catalog, element='raster'):
+        '''
+        Checks if outputs have to be created. Outputs that exist but are not up to date (created from other inputs or
+        not complete) are removed from GRASS and the catalog, so that they are recreated by the usual
+        "if the output does not exist" logic of the stages. Outputs that are not in the manifest are adopted instead
+        if adopt is set, see Manifest. Outputs removed after their export (see release()) are done if they are up to
+        date and the exported file exists; the stages skip them by the return value.
+        :param outputs: List of output names.
+        :param key: Key as returned by key().
+        :param catalog: RasterCatalog of the pipeline, None for vectors.
+        :param element: 'raster' or 'vector'.
+        :return: True if the outputs have to be created.
+        '''
+        def exists(name):
+            if catalog is not None:
+                return name in catalog
+            return self.backend.exists(name, element)
+
+        def done(name):
+            # Exists, or was exported and removed
+            path = self.entries.get(name, {}).get('exported')
+            return exists(name) or (path is not None and os.path.exists(path))
+
+        names = [output.split('@')[0] for output in outputs]
+        if self.adopt:
+            for name in names:
+                if name not in self.entries and exists(name):
+                    print(f'{name} is not in the manifest, it is kept and recorded as up to date.')
+                    self.record(name, key, 'adopted')
+        if all(self.current(name, key) and done(name) for name in names):
+            return False
+
+        for name in names:
+            if exists(name):
+                print(f'{name} is out of date and will be created again.')
+                self.backend.remove(name, element=element)
+                if catalog is not None:
+                    catalog.remove(name)
+            self.entries.pop(name, None)
+        return True
+
+    def needs_file(self, path, key):
+        '''
+        Checks if an exported file has to be created. A file that is not up to date is deleted, a file that is not in
+        the manifest is adopted if adopt is set.
+        :param path: Path of the file.
+        :param key: Key as returned by key().
+        :return: True if the file has to be created.
+        '''
+        if self.adopt and os.path.exists(path) and path not in self.entries:
+            print(f'{path} is not in the manifest, it is kept and recorded as up to date.')
+            self.record(path, key, 'adopted')
+        if os.path.exists(path) and self.current(path, key):
+            return False
+        if os.path.exists(path):
+            print(f'{path} is out of date and will be created again.')
+            os.remove(path)
+        self.entries.pop(path, None)
+        return True
@@ -0,0 +1,304 @@
+'''
+Lower percentile corridors refined from a coarse run, coarse to fine.
+At the native resolution every cost distance and corridor pass covers the whole cost surface, though the lower
+percentile corridor covers a small part of it. Here
+ - the cost surface is coarsened by 'factor' (average of the non-NULL cells of each block, as r.resamp.stats);
+ - cost distance from both sites, the corridor and its percentile are calculated on the coarse grid;
+ - the coarse corridor of a higher percentile (default three times the percentile) is widened by 'buffer' coarse
+   cells into a band; cost distance and corridor are calculated again at the native resolution over the cells of
+   the band only (all others are barriers);
+ - the percentile is taken over the number of cells of the full corridor (as in def_bidir.py), of which the band
+   has to hold at least the rank of the percentile.
+Every cell on the cheapest paths from the sites to a corridor cell has a corridor value as low or lower, so if the
+band holds all cells of the native percentile corridor, their values and the percentile are the same as in a full
+run. If the refined percentile corridor reaches the edge of the band, the band cut it off and the buffer is doubled
+until it does not (at most up to the whole cost surface). Parts of the corridor away from the band (e.g. a second
+route the coarse run did not find) are still not seen, so the result can differ from a full run; compare=True runs
+the full resolution as well and reports the differences (see compare_corridors()). The full run takes the
+percentile over the cells of its corridor, as corridor_perc(); it differs from the refined one if the cost surface
+has cells not reached from the sites.
+The search covers (1/factor)^2 of the cells of the cost surface plus the band, which holds at least the percentile
+share of the cells; the saving is largest for low percentiles.
+
+Usage:
+    corridors_multires('costsurf_slope_1@PERMANENT', cststart, factor=10, buffer=1, compare=True, catalog=catalog)
+'''
+
+import datetime
+from itertools import combinations
+import numpy as np
+from def_backend import GrassBackend
+from def_catalog import RasterCatalog
+from def_corridors import corridor_name, precision_options
+from def_rcost_numpy import accumulate, coord_to_cell
+
+
+# _____________GRIDS_____________
+def coarsen(cost, factor):
+    '''
+    Coarsens a cost array by the average of the non-NULL cells of each block of factor x factor cells.
+    Blocks at the bottom and right edge can be smaller.
+    :param cost: 2D array of cell costs, NaN for NULL cells.
+    :param factor: Number of cells per block side.
+    :return: 2D array of the coarse cell costs, NaN for blocks of NULL cells only.
+    '''
+    rows, cols = cost.shape
+    padded = np.full((-(-rows // factor) * factor, -(-cols // factor) * factor), np.nan)
+    padded[:rows, :cols] = cost
+    blocks = padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor)
+    counts = np.count_nonzero(~np.isnan(blocks), axis=(1, 3))
+    sums = np.nansum(blocks, axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def dilate(mask, cells):
+    '''
+    Widens a mask by a number of cells in every direction (including diagonals).
+    :return: Boolean 2D array.
+    '''
+    # Along the rows, then along the columns of the result.
+    for axis in (0, 1):
+        size = mask.shape[axis]
+        out = mask.copy()
+        for shift in range(1, min(cells, size - 1) + 1):
+            ahead = [slice(None)] * 2
+            behind = [slice(None)] * 2
+            ahead[axis], behind[axis] = slice(shift, None), slice(None, size - shift)
+            out[tuple(ahead)] |= mask[tuple(behind)]
+            out[tuple(behind)] |= mask[tuple(ahead)]
+        mask = out
+    return mask
+
+
+def refine(mask, factor, shape):
+    '''
+    Converts a mask of the coarse grid into the native grid.
+    :return: Boolean 2D array of the shape of the native grid.
+    '''
+    return np.repeat(np.repeat(mask, factor, axis=0), factor, axis=1)[:shape[0], :shape[1]]
+
+
+# _____________CORRIDOR_____________
+def percentile_corridor(cost, starts, percentile, nsres, ewres, knight=True, ncells=None):
+    '''
+    Calculates the lower percentile corridor between two cells over a cost array.
+    :param cost: 2D array of cell costs, NaN for NULL cells (barriers).
+    :param starts: List of the two (row, col) start cells.
+    :param percentile: Percentile (0-100).
+    :param nsres: North-south resolution in map units.
+    :param ewres: East-west resolution in map units.
+    :param knight: Use the knight's move (r.cost -k).
+    :param ncells: Optional number of cells of the full corridor the percentile is taken over (at least the number
+    of corridor cells). Default the corridor cells, as corridor_perc().
+    :return: Tuple (percentile, corridor). corridor is the 2D array of the corridor values below the percentile, NaN
+    elsewhere. percentile is None if the cells are not connected or there are fewer corridor cells than its rank.
+    '''
+    corridor = np.zeros(cost.shape)
+    for start in starts:
+        dist, direction = accumulate(cost, [start], nsres, ewres, knight=knight)
+        corridor += dist
+    corridor /= 2
+    values = np.sort(corridor[~np.isnan(corridor)])
+    if not len(values):
+        return None, corridor
+    if ncells is None:
+        ncells = len(values)
+    # Ranks of the two values to interpolate between, as numpy.percentile (linear).
+    rank = percentile / 100 * (ncells - 1)
+    low, high = int(np.floor(rank)), int(np.ceil(rank))
+    if len(values) <= high:
+        return None, corridor
+    perc = float(values[low] + (values[high] - values[low]) * (rank - low))
+    corridor[corridor >= perc] = np.nan
+    return perc, corridor
+
+
+def multires_corridor(cost, starts, percentile, nsres, ewres, factor=10, buffer=1, coarse_percentile=None, knight=True,
+                      ncells=None):
+    '''
+    Calculates the lower percentile corridor between two cells on a coarse grid first and refines it at the native
+    resolution within a band around the coarse corridor.
+    :param cost: 2D array of cell costs, NaN for NULL cells (barriers).
+    :param starts: List of the two (row, col) start cells.
+    :param percentile: Percentile (0-100).
+    :param nsres: North-south resolution in map units.
+    :param ewres: East-west resolution in map units.
+    :param factor: Number of native cells per coarse cell side.
+    :param buffer: Width of the band around the coarse corridor, in coarse cells. Doubled while the refined corridor
+    reaches the edge of the band.
+    :param coarse_percentile: Percentile of the coarse corridor the band is built from. Default three times the
+    percentile: averaging over blocks can make another route the cheapest, and a band around the coarse corridor of
+    the same percentile then misses parts of the native one.
+    :param knight: Use the knight's move (r.cost -k).
+    :param ncells: Number of cells of the full corridor the percentile is taken over. Default the number of non-NULL
+    cells of the cost array.
+    :return: Tuple (percentile, corridor, band). percentile is None if the cells are not connected; corridor is the
+    2D array of the corridor values below the percentile, NaN elsewhere; band is the boolean 2D array of the cells
+    searched at the native resolution.
+    '''
+    if ncells is None:
+        ncells = int(np.count_nonzero(~np.isnan(cost)))
+    if coarse_percentile is None:
+        coarse_percentile = min(3 * percentile, 100)
+
+    # ________Coarse run________
+    coarse = coarsen(cost, factor)
+    coarse_starts = [(row // factor, col // factor) for row, col in starts]
+    perc, coarse_corridor = percentile_corridor(coarse, coarse_starts, coarse_percentile, nsres * factor,
+                                                ewres * factor, knight=knight)
+    if perc is None:
+        return None, coarse_corridor, np.zeros(cost.shape, dtype=bool)
+    print(f' coarse {coarse_percentile}th percentile: {perc}, {np.count_nonzero(~np.isnan(coarse_corridor))} of '
+          f'{coarse.size} coarse cells')
+    core = ~np.isnan(coarse_corridor)
+    for row, col in coarse_starts:
+        core[row, col] = True
+
+    # ________Refine within the band________
+    while True:
+        band = refine(dilate(core, buffer), factor, cost.shape)
+        if band.all():
+            # The band covers the whole cost surface, i.e. a full run.
+            perc, corridor = percentile_corridor(cost, starts, percentile, nsres, ewres, knight=knight)
+            return perc, corridor, band
+        perc, corridor = percentile_corridor(np.where(band, cost, np.nan), starts, percentile, nsres, ewres,
+                                             knight=knight, ncells=ncells)
+        # Cells of the band next to cells outside of it.
+        edge = band & dilate(~band, 1)
+        if perc is None:
+            print(f' band of {buffer} coarse cells holds fewer cells than the rank of the percentile, widening')
+        elif (edge & ~np.isnan(corridor)).any():
+            print(f' refined corridor reaches the edge of the band of {buffer} coarse cells, widening')
+        else:
+            return perc, corridor, band
+        buffer *= 2
+
+
+# _____________REPORT_____________
+def compare_corridors(refined, full):
+    '''
+    Compares a refined percentile corridor against the one of a full run at the native resolution.
+    :param refined: 2D array of the refined corridor, NaN outside.
+    :param full: 2D array of the corridor of the full run, NaN outside.
+    :return: Dictionary of the number of cells in both, only in the refined and only in the full corridor, their
+    overlap (cells in both / cells in either) and the largest difference of the values of the cells in both.
+    '''
+    a = ~np.isnan(refined)
+    b = ~np.isnan(full)
+    both = a & b
+    either = np.count_nonzero(a | b)
+    return {'both': int(np.count_nonzero(both)),
+            'refined_only': int(np.count_nonzero(a & ~b)),
+            'full_only': int(np.count_nonzero(b & ~a)),
+            'overlap': float(np.count_nonzero(both) / either) if either else 1.0,
+            'max_diff': float(np.max(np.abs(refined[both] - full[both]))) if both.any() else 0.0}
+
+
+# _____________CORRIDORS_____________
+def corridors_multires(raster, cststart, pairs=None, percentile=10, factor=10, buffer=1, coarse_percentile=None,
+                       knight=True, ncells=None, compare=False, catalog=None, manifest=None, backend=None,
+                       precision=None):
+    '''
+    Creates the lower percentile corridors between pairs of sites from a cost surface, coarse to fine (see
+    multires_corridor()), without cost distance raster and full corridors. The cost surface is read once for all
+    pairs. Output names follow corridor_perc(): 'corridor_[a]_[b]_[costdist root]_[percentile]perc', where the
+    costdist root is the name of the cost surface with 'costsurf' replaced by 'costdist', as created by costdist().
+    :param raster: Name of the cost surface.
+    :param cststart: List of sites of pattern [x, y, sid].
+    :param pairs: Optional list of tuples (sid, sid). Default all pairs of sites, in the order of cststart.
+    :param percentile: Percentile at and above which cells are promoted to NULL.
+    :param factor: Number of native cells per coarse cell side.
+    :param buffer: Width of the band around the coarse corridor that is refined, in coarse cells.
+    :param coarse_percentile: Percentile of the coarse corridor the band is built from, default three times the
+    percentile (see multires_corridor()).
+    :param knight: Use the knight's move (r.cost -k).
+    :param ncells: Number of cells the percentile is taken over. Default the number of non-NULL cells of the cost
+    surface.
+    :param compare: Also calculate each corridor at the full native resolution and print the differences (see
+    compare_corridors()). Takes as long as the full run.
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param manifest: Optional Manifest (see def_manifest.py). A corridor created from another cost surface, site
+    coordinates, factor, buffer or coarse percentile, or not recorded as complete, is created again.
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :param precision: Optional Precision (see def_precision.py) the corridors are stored in. They are calculated in
+    double precision from the cost surface and rounded once when written; in mode 'int' they are in scaled units.
+    :return: Dictionary {output: report} of the comparisons if compare is True, else empty.
+    '''
+    if backend is None:
+        backend = GrassBackend()
+    if catalog is None:
+        catalog = RasterCatalog(backend=backend)
+
+    coords = {str(sid): (x, y) for x, y, sid in cststart}
+    if pairs is None:
+        pairs = list(combinations(coords, 2))
+    rast = raster.split("@")[0].replace("costsurf", "costdist")
+    flags = 'kn' if knight else 'n'
+    reports = {}
+
+    # ________Pairs still to create________
+    todo = []
+    keys = {}
+    for a, b in pairs:
+        out = f'{corridor_name(a, b, rast)}_{percentile}perc'
+        # Remove the corridor if it is out of date, so that it is created again below.
+        if manifest is not None:
+            keys[out] = manifest.key('corridor_multires', [raster], coordinates=(coords[str(a)], coords[str(b)]),
+                                     percentile=percentile, flags=flags, factor=factor, buffer=buffer,
+                                     coarse_percentile=coarse_percentile, **precision_options(precision))
+            manifest.needs([out], keys[out], catalog)
+        if out in catalog:
+            print(f'!!! {out}\n  already exists and will not be created.')
+            continue
+        todo.append((str(a), str(b), out))
+    if not todo:
+        return reports
+
+    # ________Read the cost surface once________
+    region = backend.region(raster)
+    cost = backend.read(raster).astype(np.float64)
+    if ncells is None:
+        ncells = int(np.count_nonzero(~np.isnan(cost)))
+
+    for a, b, out in todo:
+        starts = [coord_to_cell(*coords[sid], region) for sid in (a, b)]
+        if None in starts:
+            print(f'Site {a} or {b} is outside of the region of {raster}. Nothing happens.')
+            continue
+
+        print(f'Creating the {percentile}th percentile corridor between sites {a} and {b} over\n {raster}\n'
+              f' coarse to fine, factor {factor}')
+        begin_time = datetime.datetime.now()
+        perc, corridor, band = multires_corridor(cost, starts, percentile, region['nsres'], region['ewres'],
+                                                 factor=factor, buffer=buffer, coarse_percentile=coarse_percentile,
+                                                 knight=knight, ncells=ncells)
+        if perc is None:
+            print(f'Sites {a} and {b} are not connected over {raster}. Nothing happens.')
+            continue
+        print(f'{percentile}th percentile: {perc}, {np.count_nonzero(band)} of {cost.size} cells refined')
+        runtime = (datetime.datetime.now() - begin_time).total_seconds()
+
+        if compare:
+            full_begin = datetime.datetime.now()
+            full_perc, full = percentile_corridor(cost, starts, percentile, region['nsres'], region['ewres'],
+                                                  knight=knight)
+            full_runtime = (datetime.datetime.now() - full_begin).total_seconds()
+            reports[out] = compare_corridors(corridor, full)
+            reports[out].update({'percentile': perc, 'full_percentile': full_perc, 'runtime': runtime,
+                                 'full_runtime': full_runtime})
+            print(f'Compared to the full resolution run ({full_runtime} seconds): {reports[out]["both"]} cells in '
+                  f'both, {reports[out]["refined_only"]} only refined, {reports[out]["full_only"]} only full, '
+                  f'overlap {reports[out]["overlap"]:.4f}, largest difference {reports[out]["max_diff"]}, '
+                  f'percentile {full_perc}')
+
+        if precision is not None:
+            backend.write(out, precision.encode_array(corridor), overwrite=True, mtype=precision.mtype)
+            precision.check(out, backend)
+        else:
+            backend.write(out, corridor, overwrite=True)
+        catalog.add(out)
+        if manifest is not None:
+            manifest.record(out, keys[out], 'corridor_multires')
+        print(f'It took {runtime} seconds to create: \n', out)
+    return reports
@@ -0,0 +1,81 @@
+'''
+Function to join corridors into a corridor network in a single pass.
+The steps of _archaeology_corridor_network.py (stretch every corridor to 1-255, join them with nmin(),
+multiply by 100 and round) are combined into one r.mapcalc run, so every input raster is read once and only the
+final integer raster is written. The min and max values of the inputs are taken from the range stored with
+each raster (r.info), which does not read the raster data.
+Optionally the same run also creates
+ - an argmin raster: which corridor (numbered in order of the input list) holds the minimum in each cell;
+ - a coverage raster: how many corridors are not NULL in each cell.
+'''
+
+import datetime
+from def_backend import GrassBackend
+
+
+def network_join(rasterlist, output, stretch_min=1, stretch_max=255, scale=100, ranges=None, argmin=None, coverage=None,
+                 backend=None):
+    '''
+    Stretches each raster to stretch_min-stretch_max, joins them using the minimum value across all raster
+    (excluding NULL cells) and rounds the result multiplied by scale to integer, in one r.mapcalc run.
+    Stretch formula as in _archaeology_corridor_network.py:
+    ( x - min(x) ) * (smax - smin) / ( max(x) - min(x) ) + smin
+    :param rasterlist: List of corridor raster to join.
+    :param output: Name of the joined integer raster; 1-255 * 100 fits into Int16 for export.
+    :param stretch_min: Lower end of the stretch.
+    :param stretch_max: Upper end of the stretch.
+    :param scale: Factor applied before rounding to integer.
+    :param ranges: Optional dictionary {raster: (min, max)} of precomputed min and max values. Rasters not in it
+    are looked up using r.info.
+    :param argmin: Optional name of a raster holding the number (1 to n, order of rasterlist) of the corridor with
+    the minimum value in each cell. The numbers are labelled with the raster names as categories.
+    :param coverage: Optional name of a raster holding the number of corridors that are not NULL in each cell.
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :return: The joined raster, plus the argmin and coverage raster if requested.
+    '''
+    if backend is None:
+        backend = GrassBackend()
+    if ranges is None:
+        ranges = {}
+
+    # ________Get min and max of each raster________
+    stretched = []
+    for i, rast in enumerate(rasterlist, start=1):
+        if rast in ranges:
+            map_min, map_max = ranges[rast]
+        else:
+            # r.info reports the range stored with the raster, no need to read it as r.univar does.
+            info = backend.info(rast)
+            map_min, map_max = info['min'], info['max']
+        # As floats, so that corridors stored as scaled CELL (see def_precision.py) are not divided as integers.
+        map_min, map_max = float(map_min), float(map_max)
+        print(f'{i}: {rast}\n min: {map_min} max: {map_max}')
+        stretched.append(f'v{i} = ({rast}-{map_min})*({stretch_max}-{stretch_min})/({map_max}-{map_min}) + {stretch_min}')
+
+    # ________Build the r.mapcalc expressions________
+    # eval() defines the stretched values as variables, so they can be used more than once per expression.
+    variables = ', '.join(stretched)
+    names = ', '.join(f'v{i}' for i in range(1, len(rasterlist) + 1))
+    expressions = [f'{output} = eval({variables}, round(nmin({names}) * {scale}))']
+
+    if argmin:
+        # Nested if() from the last to the first raster. '|||' ignores NULL, so NULL cells are skipped.
+        choice = 'null()'
+        for i in range(len(rasterlist), 0, -1):
+            choice = f'if(isnull(v{i}) ||| v{i} != joined, {choice}, {i})'
+        expressions.append(f'{argmin} = eval({variables}, joined = nmin({names}), {choice})')
+
+    if coverage:
+        counts = ' + '.join(f'(!isnull({rast}))' for rast in rasterlist)
+        expressions.append(f'{coverage} = {counts}')
+
+    # ________Run r.mapcalc once________
+    backend.region(rasterlist)
+    begin_time = datetime.datetime.now()
+    backend.mapcalc(expressions)
+    runtime_join = (datetime.datetime.now() - begin_time).total_seconds()
+    print(f'Joining {len(rasterlist)} raster into {output} took {runtime_join/60} mins.')
+
+    if argmin:
+        # Label the numbers of the argmin raster with the names of the corridors.
+        backend.categories(argmin, {i: rast.split("@")[0] for i, rast in enumerate(rasterlist, start=1)})
@@ -0,0 +1,209 @@
+'''
+Precision of the rasters written by the corridor pipeline.
+Cost distance and corridors used to be DCELL (8 bytes per cell) from r.cost to the export, where routgdal() then
+wrote Float32 anyway. A Precision passed to costdist(), the corridor functions and tenperc() makes them write
+ - 'float': FCELL (4 bytes), about 7 significant digits;
+ - 'int': CELL (4 bytes), the values multiplied by 'scale' and rounded. All following rasters (corridors,
+   thresholded corridors, exports) stay in these scaled units; the network join stretches every corridor to 1-255,
+   so the scale cancels there.
+r.cost gets a cost surface of the same type (see surface()), as it writes the type of its input, and the NumPy and
+tiled writers store the type directly, so no raster is written in DCELL first and converted. Every raster read and
+written after r.cost then has half the size of DCELL. The expected (maximum) error of each
+output against DCELL is printed and kept in Precision.errors; summary() prints the largest.
+
+Usage:
+    precision = Precision('float')
+    costdist(costsurfaces, cststart, catalog=catalog, precision=precision)
+    corridors_batch(combos, catalog=catalog, precision=precision)
+    precision.summary()
+'''
+
+import math
+import numpy as np
+
+# Null value of CELL raster
+CELL_NULL = -2147483648
+
+
+class Precision:
+    '''
+    Storage type of the rasters of the pipeline.
+    :param mode: 'double' (DCELL, as without a Precision), 'float' (FCELL) or 'int' (CELL of the values times scale).
+    :param scale: Factor applied before rounding to integer in mode 'int'; e.g. 100 keeps two decimals.
+    '''
+
+    MTYPES = {'double': 'DCELL', 'float': 'FCELL', 'int': 'CELL'}
+
+    def __init__(self, mode='float', scale=100):
+        if mode not in self.MTYPES:
+            raise ValueError(f'Unknown precision {mode}, choose from {", ".join(self.MTYPES)}.')
+        self.mode = mode
+        self.scale = scale
+        self.mtype = self.MTYPES[mode]
+        # Expected maximum error of every output, in the units of the cost surface
+        self.errors = {}
+        # Smallest cell value of the cost surfaces created by surface() in mode 'int', in stored units
+        self.minimum = {}
+        # Number of roundings of every output (see error()), carried on to the outputs calculated from it
+        self.steps = {}
+
+    def options(self):
+        '''
+        :return: Parameters for the manifest keys (see def_manifest.py), empty for 'double' so that existing outputs
+        keep their keys.
+        '''
+        if self.mode == 'double':
+            return {}
+        if self.mode == 'int':
+            return {'precision': self.mode, 'scale': self.scale}
+        return {'precision': self.mode}
+
+    # _____________MAP ALGEBRA_____________
+    def encode(self, expr):
+        '''
+        r.mapcalc expression storing real values (e.g. accumulated cost) in the type of this precision.
+        '''
+        if self.mode == 'float':
+            return f'float({expr})'
+        if self.mode == 'int':
+            return f'round(({expr}) * {self.scale})'
+        return expr
+
+    def cast(self, expr):
+        '''
+        r.mapcalc expression storing values calculated from rasters of this precision, already scaled.
+        '''
+        if self.mode == 'float':
+            return f'float({expr})'
+        if self.mode == 'int':
+            return f'round({expr})'
+        return expr
+
+    def encode_array(self, values):
+        '''
+        NumPy version of encode(): real values as they are stored, NaN for NULL.
+        '''
+        if self.mode == 'float':
+            return values.astype(np.float32)
+        if self.mode == 'int':
+            values = values * self.scale
+            return np.sign(values) * np.floor(np.abs(values) + 0.5)
+        return values
+
+    def array(self, values):
+        '''
+        NumPy version of cast(): the values as they are stored, NaN for NULL.
+        '''
+        if self.mode == 'float':
+            return values.astype(np.float32).astype(np.float64)
+        if self.mode == 'int':
+            # r.mapcalc rounds halves away from zero.
+            return np.sign(values) * np.floor(np.abs(values) + 0.5)
+        return values
+
+    # _____________ERROR_____________
+    def error(self, maximum, steps=1):
+        '''
+        Expected maximum error, in the units of the cost surface.
+        :param maximum: Largest absolute value of the raster, in stored units.
+        :param steps: Number of roundings since the cost surface, e.g. those of both cost distance raster plus one
+        for a corridor (see inherited()).
+        :return: Error as float.
+        '''
+        if self.mode == 'float':
+            # Half a unit in the last place of a 24 bit mantissa.
+            unit = abs(maximum) * 2.0 ** -24
+        elif self.mode == 'int':
+            unit = 0.5 / self.scale
+        else:
+            unit = abs(maximum) * 2.0 ** -53
+        return unit * steps
+
+    def report(self, name, maximum, steps=1):
+        '''
+        Prints and keeps the expected error of an output.
+        :return: None
+        '''
+        if self.mode == 'int':
+            # Check the scaled values fit into CELL.
+            if abs(maximum) > -CELL_NULL - 1:
+                raise ValueError(f'{name} exceeds the range of CELL with scale {self.scale}, use a smaller scale.')
+            maximum = maximum / self.scale
+        self.steps[name.split("@")[0]] = steps
+        self.errors[name.split("@")[0]] = self.error(maximum, steps)
+        print(f'{name} stored as {self.mtype}, expected error up to {self.errors[name.split("@")[0]]:.3g}')
+
+    def inherited(self, *names):
+        '''
+        Number of roundings an output carries from the rasters it is calculated from: their errors add up, e.g. a
+        corridor has those of both cost distance raster. Raster not reported in this run count as one rounding.
+        :param names: Raster names (or paths) of the inputs.
+        :return: Number of roundings as int.
+        '''
+        return sum(self.steps.get(name.split("@")[0], 1) for name in names)
+
+    def summary(self):
+        '''
+        Prints the largest expected error of all outputs.
+        :return: None
+        '''
+        if not self.errors:
+            print(f'No outputs stored as {self.mtype}.')
+            return
+        name = max(self.errors, key=self.errors.get)
+        print(f'{len(self.errors)} outputs stored as {self.mtype}, largest expected error {self.errors[name]:.3g} '
+              f'({name}).')
+
+    def check(self, name, backend, surface=None):
+        '''
+        Prints and keeps the expected error of an output already stored in the type of this precision.
+        :param name: Raster name.
+        :param backend: Backend (see def_backend.py).
+        :param surface: Optional cost surface created by surface() the raster was calculated from by r.cost. In mode
+        'int' every cell cost was rounded, so the error grows with the number of cells a path crosses.
+        :return: None
+        '''
+        info = backend.info(name)
+        maximum = max(abs(info['min']), abs(info['max']))
+        steps = 1
+        if self.mode == 'int' and surface in self.minimum:
+            # At most one rounded cell cost per smallest cell cost of the accumulated cost.
+            steps += math.ceil(maximum / max(self.minimum[surface], 1))
+        self.report(name, maximum, steps)
+
+    # _____________CONVERSION_____________
+    def surface(self, raster, backend):
+        '''
+        Cost surface in the type of this precision, so that r.cost writes the cost distance in that type straight
+        away. In mode 'int' the cell costs are multiplied by scale and rounded.
+        :param raster: Name of the cost surface.
+        :param backend: Backend (see def_backend.py).
+        :return: Name of the cost surface to run r.cost on; raster itself if it is already stored in that type.
+        '''
+        if self.mode == 'double' or (self.mode == 'float' and backend.info(raster)['datatype'] == 'FCELL'):
+            return raster
+        name = f'tmp_{raster.split("@")[0]}_{self.mode}'
+        backend.region(raster)
+        backend.mapcalc(f'{name} = {self.encode(raster)}')
+        if self.mode == 'int':
+            self.minimum[name] = backend.info(name)['min']
+        return name
+
+    def convert(self, name, backend):
+        '''
+        Stores a raster written in DCELL in the type of this precision, e.g. the outputs of a base cost surface
+        that are kept in DCELL until the other cost surfaces are updated from them (see def_rcost_run.py). Raster
+        already of that type are not read again.
+        :param name: Raster name.
+        :param backend: Backend (see def_backend.py).
+        :return: None
+        '''
+        info = backend.info(name)
+        if self.mode != 'double' and info['datatype'] != self.mtype:
+            temp = f'{name.split("@")[0]}_{self.mode}'
+            backend.region(name)
+            backend.mapcalc(f'{temp} = {self.encode(name)}')
+            backend.remove(name.split("@")[0])
+            backend.rename(temp, name.split("@")[0])
+            info = backend.info(name)
+        self.report(name, max(abs(info['min']), abs(info['max'])))
@@ -0,0 +1,114 @@
+'''
+Recode of corridors into percentile classes, for the validation export.
+Every raster is recoded into a Byte class raster: class i holds the cells between the i-th and the (i+1)-th of the
+requested percentiles, e.g. with percs = range(0, 99) class 1 holds the lowest percent of the corridor and class 99
+the highest two percent. All breakpoints are taken by one r.quantile run and the classes are written by one r.recode
+run, so the work does not grow with the number of percentiles. The breakpoints are written to a CSV file next to the
+export.
+
+Usage:
+    quantrecode_batch(files, range(0, 99), '/export/home/fkj22/rcostconvol/out', nprocs=4, catalog=catalog)
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from def_backend import GrassBackend
+from def_catalog import RasterCatalog
+
+
+def quantrecode(rast, percs, filepath, catalog=None, manifest=None, backend=None, env=None):
+    '''
+    Recodes a raster into percentile classes.
+    Cells at or above the i-th breakpoint (sorted) and below the next one get class i + 1; cells below the first
+    breakpoint (none if percs starts at 0) get class 0.
+    :param rast: Name of the raster, e.g. 'corridor_1_2_costdist_slope_1_10perc@PERMANENT'.
+    :param percs: Percentiles of the breakpoints (0-100); at most 255.
+    :param filepath: Folder of the breakpoint file '[rast]_recoded_breaks.csv'.
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param manifest: Optional Manifest (see def_manifest.py). A recode of a raster that changed since, or with other
+    percentiles, is created again.
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :param env: Optional environment of the module runs, e.g. from backend.region_env(rast). Default the current
+    region, which has to be set to the raster.
+    :return: Name of the recoded raster '[rast]_recoded'.
+    '''
+    if backend is None:
+        backend = GrassBackend()
+    if catalog is None:
+        catalog = RasterCatalog(backend=backend)
+
+    percs = sorted(float(p) for p in percs)
+    if len(percs) > 255:
+        raise ValueError(f'{len(percs)} percentiles do not fit into a Byte raster, at most 255.')
+
+    name = rast.split("@")[0]
+    output = f'{name}_recoded'
+
+    # Remove the recode if it is out of date, so that it is created again below.
+    if manifest is not None:
+        key = manifest.key('quantrecode', [rast], percentiles=percs)
+        # Also up to date if it was exported and removed since (see Manifest.release()).
+        if not manifest.needs([output], key, catalog):
+            print(f'!!! {output}\n  is up to date and will not be created.')
+            return output
+
+    if output in catalog:
+        print(f'!!! {output}\n  already exists and will not be created.')
+        return output
+
+    # ________All breakpoints in one r.quantile run________
+    breaks = backend.quantile(rast, percs, env=env)
+
+    # ________All classes in one r.recode run________
+    # r.recode gives a value within several rules the value of the last rule, so each class reaches from its
+    # breakpoint up to (excluding) the next one.
+    rules = [(None, breaks[0], 0)]
+    for i, low in enumerate(breaks):
+        high = breaks[i + 1] if i + 1 < len(breaks) else None
+        rules.append((low, high, i + 1))
+    backend.recode(rast, output, rules, env=env)
+    catalog.add(output)
+
+    with open(os.path.join(filepath, f'{output}_breaks.csv'), 'w') as f:
+        f.write('class,percentile,value\n')
+        for i, (p, value) in enumerate(zip(percs, breaks)):
+            f.write(f'{i + 1},{p:g},{value!r}\n')
+
+    if manifest is not None:
+        manifest.record(output, key, 'quantrecode')
+    print(f'{rast} recoded into {len(breaks)} percentile classes: {output}')
+    return output
+
+
+def quantrecode_batch(rasterlist, percs, filepath, nprocs=1, catalog=None, manifest=None, backend=None):
+    '''
+    Recodes many rasters into percentile classes, see quantrecode().
+    :param rasterlist: List of rasters to recode.
+    :param percs: Percentiles of the breakpoints (0-100); at most 255.
+    :param filepath: Folder of the breakpoint files.
+    :param nprocs: Number of rasters recoded at the same time. Each gets its own region through GRASS_REGION, so
+    the region of the mapset is not changed.
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param manifest: Optional Manifest (see def_manifest.py), as in quantrecode().
+    :param backend: Backend to run on (see def_backend.py), default GRASS.
+    :return: List of the recoded rasters.
+    '''
+    if backend is None:
+        backend = GrassBackend()
+    if catalog is None:
+        catalog = RasterCatalog(backend=backend)
+
+    def run(rast):
+        return quantrecode(rast, percs, filepath, catalog=catalog, manifest=manifest, backend=backend,
+                           env=backend.region_env(rast))
+
+    if nprocs > 1:
+        with ThreadPoolExecutor(max_workers=nprocs) as pool:
+            return list(pool.map(run, rasterlist))
+
+    outputs = []
+    for rast in rasterlist:
+        # Set the computational region to the raster, as in tenperc().
+        backend.region(rast)
+        outputs.append(quantrecode(rast, percs, filepath, catalog=catalog, manifest=manifest, backend=backend))
+    return outputs
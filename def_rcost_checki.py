@@ -1,4 +1,8 @@
 import grass.script as gs
+from def_rcost_parallel import rcost_parallel
+from def_catalog import RasterCatalog
+from def_scheduler import parse_estimates
+from def_region import region_env
 
 
 # _____________START GRASS SESSION_____________ /// NOT NECESSARY AS ONLY FUNCTION DEFINED HERE
@@ -28,20 +32,32 @@ import grass.script as gs
 
 # _____________R.COST: CHECK DISK SPACE AND MEMORY REQUIREMENTS_____________
 # Step 3: r.cost using -i flag - check info on disk space and memory requirements of r.cost run
-def costdistcheck(costsurfaces, cststart):
+def costdistcheck(costsurfaces, cststart, nprocs=1, catalog=None):
     '''
     Prints info about disk space and memory requirements of r.cost for several cost surfaces and start points given as input
     :param costsurfaces: list of strings containing names of costsurfaces
     :param cststart: list of points of pattern ... TODO
-    :return: cost distance raster from each point for each costsurface given as input
+    :param nprocs: Number of r.cost checks at the same time, each in its own temporary mapset (see def_rcost_parallel.py).
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :return: Dictionary {output name: estimate} of the memory and disk space each r.cost run will need, see
+    def_scheduler.parse_estimates(). Can be passed to costdist() to schedule the runs.
     '''
+    if catalog is None:
+        catalog = RasterCatalog()
+
+    # r.cost checks to be executed in parallel.
+    jobs = []
+    # Parsed estimates per cost distance raster.
+    estimates = {}
+
     for raster in costsurfaces:
         # Create output strings
         namedist = f'{raster.replace("costsurf", "costdist")}'
         namedir = f'{raster.replace("costsurf", "movdir")}'
 
         # set region
-        gs.run_command('g.region', raster=raster)
+        # Region of the checks, passed to r.cost through GRASS_REGION (see def_region.py).
+        env = region_env(raster=raster)
 
         for x, y, sid in cststart:
 
@@ -49,32 +65,40 @@ def costdistcheck(costsurfaces, cststart):
             outdist = f'{sid}_{namedist}'
             movdir = f'{sid}_{namedir}'
 
-            # Check file does not already exist, create list of raster
-            rasts = gs.list_strings(type='raster',
-                                    mapset='PERMANENT'
-                                    )
-            # Create a list of rasters without mapset information. GRASS will print out the raster names of pattern [name]@[MAPSET].
-            cleanrasts = []
-            for rast in rasts:
-                substring = rast.split("@")[0]
-                cleanrasts.append(substring)
-
-            # Check that the corridor does not already exist in the PERMANENT mapset.
-            if outdist or movdir not in cleanrasts:
+            # Check that the outputs do not already exist in the PERMANENT mapset.
+            if outdist not in catalog or movdir not in catalog:
+                if nprocs > 1:
+                    # Collect the check, all of them are started in parallel below.
+                    jobs.append({'input': raster,
+                                 'output': outdist,
+                                 'outdir': movdir,
+                                 'coordinates': (x, y),
+                                 'memory': 3000,
+                                 'flags': 'kni'})
+                    continue
                 # Run!
                 print(f'\nCalculating r.cost over\n {raster}')
                 print(f' from {sid}\n creating: ')
                 print(f' - {outdist}')
                 print(f' - {movdir}')
-                gs.run_command('r.cost',
-                               input = raster,
-                               output = outdist,
-                               start_coordinates = (x, y),
-                               outdir = movdir,
-                               memory=3000,
-                               flags = 'kni'
-                               )
+                stdout = gs.read_command('r.cost',
+                                         input = raster,
+                                         output = outdist,
+                                         start_coordinates = (x, y),
+                                         outdir = movdir,
+                                         memory=3000,
+                                         flags = 'kni',
+                                         env=env
+                                         )
+                print(stdout)
+                estimates[outdist.split('@')[0]] = parse_estimates(stdout)
 
             else:
                 print('File already exists.')
-                pass
\ No newline at end of file
+                pass
+
+    for job, stdout in rcost_parallel(jobs, nprocs):
+        print(f'\nr.cost check for {job["output"]}:\n{stdout}')
+        estimates[job['output'].split('@')[0]] = parse_estimates(stdout)
+
+    return estimates
@@ -0,0 +1,431 @@
+'''
+In-process alternative to r.cost.
+The cost surface is read once into a NumPy array and an accumulated cost search (Dijkstra, using a binary heap)
+is run from every start point on that array. Outputs are written with the same names and encodings as r.cost, i.e.
+a cumulative cost raster and a movement direction raster in degrees counterclockwise from east, so that corridors()
+and lcp() (r.path format='degree') can use them without any change.
+
+Cost of a move between two cells follows r.cost: the average cost of the cells crossed times the distance between
+the cell centres, measured in cells of the east-west resolution (r.cost: EW_fac = 1, NS_fac = nsres / ewres), not in
+map units. For the knight's move (-k) the two cells in between are included in the average.
+
+The search is a loop over the cells in Python (heapq), not vectorised. It saves reading the cost surface and starting
+r.cost once per start point, and allows the incremental updates below, but per cell it is much slower than r.cost
+(written in C). On large cost surfaces r.cost (costdist(engine='rcost')) is the faster choice.
+
+For scenario runs over cost surfaces edited from a base (e.g. a dam or a water mask), incremental() updates the
+outputs over the base instead of searching the whole grid again, with the same result as a full search.
+'''
+
+import heapq
+import math
+import numpy as np
+
+
+# _____________NEIGHBOURHOOD_____________
+def moves(knight=True):
+    '''
+    Creates the list of moves considered from every cell.
+    :param knight: If True (r.cost -k) the 8 knight's moves are added to the 8 neighbours (16 moves in total).
+    :return: List of tuples (drow, dcol, via, degree). 'via' holds the offsets of the cells crossed by a knight's move,
+    'degree' is the r.cost movement direction stored in the cell that is reached by this move, i.e. the direction
+    pointing back to the cell it was reached from, in degrees counterclockwise from east (east is 360, not 0).
+    '''
+    offsets = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+    if knight:
+        offsets += [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+
+    result = []
+    for dr, dc in offsets:
+        # Cells crossed by a knight's move, r.cost averages their costs as well.
+        if abs(dr) == 2:
+            via = ((dr // 2, 0), (dr // 2, dc))
+        elif abs(dc) == 2:
+            via = ((0, dc // 2), (dr, dc // 2))
+        else:
+            via = ()
+        # Direction from the reached cell back to the present cell. Rows count southwards, hence +dr is north.
+        # Knight's moves are coded in multiples of 22.5 degrees as in r.cost.
+        angle = math.degrees(math.atan2(dr, -dc)) % 360
+        degree = round(angle / 22.5) * 22.5 or 360.0
+        result.append((dr, dc, via, degree))
+    return result
+
+
+def step_length(dr, dc, nsres, ewres):
+    '''
+    Distance of a move between two cell centres in cells of the east-west resolution, as in r.cost.
+    :param dr: Rows moved.
+    :param dc: Columns moved.
+    :param nsres: North-south resolution in map units.
+    :param ewres: East-west resolution in map units.
+    :return: Distance as float.
+    '''
+    return math.hypot(dr * nsres / ewres, dc)
+
+
+# _____________ACCUMULATED COST SEARCH_____________
+def spread(cost, dist, pred, heap, shape, nsres, ewres, movelist, limit=None, settled=None):
+    '''
+    Runs the accumulated cost search on flat lists in place. Split from accumulate() so that other engines can start
+    from partially solved grids or stop at a cost limit and continue later.
+    :param cost: Flat list of cell costs, NaN for NULL cells (barriers).
+    :param dist: Flat list of accumulated costs, math.inf for cells not reached yet. Updated in place.
+    :param pred: Flat list of the index into movelist by which each cell was reached, -1 for none. Updated in place.
+    :param heap: Heap of (accumulated cost, flat index) tuples to spread from. Updated in place.
+    :param shape: (rows, cols) of the grid.
+    :param nsres: North-south resolution in map units.
+    :param ewres: East-west resolution in map units.
+    :param movelist: List of moves as created by moves().
+    :param limit: Optional accumulated cost at which to stop. Cells beyond the limit stay on the heap.
+    :param settled: Optional list the flat index of every cell is appended to once its accumulated cost is final.
+    :return: None
+    '''
+    rows, cols = shape
+    # Precompute the distance of every move in cells.
+    steps = [(dr, dc, tuple(r * cols + c for r, c in via), via, step_length(dr, dc, nsres, ewres))
+             for dr, dc, via, degree in movelist]
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    isnan = math.isnan
+
+    while heap:
+        d, i = heap[0]
+        if limit is not None and d > limit:
+            break
+        heappop(heap)
+        # Skip outdated heap entries.
+        if d > dist[i]:
+            continue
+        if settled is not None:
+            settled.append(i)
+        row, col = divmod(i, cols)
+        ci = cost[i]
+        for k, (dr, dc, vias, via, length) in enumerate(steps):
+            r = row + dr
+            c = col + dc
+            if r < 0 or r >= rows or c < 0 or c >= cols:
+                continue
+            j = i + dr * cols + dc
+            cj = cost[j]
+            if isnan(cj):
+                continue
+            if vias:
+                # Knight's move: average over the start, end and the two cells crossed.
+                total = ci + cj + cost[i + vias[0]] + cost[i + vias[1]]
+                if isnan(total):
+                    continue
+                nd = d + total / 4 * length
+            else:
+                nd = d + (ci + cj) / 2 * length
+            if nd < dist[j]:
+                dist[j] = nd
+                pred[j] = k
+                heappush(heap, (nd, j))
+
+
+def accumulate(cost, starts, nsres, ewres, knight=True, keep_nulls=True, max_cost=None):
+    '''
+    Calculates the accumulated cost and movement direction from one or more start cells over a cost array.
+    :param cost: 2D NumPy array of cell costs. NULL cells are NaN and act as barriers.
+    :param starts: List of (row, col) tuples of the start cells.
+    :param nsres: North-south resolution in map units.
+    :param ewres: East-west resolution in map units.
+    :param knight: Use the knight's move (r.cost -k).
+    :param keep_nulls: Keep NULL cells of the cost array NULL in the output (r.cost -n).
+    :param max_cost: Optional accumulated cost at which to stop (r.cost max_cost=). Cells beyond are NaN.
+    :return: Tuple of two 2D float arrays (accumulated cost, movement direction in degrees), NaN where not reached.
+    '''
+    shape = cost.shape
+    movelist = moves(knight)
+    flat = cost.astype(np.float64).ravel().tolist()
+    dist = [math.inf] * len(flat)
+    pred = [-1] * len(flat)
+
+    heap = []
+    for row, col in starts:
+        i = row * shape[1] + col
+        dist[i] = 0.0
+        heap.append((0.0, i))
+    heapq.heapify(heap)
+
+    spread(flat, dist, pred, heap, shape, nsres, ewres, movelist, limit=max_cost)
+    if max_cost is not None:
+        # Cells on the heap beyond the limit were not reached.
+        dist = [d if d <= max_cost else math.inf for d in dist]
+
+    return to_arrays(dist, pred, shape, movelist, cost if keep_nulls else None)
+
+
+def to_arrays(dist, pred, shape, movelist, cost=None):
+    '''
+    Converts the flat lists of spread() into the cumulative cost and movement direction arrays written by r.cost.
+    :param dist: Flat list of accumulated costs.
+    :param pred: Flat list of move indices.
+    :param shape: (rows, cols) of the grid.
+    :param movelist: List of moves as created by moves().
+    :param cost: Optional cost array whose NULL cells are kept NULL in the output.
+    :return: Tuple of two 2D float arrays (accumulated cost, movement direction in degrees).
+    '''
+    outdist = np.array(dist, dtype=np.float64).reshape(shape)
+    outdist[np.isinf(outdist)] = np.nan
+
+    # Start cells have no move and get direction 0, as in r.cost.
+    degrees = np.array([m[3] for m in movelist] + [0.0], dtype=np.float64)
+    outdir = degrees[np.array(pred, dtype=np.int64).reshape(shape)]
+    outdir[np.isnan(outdist)] = np.nan
+
+    if cost is not None:
+        nulls = np.isnan(cost)
+        outdist[nulls] = np.nan
+        outdir[nulls] = np.nan
+    return outdist, outdir
+
+
+# _____________GRASS REGION HELPERS_____________
+def coord_to_cell(x, y, region):
+    '''
+    Converts map coordinates into the (row, col) of the current computational region.
+    :param x: Easting.
+    :param y: Northing.
+    :param region: Dictionary as returned by gs.region().
+    :return: Tuple (row, col), or None if the point lies outside of the region.
+    '''
+    row = int((region['n'] - float(y)) // region['nsres'])
+    col = int((float(x) - region['w']) // region['ewres'])
+    if 0 <= row < region['rows'] and 0 <= col < region['cols']:
+        return row, col
+    return None
+
+
+# _____________INCREMENTAL_____________
+def move_cost(cost, i, j, vias, length):
+    '''
+    Cost of a move between two cells, computed exactly as in spread().
+    :return: Cost as float, NaN if a cell of the move is NULL.
+    '''
+    if vias:
+        return (cost[i] + cost[j] + cost[i + vias[0]] + cost[i + vias[1]]) / 4 * length
+    return (cost[i] + cost[j]) / 2 * length
+
+
+def neighbours(i, shape, steps):
+    '''
+    Cells reached from a cell by every move.
+    :return: Generator of (move index, flat index of the cell reached).
+    '''
+    rows, cols = shape
+    row, col = divmod(i, cols)
+    for k, (dr, dc, vias, length) in enumerate(steps):
+        r = row + dr
+        c = col + dc
+        if 0 <= r < rows and 0 <= c < cols:
+            yield k, r * cols + c
+
+
+def repair(cost, changed, dist, pred, start, shape, nsres, ewres, movelist):
+    '''
+    Updates a solved accumulated cost search after the cost of some cells changed, in place.
+    The cells whose path from the start crosses a changed cell (i.e. the branches of the tree of moves below the
+    changed cells) are reset, then the search is run again from the cells around them and around the changed cells.
+    Finally the moves of all cells around the updated ones are chosen again as spread() would have chosen them: the
+    move from the neighbour settled first (lowest accumulated cost, then lowest index) among those giving the
+    accumulated cost. The result is identical to a new search over the changed cost, with work in proportion to the
+    changed cells and the cells downstream of them.
+    :param cost: Flat list of the changed cell costs, NaN for NULL cells.
+    :param changed: List of flat indices of the cells whose cost changed.
+    :param dist: Flat list of accumulated costs of the search over the old cost, math.inf where not reached.
+    :param pred: Flat list of move indices of the search over the old cost, -1 for none.
+    :param start: Flat index of the start cell.
+    :param shape: (rows, cols) of the grid.
+    :param nsres: North-south resolution in map units.
+    :param ewres: East-west resolution in map units.
+    :param movelist: List of moves as created by moves().
+    :return: Number of cells searched again.
+    '''
+    rows, cols = shape
+    steps = [(dr, dc, tuple(r * cols + c for r, c in via), step_length(dr, dc, nsres, ewres))
+             for dr, dc, via, degree in movelist]
+    # Offsets of the cells a move crosses, relative to the cell it reaches: start, end and the cells in between.
+    touched = [[(-dr, -dc), (0, 0)] + [(r - dr, c - dc) for r, c in via] for dr, dc, via, degree in movelist]
+
+    def shifted(i, dr, dc):
+        row, col = divmod(i, cols)
+        r, c = row + dr, col + dc
+        if 0 <= r < rows and 0 <= c < cols:
+            return r * cols + c
+        return None
+
+    # ________Reset the branches below the changed cells________
+    # Cells reached by a move crossing a changed cell
+    invalid = set()
+    for i in changed:
+        for k, offsets in enumerate(touched):
+            for dr, dc in offsets:
+                j = shifted(i, -dr, -dc)
+                if j is not None and pred[j] == k:
+                    invalid.add(j)
+    # and everything reached from them
+    stack = list(invalid)
+    while stack:
+        i = stack.pop()
+        for k, j in neighbours(i, shape, steps):
+            if pred[j] == k and j not in invalid:
+                invalid.add(j)
+                stack.append(j)
+    invalid.discard(start)
+    for i in invalid:
+        dist[i] = math.inf
+        pred[i] = -1
+
+    # ________Search again from the cells around the reset and changed cells________
+    around = set()
+    for i in invalid.union(changed):
+        for dr in range(-2, 3):
+            for dc in range(-2, 3):
+                j = shifted(i, dr, dc)
+                if j is not None and not math.isinf(dist[j]):
+                    around.add(j)
+    heap = [(dist[i], i) for i in around]
+    heapq.heapify(heap)
+    settled = []
+    spread(cost, dist, pred, heap, shape, nsres, ewres, movelist, settled=settled)
+
+    # ________Choose the moves again where accumulated costs changed________
+    updated = set()
+    for i in invalid.union(changed, settled):
+        for dr in range(-2, 3):
+            for dc in range(-2, 3):
+                j = shifted(i, dr, dc)
+                if j is not None:
+                    updated.add(j)
+    updated.discard(start)
+    for j in updated:
+        best = None
+        if not math.isinf(dist[j]):
+            for k, (dr, dc, vias, length) in enumerate(steps):
+                i = shifted(j, -dr, -dc)
+                if i is None or math.isinf(dist[i]):
+                    continue
+                if dist[i] + move_cost(cost, i, j, vias, length) == dist[j] and (best is None or
+                                                                                 (dist[i], i) < best[0]):
+                    best = ((dist[i], i), k)
+        pred[j] = best[1] if best is not None else -1
+    return len(settled)
+
+
+def incremental(cost, base_cost, base_dist, base_dir, start, nsres, ewres, knight=True, keep_nulls=True):
+    '''
+    Calculates the accumulated cost and movement direction over a changed cost surface from the outputs over a base
+    cost surface, only searching again where the change has an effect (see repair()). The base outputs have to come
+    from accumulate() (costdist(engine='numpy')) with the same start cell and flags.
+    :param cost: 2D array of the changed cell costs, NaN for NULL cells.
+    :param base_cost: 2D array of the base cell costs.
+    :param base_dist: 2D array of the accumulated cost over the base cost surface.
+    :param base_dir: 2D array of the movement direction over the base cost surface, in degrees.
+    :param start: (row, col) of the start cell.
+    :param nsres: North-south resolution in map units.
+    :param ewres: East-west resolution in map units.
+    :param knight: Use the knight's move (r.cost -k).
+    :param keep_nulls: Keep NULL cells of the cost array NULL in the output (r.cost -n).
+    :return: Tuple (accumulated cost, movement direction, number of cells searched again), as accumulate().
+    '''
+    shape = cost.shape
+    movelist = moves(knight)
+    changed = np.flatnonzero(~((cost == base_cost) | (np.isnan(cost) & np.isnan(base_cost)))).tolist()
+
+    # Move indices from the directions, 0 (start) and NULL have none.
+    index = {m[3]: k for k, m in enumerate(movelist)}
+    directions = np.nan_to_num(base_dir, nan=0.0).ravel().tolist()
+    pred = [index.get(d, -1) for d in directions]
+    dist = np.where(np.isnan(base_dist), np.inf, base_dist).ravel().tolist()
+
+    searched = 0
+    if changed:
+        searched = repair(cost.astype(np.float64).ravel().tolist(), changed, dist, pred, start[0] * shape[1] + start[1],
+                          shape, nsres, ewres, movelist)
+    outdist, outdir = to_arrays(dist, pred, shape, movelist, cost if keep_nulls else None)
+    return outdist, outdir, searched
+
+
+def usable(outdist, movdir, backend):
+    '''
+    Checks the outputs of a base cost surface can be updated by incremental(): both exist and the cost distance is
+    stored as DCELL, as rounded values would be carried into the update.
+    :return: True or False
+    '''
+    if not (backend.exists(outdist) and backend.exists(movdir)):
+        print(f' {outdist} or {movdir} does not exist, full search.')
+        return False
+    if backend.info(outdist)['datatype'] != 'DCELL':
+        print(f' {outdist} is not stored as DCELL, full search.')
+        return False
+    return True
+
+
+# _____________R.COST REPLACEMENT_____________
+def costdist_numpy(raster, cststart, flags='kn', overwrite=False, backend=None, base=None, precision=None):
+    '''
+    Calculates cost distance and movement direction raster from every start point over one cost surface,
+    reading the cost surface only once. Output names follow costdist(): '{sid}_costdist_*' and '{sid}_movdir_*'.
+    The computational region has to be set to the cost surface before calling this function.
+    :param raster: Name of the cost surface.
+    :param cststart: List of start points of pattern [x, y, sid].
+    :param flags: r.cost flags to emulate; 'k' knight's move, 'n' keep NULL cells NULL.
+    :param overwrite: Overwrite existing outputs.
+    :param backend: Backend the cost surface is read from and the outputs are written to (see def_backend.py).
+    Default GRASS.
+    :param base: Optional name of a base cost surface the cost surface was edited from. Where the outputs of the
+    base exist, the search is only run again where the edit has an effect (see incremental()). They have to be DCELL
+    outputs of this function (costdist(engine='numpy') without precision) over the same region.
+    :param precision: Optional Precision (see def_precision.py) the cost distance raster are written in.
+    :return: List of the sids of the start points whose raster were written; start points outside of the region are
+    left out.
+    '''
+    if backend is None:
+        # def_backend imports this module, so it is imported here.
+        from def_backend import GrassBackend
+        backend = GrassBackend()
+
+    region = backend.region()
+    # Read the cost surface once. NULL cells are read as NaN.
+    cost = backend.read(raster)
+
+    namedist = f'{raster.split("@")[0].replace("costsurf", "costdist")}'
+    namedir = f'{raster.split("@")[0].replace("costsurf", "movdir")}'
+    if base is not None:
+        base_cost = backend.read(base)
+        basedist = f'{base.split("@")[0].replace("costsurf", "costdist")}'
+        basedir = f'{base.split("@")[0].replace("costsurf", "movdir")}'
+
+    written = []
+    for x, y, sid in cststart:
+        outdist = f'{sid}_{namedist}'
+        movdir = f'{sid}_{namedir}'
+
+        start = coord_to_cell(x, y, region)
+        if start is None:
+            print(f'Start point {sid} is outside of the region of {raster}. Nothing happens.')
+            continue
+
+        print(f'\nCalculating accumulated cost (numpy) over\n {raster}')
+        print(f' from {sid}\n creating: ')
+        print(f' - {outdist}')
+        print(f' - {movdir}')
+        if base is not None and usable(f'{sid}_{basedist}', f'{sid}_{basedir}', backend):
+            print(f' from the outputs over {base}')
+            dist, direction, searched = incremental(cost, base_cost, backend.read(f'{sid}_{basedist}'),
+                                                    backend.read(f'{sid}_{basedir}'), start, region['nsres'],
+                                                    region['ewres'], knight='k' in flags, keep_nulls='n' in flags)
+            print(f' {searched} of {cost.size} cells searched again')
+        else:
+            dist, direction = accumulate(cost, [start], region['nsres'], region['ewres'],
+                                         knight='k' in flags, keep_nulls='n' in flags)
+
+        backend.write(movdir, direction, overwrite=overwrite)
+        if precision is not None:
+            backend.write(outdist, precision.encode_array(dist), overwrite=overwrite, mtype=precision.mtype)
+        else:
+            backend.write(outdist, dist, overwrite=overwrite)
+        written.append(sid)
+    return written
@@ -0,0 +1,172 @@
+'''
+Parallel execution of r.cost.
+r.cost is single-threaded, so several r.cost runs are started at the same time. Every worker gets its own temporary
+mapset for its outputs; the region of each run is passed through GRASS_REGION (see def_region.py), so the workers do
+not interfere with each other or with the region of the PERMANENT mapset. Results are moved (or copied using g.copy) into PERMANENT once a run
+has finished and the temporary mapsets are deleted at the end.
+'''
+
+import os
+import queue
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import grass.script as gs
+from def_scheduler import Budget
+from def_region import region_env, window_params
+
+# Database elements that make up a raster map. Moving these moves the map from one mapset to another.
+RASTER_ELEMENTS = ['cell', 'fcell', 'cellhd', 'cats', 'colr', 'hist', 'cell_misc', 'quant']
+
+
+# _____________TEMPORARY MAPSETS_____________
+def create_worker(name):
+    '''
+    Creates a temporary mapset next to PERMANENT and a GISRC file pointing to it.
+    The region of the new mapset is the default region of the location.
+    :param name: Name of the temporary mapset.
+    :return: Dictionary with the environment ('env') to run GRASS modules in the mapset, its name ('mapset'),
+    its path ('path') and the path of the GISRC file ('gisrc').
+    '''
+    genv = gs.gisenv()
+    location = os.path.join(genv['GISDBASE'], genv['LOCATION_NAME'])
+    path = os.path.join(location, name)
+    os.makedirs(path, exist_ok=True)
+    shutil.copy(os.path.join(location, 'PERMANENT', 'DEFAULT_WIND'), os.path.join(path, 'WIND'))
+
+    # Each worker needs its own GISRC file, otherwise all of them would work in the same mapset.
+    fd, gisrc = tempfile.mkstemp(suffix='.gisrc')
+    with os.fdopen(fd, 'w') as rc:
+        rc.write(f'GISDBASE: {genv["GISDBASE"]}\n'
+                 f'LOCATION_NAME: {genv["LOCATION_NAME"]}\n'
+                 f'MAPSET: {name}\n'
+                 f'GUI: text\n')
+    env = os.environ.copy()
+    env['GISRC'] = gisrc
+    return {'env': env, 'mapset': name, 'path': path, 'gisrc': gisrc}
+
+
+def remove_worker(worker):
+    '''
+    Deletes a temporary mapset created by create_worker() together with its GISRC file.
+    :param worker: Dictionary as returned by create_worker().
+    :return: None
+    '''
+    shutil.rmtree(worker['path'], ignore_errors=True)
+    if os.path.exists(worker['gisrc']):
+        os.remove(worker['gisrc'])
+
+
+def transfer(name, worker, how='move'):
+    '''
+    Brings a raster created in a temporary mapset into PERMANENT.
+    :param name: Name of the raster in the temporary mapset.
+    :param worker: Dictionary as returned by create_worker().
+    :param how: 'move' renames the raster files on disk (no data is copied, temporary mapset must be on the same
+    file system), 'copy' uses g.copy. An existing raster of that name in PERMANENT is replaced.
+    :return: None
+    '''
+    if how == 'copy':
+        gs.run_command('g.copy', raster=f'{name}@{worker["mapset"]},{name}', overwrite=True)
+        return
+
+    permanent = os.path.join(os.path.dirname(worker['path']), 'PERMANENT')
+    # Remove all files of a raster of that name (rerun or overwrite) first, so that none of the old raster is left;
+    # cell_misc/[name] is a directory, which os.replace() cannot replace.
+    for element in RASTER_ELEMENTS:
+        dst = os.path.join(permanent, element, name)
+        if os.path.isdir(dst):
+            shutil.rmtree(dst)
+        elif os.path.lexists(dst):
+            os.remove(dst)
+    for element in RASTER_ELEMENTS:
+        src = os.path.join(worker['path'], element, name)
+        if os.path.exists(src):
+            os.makedirs(os.path.join(permanent, element), exist_ok=True)
+            os.replace(src, os.path.join(permanent, element, name))
+
+
+# _____________PARALLEL R.COST_____________
+def rcost_job(job, worker, how='move'):
+    '''
+    Runs a single r.cost in a temporary mapset and transfers the outputs to PERMANENT.
+    :param job: Dictionary with the keys 'input', 'output', 'outdir', 'coordinates', 'memory' and 'flags'.
+    Optional keys: 'window' (region of the run, see def_windows.py) and 'max_cost' (r.cost max_cost=).
+    :param worker: Dictionary as returned by create_worker().
+    :param how: How to bring the outputs into PERMANENT, see transfer().
+    :return: Standard output of r.cost (the estimates when run with the -i flag).
+    '''
+    inp = job['input'] if '@' in job['input'] else f'{job["input"]}@PERMANENT'
+    # Outputs are always created in the temporary mapset, drop any mapset information.
+    output = job['output'].split('@')[0]
+    outdir = job['outdir'].split('@')[0]
+
+    # Region of this run only, passed through GRASS_REGION (see def_region.py); no WIND file is changed.
+    env = region_env(env=worker['env'], raster=inp)
+    if job.get('window'):
+        env = region_env(env=env, **window_params(inp, job['window'], env=worker['env']))
+    options = {'max_cost': job['max_cost']} if job.get('max_cost') else {}
+    stdout = gs.read_command('r.cost',
+                             input=inp,
+                             output=output,
+                             start_coordinates=job['coordinates'],
+                             outdir=outdir,
+                             memory=job['memory'],
+                             flags=job['flags'],
+                             env=env,
+                             **options
+                             )
+    # The -i flag only prints the estimates, nothing to transfer.
+    if 'i' not in job['flags']:
+        transfer(output, worker, how)
+        transfer(outdir, worker, how)
+    return stdout
+
+
+def rcost_parallel(jobs, nprocs, how='move', ram_mb=None, disk_mb=None):
+    '''
+    Runs r.cost jobs concurrently, each of them in one of nprocs temporary mapsets.
+    Jobs are started in the order given. With ram_mb a job also waits until its 'memory' (and 'disk', if given)
+    fits into the budget left by the running jobs (see def_scheduler.py).
+    :param jobs: List of job dictionaries, see rcost_job().
+    :param nprocs: Number of r.cost runs at the same time.
+    :param how: How to bring the outputs into PERMANENT, see transfer().
+    :param ram_mb: Optional RAM budget in MB for all runs together.
+    :param disk_mb: Optional disk budget in MB for all runs together.
+    :return: List of (job, standard output of r.cost) tuples in order of completion.
+    '''
+    if not jobs:
+        return []
+
+    pid = os.getpid()
+    workers = [create_worker(f'tmp_rcost_{pid}_{n}') for n in range(min(nprocs, len(jobs)))]
+    # Pool of free workers. A job takes a worker and gives it back when it is done.
+    free = queue.Queue()
+    for worker in workers:
+        free.put(worker)
+    budget = Budget(ram_mb, disk_mb) if ram_mb is not None else None
+
+    def run(job):
+        if budget is not None:
+            budget.acquire(job['memory'], job.get('disk', 0))
+        worker = free.get()
+        try:
+            print(f'\nCalculating r.cost over\n {job["input"]}\n in {worker["mapset"]}, creating: ')
+            print(f' - {job["output"]}')
+            print(f' - {job["outdir"]}')
+            return rcost_job(job, worker, how)
+        finally:
+            free.put(worker)
+            if budget is not None:
+                budget.release(job['memory'], job.get('disk', 0))
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+            futures = {pool.submit(run, job): job for job in jobs}
+            for future in as_completed(futures):
+                results.append((futures[future], future.result()))
+    finally:
+        for worker in workers:
+            remove_worker(worker)
+    return results
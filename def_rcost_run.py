@@ -1,6 +1,10 @@
 import os
-import grass.script as gs
 import grass.script.setup as gsetup
+from def_rcost_numpy import costdist_numpy
+from def_rcost_parallel import rcost_parallel
+from def_catalog import RasterCatalog
+from def_scheduler import plan, free_disk_mb
+from def_backend import GrassBackend
 
 # _____________START GRASS SESSION_____________ /// NOT NECESSARY AS ONLY FUNCTION DEFINED HERE
 # # to start the GRASS session
@@ -29,20 +33,90 @@ import grass.script.setup as gsetup
 
 # _____________R.COST: RUN_____________
 # Step 3: r.cost using -i flag - check info on disk space and memory requirements of r.cost run
-def costdist(costsurfaces, cststart):
+def costdist(costsurfaces, cststart, engine='rcost', nprocs=1, catalog=None, estimates=None, ram_mb=None, disk_mb=None,
+             manifest=None, backend=None, windows=None, max_cost=None, precision=None, base=None):
     '''
     Prints info about disk space and memory requirements of r.cost for several cost surfaces and start points given as input
     :param costsurfaces: list of strings containing names of costsurfaces
     :param cststart: list of points of pattern ... TODO
+    :param engine: 'rcost' runs r.cost once per cost surface and start point.
+    'numpy' reads each cost surface once and calculates all start points in-process (see def_rcost_numpy.py). Its
+    search runs in Python and is much slower per cell than r.cost, it is meant for small regions and for base runs.
+    :param nprocs: Number of r.cost runs at the same time, each in its own temporary mapset (see def_rcost_parallel.py).
+    Only used with engine='rcost'.
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param estimates: Estimates returned by costdistcheck(). With ram_mb, each parallel r.cost run gets a memory=
+    value from its estimate, the largest runs are started first and only as many run at the same time as fit into
+    the budget (see def_scheduler.py).
+    :param ram_mb: RAM budget in MB for all parallel r.cost runs together.
+    :param disk_mb: Disk budget in MB for the parallel r.cost runs. Defaults to the free space of the GRASS database.
+    :param manifest: Optional Manifest (see def_manifest.py). Outputs created from a different cost surface, start
+    point or flags, or not recorded as complete, are created again.
+    :param backend: Backend to run on (see def_backend.py), default GRASS. Parallel runs (nprocs) need GRASS.
+    :param windows: Optional Windows (see def_windows.py). Each r.cost run only covers the window of its site,
+    aligned to the cost surface. GRASS only, not used with engine='numpy'.
+    :param max_cost: Optional accumulated cost at which r.cost stops (max_cost=); cells beyond are NULL.
+    Not used with engine='numpy'.
+    :param precision: Optional Precision (see def_precision.py). Cost distance raster are stored as FCELL or scaled
+    CELL: r.cost runs on a copy of the cost surface in that type (Precision.surface(), removed at the end) and
+    writes it directly, the numpy engine writes it directly.
+    :param base: Optional name of a base cost surface the other cost surfaces were edited from, e.g. a run without a
+    dam. The base is calculated first; the other cost surfaces are only searched again where they differ from the
+    base and where that has an effect (see incremental() in def_rcost_numpy.py), with the same outputs as a full run.
+    Only used with engine='numpy'. The outputs of the base are converted to the precision after all others.
     :return: cost distance raster from each point for each costsurface given as input
     '''
+    if backend is None:
+        backend = GrassBackend()
+    if catalog is None:
+        catalog = RasterCatalog(backend=backend)
+
+    # r.cost runs to be executed in parallel.
+    jobs = []
+    # Keys of the outputs in the manifest, per cost distance raster.
+    keys = {}
+
+    # With a base, its outputs are created first and kept in DCELL until the other cost surfaces are updated from them.
+    deferred = []
+    if base is not None and engine == 'numpy':
+        costsurfaces = sorted(costsurfaces, key=lambda r: r.split("@")[0] != base.split("@")[0])
+    else:
+        base = None
+
+    # Cost surfaces in the type of the precision r.cost runs on, {cost surface: copy}.
+    surfaces = {}
+
+    def surface(raster):
+        if precision is None:
+            return raster
+        if raster not in surfaces:
+            surfaces[raster] = precision.surface(raster, backend)
+            backend.region(raster)
+        return surfaces[raster]
+
+    def done(outdist, movdir, raster=None, convert=False):
+        # Register finished outputs in the catalog and the manifest.
+        catalog.add(outdist)
+        catalog.add(movdir)
+        if precision is not None:
+            if convert:
+                precision.convert(outdist, backend)
+            else:
+                precision.check(outdist, backend, surfaces.get(raster))
+        if manifest is not None:
+            manifest.record(outdist, keys[outdist], 'costdist')
+            manifest.record(movdir, keys[outdist], 'costdist')
+
     for raster in costsurfaces:
         # Create output strings
         namedist = f'{raster.replace("costsurf", "costdist")}'
         namedir = f'{raster.replace("costsurf", "movdir")}'
 
         # set region
-        gs.run_command('g.region', raster=raster)
+        backend.region(raster)
+
+        # Start points still to be calculated by the numpy engine.
+        todo = []
 
         for x, y, sid in cststart:
 
@@ -50,27 +124,79 @@ def costdist(costsurfaces, cststart):
             outdist = f'{sid}_{namedist}'
             movdir = f'{sid}_{namedir}'
 
+            # Remove outputs that are out of date, so that they are created again below.
+            window = windows.site(sid) if windows is not None and engine != 'numpy' else None
+            limit = max_cost if engine != 'numpy' else None
+            if manifest is not None:
+                # Window and max_cost are only part of the key if used, so existing outputs keep their keys.
+                options = {key: value for key, value in (('window', window), ('max_cost', limit)) if value}
+                if precision is not None:
+                    options.update(precision.options())
+                keys[outdist] = manifest.key('costdist', [raster], coordinates=(x, y), flags='kn', engine=engine,
+                                             **options)
+                manifest.needs([outdist, movdir], keys[outdist], catalog)
+
             # Check file does not already exists
-            resultdist = gs.find_file(name=outdist, element='cell')
-            resultdir = gs.find_file(name=movdir, element='cell')
-            if outdist not in resultdist['name']:
-                if movdir not in resultdir['name']:
+            if outdist not in catalog:
+                if movdir not in catalog:
+                    if engine == 'numpy':
+                        # Collect the start point, all of them are calculated at once below.
+                        todo.append((x, y, sid))
+                        continue
+                    if nprocs > 1 and isinstance(backend, GrassBackend):
+                        # Collect the run, all of them are started in parallel below.
+                        jobs.append({'input': surface(raster),
+                                     'raster': raster,
+                                     'output': outdist,
+                                     'outdir': movdir,
+                                     'coordinates': (x, y),
+                                     'memory': 3000,
+                                     'flags': 'kn',
+                                     'window': window,
+                                     'max_cost': limit})
+                        continue
                     # Run!
                     print(f'\nCalculating r.cost over\n {raster}')
                     print(f' from {sid}\n creating: ')
                     print(f' - {outdist}')
                     print(f' - {movdir}')
-                    gs.run_command('r.cost',
-                                   input=raster,
-                                   output=outdist,
-                                   start_coordinates=(x, y),
-                                   outdir=movdir,
-                                   memory=3000,
-                                   flags='kn'
-                                   )
+                    inp = surface(raster)
+                    if window is not None:
+                        backend.region(raster, window=window)
+                    backend.cost(inp, (x, y), outdist, movdir, flags='kn', memory=3000, max_cost=limit)
+                    done(outdist, movdir, raster)
                 else:
                     print('File already exists.')
                     pass
             else:
                 print('File already exists.')
-                pass
\ No newline at end of file
+                pass
+
+        if todo:
+            isbase = base is not None and raster.split("@")[0] == base.split("@")[0]
+            # The outputs of the base stay DCELL until the others are updated from them.
+            written = costdist_numpy(raster, todo, flags='kn', backend=backend, base=None if isbase else base,
+                                     precision=None if isbase else precision)
+            # Start points outside of the region were not written.
+            for sid in written:
+                if isbase:
+                    deferred.append((f'{sid}_{namedist}', f'{sid}_{namedir}'))
+                    continue
+                done(f'{sid}_{namedist}', f'{sid}_{namedir}')
+
+    for outdist, movdir in deferred:
+        done(outdist, movdir, convert=True)
+
+    if estimates is not None and ram_mb is not None:
+        jobs = plan(jobs, estimates, ram_mb)
+        if disk_mb is None:
+            disk_mb = free_disk_mb()
+    else:
+        ram_mb = None
+
+    for job, stdout in rcost_parallel(jobs, nprocs, ram_mb=ram_mb, disk_mb=disk_mb):
+        done(job['output'], job['outdir'], job['raster'])
+
+    for raster, copy in surfaces.items():
+        if copy != raster:
+            backend.remove(copy)
@@ -0,0 +1,154 @@
+'''
+Computational regions passed to every module call instead of set with g.region.
+g.region writes the region to the WIND file of the mapset, which every module of the mapset reads. Setting it before
+each step costs a module run per raster, and two stages (or workers) in the same mapset change each other's region.
+Modules also read the region from the GRASS_REGION environment variable (before WIND_OVERRIDE and the WIND file), so
+instead:
+ - region_string() computes the region g.region would set (g.region -u, the WIND file is not changed) and keeps it
+   for the rest of the process. It is computed again only for other parameters or if one of the named raster has
+   been created again since (modification time of its cell header).
+ - region_env() returns an environment with GRASS_REGION set, passed to the module calls by env=.
+ - region_dict() reads the region from the string, as gs.region() would return it, without running g.region.
+GrassBackend.region() keeps the environment of the following calls of the backend (see def_backend.py); the region
+of the mapset stays as it is.
+
+Usage:
+    env = region_env(raster=rast)
+    gs.run_command('r.quantile', input=rast, percentiles=10, env=env)
+    region = region_dict(env['GRASS_REGION'])
+'''
+
+import os
+import threading
+
+# grass.script is only needed to compute regions that are not cached yet
+try:
+    import grass.script as gs
+except ImportError:
+    gs = None
+
+# g.region parameters that name raster
+RASTER_PARAMS = ('raster', 'zoom', 'align')
+
+# GRASS_REGION keys of the values of gs.region()
+KEYS = {'north': 'n', 'south': 's', 'east': 'e', 'west': 'w', 'n-s resol': 'nsres', 'e-w resol': 'ewres',
+        'proj': 'projection'}
+
+# Region strings of the process, {key: string}; shared by all threads.
+strings = {}
+lock = threading.Lock()
+
+
+def names(value):
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return str(value).split(',')
+
+
+def header_times(rasters, env=None):
+    '''
+    Modification times of the cell headers of raster, read from the GRASS database without running a module.
+    :param rasters: List of raster names, with or without '@MAPSET'.
+    :param env: Optional environment, its GISRC gives the database, location and mapset.
+    :return: Tuple of times, None for raster not found.
+    '''
+    env = env if env is not None else os.environ
+    gisrc = {}
+    try:
+        with open(env['GISRC']) as f:
+            for line in f:
+                if ':' in line:
+                    key, value = line.split(':', 1)
+                    gisrc[key.strip()] = value.strip()
+        location = os.path.join(gisrc['GISDBASE'], gisrc['LOCATION_NAME'])
+    except (OSError, KeyError):
+        return tuple(None for rast in rasters)
+    times = []
+    for rast in rasters:
+        name, _, mapset = rast.partition('@')
+        found = None
+        # Without mapset the current mapset is searched first, then PERMANENT.
+        for m in [mapset] if mapset else [gisrc.get('MAPSET', 'PERMANENT'), 'PERMANENT']:
+            try:
+                found = os.stat(os.path.join(location, m, 'cellhd', name)).st_mtime_ns
+                break
+            except OSError:
+                continue
+        times.append(found)
+    return tuple(times)
+
+
+def region_string(env=None, **params):
+    '''
+    GRASS_REGION string of the region g.region sets with the given parameters, computed once per process.
+    :param env: Optional environment; e.g. of a temporary mapset, or with GRASS_REGION of the region the parameters
+    start from (e.g. zoom=).
+    :param params: Parameters of g.region, e.g. raster=, zoom=, n=, s=, e=, w=, align=.
+    :return: String of pattern 'north: [n];south: [s];...'.
+    '''
+    rasters = [rast for key in RASTER_PARAMS if key in params for rast in names(params[key])]
+    key = (env.get('GRASS_REGION') if env is not None else os.environ.get('GRASS_REGION'),
+           tuple(sorted((name, ','.join(names(value))) for name, value in params.items())),
+           header_times(rasters, env))
+    with lock:
+        if key in strings:
+            return strings[key]
+    # g.region -u: the region is printed, the WIND file is not changed.
+    string = gs.region_env(env=env, **params)
+    with lock:
+        strings[key] = string
+    return string
+
+
+def region_env(env=None, **params):
+    '''
+    Environment to run module calls in a region, see region_string().
+    :param env: Optional environment the region is added to, default that of the process.
+    :return: Copy of the environment with GRASS_REGION set.
+    '''
+    string = region_string(env=env, **params)
+    env = dict(env if env is not None else os.environ)
+    env['GRASS_REGION'] = string
+    return env
+
+
+def region_dict(string):
+    '''
+    Reads a GRASS_REGION string.
+    :return: Dictionary with n, s, e, w, nsres, ewres, rows and cols, as returned by gs.region().
+    '''
+    region = {}
+    for item in string.split(';'):
+        if ':' in item:
+            key, value = item.split(':', 1)
+            key = KEYS.get(key.strip(), key.strip())
+            region[key] = float(value)
+    for key in ('rows', 'cols', 'projection', 'zone'):
+        if key in region:
+            region[key] = int(region[key])
+    return region
+
+
+def window_params(raster, window, env=None):
+    '''
+    Parameters of g.region for a window clipped to the extent of a raster and aligned to its grid.
+    :param raster: Raster (e.g. the cost surface) the window is clipped and aligned to.
+    :param window: Dictionary with n, s, e and w (see def_windows.py).
+    :param env: Optional environment, e.g. of a temporary mapset.
+    :return: Dictionary, e.g. for region_env().
+    '''
+    full = region_dict(region_string(env=env, raster=raster))
+    return {'n': min(window['n'], full['n']),
+            's': max(window['s'], full['s']),
+            'e': min(window['e'], full['e']),
+            'w': max(window['w'], full['w']),
+            'align': raster}
+
+
+def forget():
+    '''
+    Empties the cache of region strings, e.g. after raster were changed in place by another process.
+    :return: None
+    '''
+    with lock:
+        strings.clear()
@@ -1,6 +1,8 @@
 import os
-import grass.script as gs
+from concurrent.futures import ThreadPoolExecutor
 import grass.script.setup as gsetup
+from def_catalog import RasterCatalog
+from def_backend import GrassBackend
 
 # _____________START GRASS SESSION & INPUT DEFINITION_____________
 # to start the GRASS session in PERMANENT mapset
@@ -12,39 +14,62 @@ import grass.script.setup as gsetup
 
 
 # _____________FUNCTION R.IN.GDAL WITH EXISTS CHECK_____________
-def ringdal(folder, namestring):
+def ringdal(folder, namestring, catalog=None, mode='copy', nprocs=1, manifest=None, backend=None):
     '''
     Function to read raster data (tif only!) into GRASS environment from a specified directory using r.in.gdal.
     :param folder: Directory in which tifs are stored.
     :param namestring: Substring if only specific files from directory should be read in.
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param mode: 'copy' imports the data into the GRASS database using r.in.gdal.
+    'link' registers the tifs using r.external; no data is copied, GRASS reads the tifs directly through GDAL.
+    The tifs then have to stay in the folder for as long as the rasters are used.
+    :param nprocs: Number of imports at the same time. The region is extended once after all imports instead of
+    by each import (-e flag), so that the imports do not write the region at the same time.
+    :param manifest: Optional Manifest (see def_manifest.py). Rasters read in from a tif that changed since, or not
+    recorded as complete, are read in again.
+    :param backend: Backend the rasters are read into (see def_backend.py), default GRASS.
     :return: Registered grass raster datasets. No output.
     '''
+    if backend is None:
+        backend = GrassBackend()
+
     # STEP 1: Check that dataset with same name does not already exist in GRASS.
-    # Create a list of raster file names that are currently in GRASS.
-    rasterdata = gs.list_strings(type='raster',
-                                 mapset='PERMANENT',
-                                 flag='r')
-    # Create a new list from the above list that does not contain the mapset information.
-    cleanraster = []
-    for rast in rasterdata:
-        substring = rast.split("@")[0]
-        cleanraster.append(substring)
-
-    # read in raster using r.in.gdal
+    # Catalog of raster file names that are currently in GRASS, without the mapset information.
+    if catalog is None:
+        catalog = RasterCatalog(backend=backend)
+
+    # STEP 2: Collect the geotiffs in the folder that are to be read in.
     # this is the folder where your GEE exports are in
+    files = []
+    # Keys of the rasters in the manifest
+    keys = {}
     for file in os.listdir(folder):
         filename = os.path.splitext(file)[0]
+        # Remove rasters that are out of date, so that they are read in again below.
+        if manifest is not None and file.endswith('.tif') and namestring in filename:
+            keys[filename] = manifest.key('ringdal', [os.path.join(folder, file)], mode=mode)
+            manifest.needs([filename], keys[filename], catalog)
         # iterate through geotiffs in the folder
         if (file.endswith('.tif')) \
-                and (os.path.splitext(file)[0] not in cleanraster) \
+                and (filename not in catalog) \
                 and (namestring in filename):
-            # -e flag extends region to extent of new dataset, updates default region if used in PERMANENT mapset
-            gs.run_command('r.in.gdal',
-                           input=os.path.join(folder, file),
-                           output=filename,
-                           flags='e',
-                           memory=1000
-                           )
+            files.append((file, filename))
         else:
             pass
 
+    # STEP 3: Read in raster using r.in.gdal (copy) or r.external (link)
+    def readin(file, filename, flags):
+        backend.import_raster(os.path.join(folder, file), filename, mode=mode, flags=flags)
+        catalog.add(filename)
+        if manifest is not None:
+            manifest.record(filename, keys[filename], 'ringdal')
+        return filename
+
+    if nprocs > 1 and files:
+        with ThreadPoolExecutor(max_workers=nprocs) as pool:
+            imported = list(pool.map(lambda f: readin(f[0], f[1], ''), files))
+        backend.extend_region(imported)
+    else:
+        for file, filename in files:
+            # -e flag extends region to extent of new dataset, updates default region if used in PERMANENT mapset
+            readin(file, filename, 'e')
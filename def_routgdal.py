@@ -21,12 +21,65 @@ COMPRESS=LZW
 PREDICTOR=3
 BIGTIFF=YES
 
+createopts() compresses the other data types as well: integer data (e.g. the Int16 network) with PREDICTOR=2 and
+BIGTIFF=IF_SAFER.
+
+Further options of routgdal():
+- nprocs runs several r.out.gdal at the same time. Each run gets its own computational region through the
+  GRASS_REGION environment variable, so the region of the mapset is not changed.
+- driver='COG' writes Cloud-Optimized GeoTIFFs (GDAL >= 3.1) with internal overviews.
+- compress (LZW, DEFLATE, ZSTD), predictor and threads (GDAL NUM_THREADS, multi-threaded compression).
+- sparse=True writes tiled GeoTIFFs without the tiles that hold only NULL cells (SPARSE_OK), for the thresholded
+  corridors; def_sparse.py joins such files into the network reading only the tiles with data.
+- runner (a ModuleRunner, see def_async.py) runs r.out.gdal as nprocs does, with streamed output and retries.
+
 """
 
 import os
-import grass.script as gs
+from concurrent.futures import ThreadPoolExecutor
+from def_catalog import RasterCatalog
+from def_backend import GrassBackend
+
+
+def createopts(datatype, driver='GTiff', compress='LZW', predictor=None, threads=None, sparse=False):
+    '''
+    Creates the create options for r.out.gdal.
+    :param datatype: (string) data type of the export, see routgdal().
+    :param driver: 'GTiff' or 'COG'.
+    :param compress: Compression codec; e.g. LZW, DEFLATE, ZSTD.
+    :param predictor: GTiff predictor (1 none, 2 horizontal differencing, 3 floating point). Defaults to 3 for the
+    floating point (and complex) data types and to 2 for the integer ones. For COG translated into NO, STANDARD and
+    FLOATING_POINT.
+    :param threads: Number of threads GDAL uses for compression (NUM_THREADS); e.g. 4 or 'ALL_CPUS'.
+    :param sparse: If True tiles that hold only nodata are not written (TILED=YES, SPARSE_OK=TRUE), see def_sparse.py.
+    :return: Create options separated by a comma of pattern NAME=OPTION.
+    '''
+    large_datatypes = ['Float32', 'Float64', 'CInt16', 'CInt32', 'CFloat32', 'CFloat64']
 
-def routgdal(rasterlist, datatype, loc_out):
+    # Every data type is compressed. The floating point predictor (3) is only for the large data types, it would
+    # mess with integer data and the output would be useless; integer data use horizontal differencing (2).
+    # The large data types are always written as BigTIFF, the others only where the file could exceed 4 GB.
+    gtiff_predictor = predictor if predictor is not None else 3 if datatype in large_datatypes else 2
+    options = [f'COMPRESS={compress}', f'PREDICTOR={gtiff_predictor}',
+               'BIGTIFF=YES' if datatype in large_datatypes else 'BIGTIFF=IF_SAFER']
+    if driver == 'COG':
+        # COG is always tiled and compressed, overviews are created internally.
+        cog_predictor = {1: 'NO', 2: 'STANDARD', 3: 'FLOATING_POINT'}
+        options = [f'COMPRESS={compress}', 'OVERVIEWS=AUTO', 'BIGTIFF=IF_SAFER']
+        if predictor is not None:
+            options.append(f'PREDICTOR={cog_predictor.get(int(predictor), "NO")}')
+    if threads:
+        options.append(f'NUM_THREADS={threads}')
+    if sparse:
+        # Thresholded corridors are mostly NULL; empty tiles then take no space in the file.
+        options.append('SPARSE_OK=TRUE')
+        if driver != 'COG':
+            options += ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256']
+    return ','.join(options)
+
+
+def routgdal(rasterlist, datatype, loc_out, catalog=None, nprocs=1, driver='GTiff', compress='LZW', predictor=None, threads=None,
+             manifest=None, backend=None, sparse=False, runner=None):
     '''
 
     Here is some explanation as to datatypes and the type of data they store:
@@ -35,40 +88,98 @@ def routgdal(rasterlist, datatype, loc_out):
     :param datatype: (string) specify the data type;
     choose from: Byte, Int16, UInt16, Int32, UInt32, Float32, Float64, CInt16, CInt32, CFloat32, CFloat64
     :param loc_out: output location as string; e.g. '/export/home/fkj22/rcostconvol/out'
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param nprocs: Number of r.out.gdal runs at the same time.
+    :param driver: 'GTiff' or 'COG' (Cloud-Optimized GeoTIFF with internal overviews).
+    :param compress: Compression codec; e.g. LZW, DEFLATE, ZSTD.
+    :param predictor: Predictor, see createopts().
+    :param threads: Number of threads GDAL uses for compression of each file (NUM_THREADS).
+    :param manifest: Optional Manifest (see def_manifest.py). Files exported from a raster that changed since, or
+    with other options, or not recorded as complete, are exported again.
+    :param backend: Backend to export from (see def_backend.py), default GRASS.
+    :param sparse: If True tiles holding only NULL cells are not written (SPARSE_OK), so the files of thresholded
+    corridors are about the size of the corridor; see createopts() and def_sparse.py.
+    :param runner: Optional ModuleRunner (see def_async.py, GRASS only). All r.out.gdal runs are started at once, at
+    most runner.limit at the same time, each in the region of its raster; nprocs is not used.
     :return: Creates a GeoTIFF of each file in the above list 'files' using GRASS module 'r.out.gdal'.
     see https://grass.osgeo.org/grass78/manuals/r.out.gdal.html for more details
     '''
-    large_datatypes = ['Float32', 'Float64', 'CInt16', 'CInt32', 'CFloat32', 'CFloat64']
+    if backend is None:
+        backend = GrassBackend()
+    if catalog is None:
+        catalog = RasterCatalog(backend=backend)
 
-    for rast in rasterlist:
+    options = createopts(datatype, driver, compress, predictor, threads, sparse)
 
-        # Set the computational region so as not to loose any data. This should not change, but is good practice to specify for each raster individually.
-        gs.run_command('g.region', raster=rast)
+    # List the output location once instead of once per raster.
+    existing = set(os.listdir(loc_out))
 
+    def target(rast):
         # Specify output location and name of resulting raster.
         name = rast.split("@")[0] # Use the name of the Grass dataset. As it will have the mapset information appended to it after '@', only take the string before '@'.
         file = f'{name}_{datatype}.tif'
         out = f'{loc_out}/{name}_{datatype}.tif' # Add 'datatype' at the end of the file name to indicate that the exported data type is Float32.
+        return file, out
 
-        # Set the createoptions to handle large files if the datatype is of a large type
-        # Otherwise the compression and predictor will mess with the smaller data and the output is useless
-        # If the datatype is not one of the large ones, then createopt will be empty. No harm done.
-        options = 'COMPRESS=LZW,PREDICTOR=3,BIGTIFF=YES' if datatype in large_datatypes else ''
+    def finish(rast):
+        file, out = target(rast)
+        print(f'{rast} saved in {datatype} \n as {file} \n to {loc_out}')
+        if manifest is not None:
+            manifest.record(out, keys[rast], 'routgdal')
+        return file
 
-        if file not in os.listdir(loc_out):
+    def export(rast, env=None):
+        file, out = target(rast)
         # Run GRASS module 'r.out.gdal'
-            gs.run_command('r.out.gdal',
-                           input=rast,
-                           output=out,
-                           createopt=options, # Create options separated by a comma of pattern NAME=OPTION based on the GTiff File Format documentation on the GDAL website.
-                           format='GTiff',
-                           type=datatype,
-                           nodata=0,
-                           flags='f') # Force the output to the chosen datatype.
-            print(f'{rast} saved in {datatype} \n as {file} \n to {loc_out}')
-
-        else:
-            print('File already exists and will not be created.')
-            pass
+        backend.export(rast,
+                       out,
+                       datatype,
+                       driver=driver,
+                       createopt=options, # Create options separated by a comma of pattern NAME=OPTION based on the GTiff File Format documentation on the GDAL website.
+                       nodata=0,
+                       env=env)
+        return finish(rast)
+
+    todo = []
+    # Keys of the exported files in the manifest
+    keys = {}
+    for rast in rasterlist:
+
+        # Only rasters that are still in GRASS can be exported.
+        if rast not in catalog:
+            print(f'{rast} does not exist and will not be exported.')
+            continue
 
+        # Delete files that are out of date, so that they are exported again below.
+        if manifest is not None:
+            out = f'{loc_out}/{rast.split("@")[0]}_{datatype}.tif'
+            keys[rast] = manifest.key('routgdal', [rast], datatype=datatype, driver=driver, options=options)
+            if manifest.needs_file(out, keys[rast]):
+                existing.discard(os.path.basename(out))
 
+        if f'{rast.split("@")[0]}_{datatype}.tif' in existing:
+            print('File already exists and will not be created.')
+            continue
+        todo.append(rast)
+
+    if runner is not None:
+        # The region of each run is passed through GRASS_REGION, as with nprocs.
+        futures = [(rast, runner.submit('r.out.gdal', env=backend.region_env(rast),
+                                        **backend.export_options(rast, target(rast)[1], datatype, driver=driver,
+                                                                 createopt=options, nodata=0)))
+                   for rast in todo]
+        for rast, future in futures:
+            future.result()
+            existing.add(finish(rast))
+    elif nprocs > 1:
+        # The region of each run is passed through GRASS_REGION, so parallel runs do not change each other's region.
+        def run(rast):
+            return export(rast, backend.region_env(rast))
+
+        with ThreadPoolExecutor(max_workers=nprocs) as pool:
+            existing.update(pool.map(run, todo))
+    else:
+        for rast in todo:
+            # Set the computational region so as not to loose any data. This should not change, but is good practice to specify for each raster individually.
+            backend.region(rast)
+            existing.add(export(rast))
@@ -0,0 +1,120 @@
+'''
+Memory-aware scheduling of r.cost runs.
+costdistcheck() runs r.cost with the -i flag, which only prints how much memory and disk space a run will need.
+The functions here turn that output into numbers, pick the memory= value of each run and decide how many runs
+fit into a RAM and free disk budget at the same time. Large runs are started first, so that the small ones fill
+the gaps at the end instead of a large one running alone.
+'''
+
+import math
+import re
+import shutil
+import threading
+import grass.script as gs
+
+# Lines printed by r.cost -i
+PATTERNS = {'disk_mb': re.compile(r'([\d.]+)\s*MB of disk space'),
+            'memory_mb': re.compile(r'([\d.]+)\s*MB of memory'),
+            'segments': re.compile(r'(\d+)\s+of\s+(\d+)\s+segments')}
+
+
+def parse_estimates(text):
+    '''
+    Parses the output of r.cost -i.
+    :param text: Output of r.cost -i as string.
+    :return: Dictionary with 'disk_mb', 'memory_mb', 'segments_kept' and 'segments_total'; None if not found.
+    '''
+    estimate = {'disk_mb': None, 'memory_mb': None, 'segments_kept': None, 'segments_total': None}
+    for key in ('disk_mb', 'memory_mb'):
+        match = PATTERNS[key].search(text)
+        if match:
+            estimate[key] = float(match.group(1))
+    match = PATTERNS['segments'].search(text)
+    if match:
+        estimate['segments_kept'] = int(match.group(1))
+        estimate['segments_total'] = int(match.group(2))
+    return estimate
+
+
+def job_memory(estimate, ram_mb, memory=3000):
+    '''
+    Picks the memory= value of a r.cost run: enough to keep all segments in memory, but not more than the budget.
+    :param estimate: Dictionary as returned by parse_estimates() for a run with memory=memory.
+    :param ram_mb: RAM budget in MB for all runs together.
+    :param memory: memory= value the estimate was made with.
+    :return: memory= value in MB.
+    '''
+    if estimate.get('memory_mb') is None:
+        return min(memory, ram_mb)
+    needed = estimate['memory_mb']
+    # Not all segments fit into memory with the current setting: scale up to all segments.
+    if estimate.get('segments_kept') and estimate.get('segments_total'):
+        needed = needed / estimate['segments_kept'] * estimate['segments_total']
+    # Leave some room for the module itself.
+    return int(max(1, min(math.ceil(needed * 1.05), ram_mb)))
+
+
+def free_disk_mb():
+    '''
+    Free disk space of the GRASS database.
+    :return: Free space in MB.
+    '''
+    return shutil.disk_usage(gs.gisenv()['GISDBASE']).free / 1024 ** 2
+
+
+def plan(jobs, estimates, ram_mb, memory=3000):
+    '''
+    Sets the memory= value ('memory') and expected disk use ('disk') of each job and orders them largest first.
+    :param jobs: List of job dictionaries, see def_rcost_parallel.rcost_job().
+    :param estimates: Dictionary {output name: estimate} as returned by costdistcheck().
+    :param ram_mb: RAM budget in MB for all runs together.
+    :param memory: memory= value the estimates were made with.
+    :return: List of job dictionaries, largest first.
+    '''
+    for job in jobs:
+        estimate = estimates.get(job['output'].split('@')[0])
+        if estimate is None:
+            continue
+        job['memory'] = job_memory(estimate, ram_mb, memory)
+        job['disk'] = estimate.get('disk_mb') or 0
+    return sorted(jobs, key=lambda job: (job['memory'], job.get('disk', 0)), reverse=True)
+
+
+class Budget:
+    '''
+    RAM and disk budget shared by parallel runs. A run waits until its memory and disk fit into what is left.
+    A run larger than the whole budget is started once nothing else is running.
+    :param ram_mb: RAM budget in MB.
+    :param disk_mb: Disk budget in MB, None for no limit.
+    '''
+
+    def __init__(self, ram_mb, disk_mb=None):
+        self.ram_mb = ram_mb
+        self.disk_mb = disk_mb
+        self.ram_used = 0
+        self.disk_used = 0
+        self.running = 0
+        self.condition = threading.Condition()
+
+    def fits(self, memory, disk):
+        if self.running == 0:
+            return True
+        if self.ram_used + memory > self.ram_mb:
+            return False
+        if self.disk_mb is not None and self.disk_used + disk > self.disk_mb:
+            return False
+        return True
+
+    def acquire(self, memory, disk=0):
+        with self.condition:
+            self.condition.wait_for(lambda: self.fits(memory, disk))
+            self.ram_used += memory
+            self.disk_used += disk
+            self.running += 1
+
+    def release(self, memory, disk=0):
+        with self.condition:
+            self.ram_used -= memory
+            self.disk_used -= disk
+            self.running -= 1
+            self.condition.notify_all()
@@ -0,0 +1,175 @@
+'''
+Sparse GeoTIFFs of the thresholded corridors and a network join that only reads their non-NULL blocks.
+After tenperc() about 90% of every '_10perc' corridor is NULL. routgdal(..., sparse=True) exports them as tiled
+GeoTIFFs with SPARSE_OK=TRUE: GDAL does not write tiles that hold only nodata, so the file size follows the area of
+the corridor instead of the area of the raster. Such tiles have no offset in the TIFF (BLOCK_OFFSET_[x]_[y] of the
+'TIFF' metadata domain is empty), which SparseRaster uses to list the tiles that hold data without reading any.
+
+network_join_sparse() joins the exported corridors as network_join() does in GRASS (stretch to 1-255, nmin(),
+multiply by 100, round), but reads only the tiles that hold data:
+ - pass 1 opens every file once, lists its tiles with data and takes its min and max from those tiles (skipped for
+   files given in 'ranges');
+ - pass 2 goes through the raster in strips of 'tilerows' rows and reads, per file, only the tiles of the strip that
+   hold data. Strips without any data are not written to the (sparse) output either.
+All files have to be on the same grid, e.g. exported from the same cost surface.
+
+Usage:
+    routgdal(data, 'Float32', outloc, catalog=catalog, sparse=True)
+    files = [f'{outloc}/{rast.split("@")[0]}_Float32.tif' for rast in data]
+    network_join_sparse(files, f'{outloc}/network_slope_1_Int16.tif')
+'''
+
+import datetime
+import math
+import os
+import numpy as np
+
+
+class SparseRaster:
+    '''
+    Tiled GeoTIFF that is read only where it holds data. Nodata cells are NaN.
+    :param path: Path of the file.
+    '''
+
+    def __init__(self, path):
+        # GDAL is only needed for the sparse files, the pipeline runs without it.
+        from osgeo import gdal
+        self.path = path
+        self.ds = gdal.Open(path)
+        if self.ds is None:
+            raise ValueError(f'{path} cannot be opened by GDAL, check its export.')
+        self.band = self.ds.GetRasterBand(1)
+        self.shape = (self.ds.RasterYSize, self.ds.RasterXSize)
+        self.block = tuple(reversed(self.band.GetBlockSize()))  # (rows, cols)
+        self.nodata = self.band.GetNoDataValue()
+
+    def grid(self):
+        return self.shape, self.ds.GetGeoTransform(), self.block
+
+    def blocks(self):
+        '''
+        :return: List of (block row, block column) of the tiles that are written to the file.
+        '''
+        nrows = math.ceil(self.shape[0] / self.block[0])
+        ncols = math.ceil(self.shape[1] / self.block[1])
+        tiff = self.ds.GetDriver().ShortName in ('GTiff', 'COG')
+        present = []
+        for by in range(nrows):
+            for bx in range(ncols):
+                # Empty for tiles that were not written (SPARSE_OK). Files that are not TIFFs have all blocks.
+                if not tiff or self.band.GetMetadataItem(f'BLOCK_OFFSET_{bx}_{by}', 'TIFF') not in (None, '', '0'):
+                    present.append((by, bx))
+        return present
+
+    def window(self, by, bx):
+        '''
+        :return: (row, column, rows, columns) of a tile, clipped to the raster.
+        '''
+        row, col = by * self.block[0], bx * self.block[1]
+        return row, col, min(self.block[0], self.shape[0] - row), min(self.block[1], self.shape[1] - col)
+
+    def read(self, row, col, nrows, ncols):
+        values = self.band.ReadAsArray(col, row, ncols, nrows).astype(np.float64)
+        if self.nodata is not None:
+            values[values == self.nodata] = np.nan
+        return values
+
+    def close(self):
+        self.band = None
+        self.ds = None
+
+
+def network_join_sparse(files, output, stretch_min=1, stretch_max=255, scale=100, ranges=None, tilerows=1024,
+                        nodata=0):
+    '''
+    Joins exported corridors into a network as network_join() does, reading only the tiles of the files that hold
+    data. The output is a sparse tiled Int16 GeoTIFF (1-255 * 100 fits into Int16).
+    Stretch formula as in network_join():
+    ( x - min(x) ) * (smax - smin) / ( max(x) - min(x) ) + smin
+    :param files: List of paths of corridor GeoTIFFs on the same grid and with the same tiles, e.g. exported by
+    routgdal(..., sparse=True). Files that do not exist (e.g. failed exports) are not joined.
+    :param output: Path of the joined GeoTIFF.
+    :param stretch_min: Lower end of the stretch.
+    :param stretch_max: Upper end of the stretch.
+    :param scale: Factor applied before rounding to integer.
+    :param ranges: Optional dictionary {path: (min, max)} of precomputed min and max values. Files not in it are
+    read once more to get them.
+    :param tilerows: Rows of the strips of pass 2. Memory holds about two float arrays of tilerows x columns.
+    :param nodata: Nodata value of the output.
+    :return: Dictionary {path: (min, max)} of the ranges used.
+    '''
+    if ranges is None:
+        ranges = {}
+    missing = [path for path in files if not os.path.exists(path)]
+    for path in missing:
+        print(f'{path} does not exist and will not be joined. Check what happened.')
+    files = [path for path in files if path not in missing]
+    if not files:
+        print('No files to join. Nothing happens.')
+        return ranges
+    # GDAL is only needed for the sparse files, the pipeline runs without it.
+    from osgeo import gdal
+    begin_time = datetime.datetime.now()
+
+    # ________Pass 1: tiles with data and ranges________
+    present = {}
+    grid = None
+    for i, path in enumerate(files, start=1):
+        raster = SparseRaster(path)
+        if grid is None:
+            grid = raster.grid()
+        elif raster.grid() != grid:
+            raise ValueError(f'{path} is not on the grid (or has other tiles) than {files[0]}.')
+        present[path] = [raster.window(by, bx) for by, bx in raster.blocks()]
+        if path not in ranges:
+            low, high = math.inf, -math.inf
+            for window in present[path]:
+                values = raster.read(*window)
+                if not np.isnan(values).all():
+                    low, high = min(low, np.nanmin(values)), max(high, np.nanmax(values))
+            ranges[path] = (float(low), float(high))
+        raster.close()
+        print(f'{i}: {path}\n {len(present[path])} tiles with data, min: {ranges[path][0]} max: {ranges[path][1]}')
+
+    # ________Pass 2: join strip by strip________
+    (nrows, ncols), geotransform, block = grid
+    # Strips of whole tiles, so that every tile is read once.
+    tilerows = max(block[0], tilerows // block[0] * block[0])
+    out = gdal.GetDriverByName('GTiff').Create(output, ncols, nrows, 1, gdal.GDT_Int16,
+                                               options=['TILED=YES', 'SPARSE_OK=TRUE', 'COMPRESS=LZW',
+                                                        'BIGTIFF=IF_SAFER'])
+    out.SetGeoTransform(geotransform)
+    out.SetProjection(gdal.Open(files[0]).GetProjection())
+    band = out.GetRasterBand(1)
+    band.SetNoDataValue(nodata)
+
+    for row0 in range(0, nrows, tilerows):
+        rows = min(tilerows, nrows - row0)
+        joined = None
+        for path in files:
+            windows = [w for w in present[path] if row0 <= w[0] < row0 + rows]
+            if not windows:
+                continue
+            map_min, map_max = ranges[path]
+            raster = SparseRaster(path)
+            for row, col, wrows, wcols in windows:
+                values = raster.read(row, col, wrows, wcols)
+                stretched = (values - map_min) * (stretch_max - stretch_min) / (map_max - map_min) + stretch_min
+                if joined is None:
+                    joined = np.full((rows, ncols), np.nan)
+                target = joined[row - row0:row - row0 + wrows, col:col + wcols]
+                # fmin() ignores NaN, as nmin() ignores NULL.
+                np.fmin(target, stretched, out=target)
+            raster.close()
+        if joined is None:
+            # No data in this strip, nothing is written (SPARSE_OK).
+            continue
+        # round() of r.mapcalc rounds halves away from zero.
+        result = np.where(np.isnan(joined), nodata, np.sign(joined) * np.floor(np.abs(joined) * scale + 0.5))
+        band.WriteArray(result.astype(np.int16), 0, row0)
+
+    band = None
+    out = None
+    runtime_join = (datetime.datetime.now() - begin_time).total_seconds()
+    print(f'Joining {len(files)} files into {output} took {runtime_join/60} mins.')
+    return ranges
@@ -0,0 +1,304 @@
+'''
+GRASS-free stand-in for the parts of grass.script used by the corridor pipeline.
+The module calls are translated into calls of one in-memory ArrayBackend (see def_backend.py): rasters are NumPy
+arrays, r.cost is replaced by the NumPy engine of def_rcost_numpy.py and r.mapcalc expressions are translated to
+NumPy. Files written by r.out.gdal and read by r.in.gdal / r.external are NumPy .npz archives (data and grid) under
+the name given, e.g. '[name].tif', so that neither GRASS nor GDAL is needed.
+
+This is meant for benchmarks and tests of the pipeline logic on machines without GRASS (see benchmark_corridor.py),
+not for real analyses. Call install() before importing any other def_* module:
+
+    import def_standin
+    def_standin.install()
+    from def_rcost_run import costdist
+    costdist(costsurfaces, cststart, backend=def_standin.BACKEND)
+'''
+
+import fnmatch
+import io
+import os
+import sys
+import tempfile
+import types
+import numpy as np
+import def_backend
+import def_region
+from def_backend import ArrayBackend, as_list, base
+
+GISDBASE = tempfile.gettempdir()
+
+
+class ScriptError(Exception):
+    pass
+
+
+class CalledModuleError(ScriptError):
+    pass
+
+
+def save(path, array, grid):
+    '''
+    Writes a raster file as read by r.in.gdal and r.external of the stand-in.
+    :param path: Path of the file; e.g. '[folder]/costsurf_[name].tif'.
+    :param array: 2D array, NaN for null cells.
+    :param grid: Dictionary with n, s, e, w, nsres and ewres.
+    :return: None
+    '''
+    with open(path, 'wb') as f:
+        np.savez(f, data=array, grid=np.array([grid[k] for k in ('n', 's', 'e', 'w', 'nsres', 'ewres')]))
+
+
+class StandinBackend(ArrayBackend):
+    '''
+    ArrayBackend reading and writing .npz archives instead of GDAL files.
+    '''
+
+    def read_file(self, path):
+        with np.load(path) as f:
+            n, s, e, w, nsres, ewres = (float(v) for v in f['grid'])
+            return f['data'].astype(np.float64), {'n': n, 's': s, 'e': e, 'w': w, 'nsres': nsres, 'ewres': ewres}
+
+    def write_file(self, path, array, grid, datatype='Float32', driver='GTiff', createopt='', nodata=0):
+        save(path, array, grid)
+
+
+# In-memory GRASS database
+BACKEND = StandinBackend()
+
+
+def reset():
+    '''
+    Empties the in-memory database.
+    :return: None
+    '''
+    BACKEND.__init__()
+
+
+# _____________GRASS.SCRIPT_____________
+def region(**kwargs):
+    return BACKEND.region()
+
+
+def region_env(**kwargs):
+    return ';'.join(f'{key}: {value}' for key, value in BACKEND.region().items())
+
+
+def gisenv(**kwargs):
+    return {'GISDBASE': GISDBASE, 'LOCATION_NAME': 'standin', 'MAPSET': 'PERMANENT'}
+
+
+def raster_info(map, **kwargs):
+    return BACKEND.info(map)
+
+
+def mapcalc(exp, **kwargs):
+    BACKEND.mapcalc(exp)
+
+
+def list_strings(type, mapset=None, pattern=None, exclude=None, flag='', **kwargs):
+    if type == 'raster':
+        names = BACKEND.list(pattern, exclude)
+    else:
+        names = [n for n in sorted(BACKEND.vectors) if not pattern or fnmatch.fnmatch(n, pattern)]
+    return [f'{n}@PERMANENT' for n in names]
+
+
+def find_file(name, element='cell', **kwargs):
+    if BACKEND.exists(name, 'vector' if element == 'vector' else 'raster'):
+        return {'name': base(name), 'file': os.path.join(GISDBASE, 'standin', 'PERMANENT', element, base(name)),
+                'mapset': 'PERMANENT', 'fullname': f'{base(name)}@PERMANENT'}
+    return {'name': '', 'file': '', 'mapset': '', 'fullname': ''}
+
+
+def estimate(memory=None, **kwargs):
+    # Output of r.cost -i
+    cells = BACKEND.region()['rows'] * BACKEND.region()['cols']
+    return (f'Will need at least {cells * 40 / 1024 ** 2:.2f} MB of disk space\n'
+            f'Will need at least {min(cells * 40 / 1024 ** 2, float(memory or 300)):.2f} MB of memory\n'
+            f'1 of 1 segments are kept in memory\n')
+
+
+def lines_ascii(vector):
+    # v.out.ascii format=standard
+    text = ['ORGANIZATION: standin', 'VERTI:']
+    for cat, coords in BACKEND.lines(vector):
+        text.append(f'L  {len(coords)} 1')
+        text += [f' {x} {y}' for x, y in coords]
+        text.append(f' 1     {cat}')
+    return '\n'.join(text) + '\n'
+
+
+def dispatch(module, kwargs):
+    '''
+    Runs a GRASS module call on the backend.
+    :return: Standard output of the module as string.
+    '''
+    for key in ('env', 'overwrite', 'quiet', 'verbose', 'stdout', 'stderr', 'superquiet'):
+        kwargs.pop(key, None)
+    stdin = kwargs.pop('stdin', None)
+    if isinstance(stdin, bytes):
+        stdin = stdin.decode()
+    get = kwargs.get
+
+    if module == 'g.region':
+        return ''.join(f'{key}={value}\n' for key, value in BACKEND.region().items()) if 'g' in get('flags', '') else ''
+    if module == 'r.mapcalc':
+        BACKEND.mapcalc(stdin if get('file') == '-' else get('expression'))
+    elif module in ('r.in.gdal', 'r.external'):
+        BACKEND.import_raster(get('input'), get('output'))
+    elif module == 'r.out.gdal':
+        BACKEND.export(get('input'), get('output'), get('type', 'Float32'))
+    elif module == 'r.cost':
+        if 'i' in get('flags', ''):
+            return estimate(get('memory'))
+        BACKEND.cost(get('input'), as_list(get('start_coordinates')), get('output'), get('outdir'), get('flags', ''))
+    elif module == 'r.path':
+        BACKEND.path(get('input'), get('values'), get('vector_path'),
+                     coordinates=as_list(get('start_coordinates', '')), points=get('start_points'))
+    elif module == 'r.quantile':
+        percentiles = as_list(get('percentiles'))
+        return ''.join(f'{i}:{float(p):f}:{value}\n'
+                       for i, (p, value) in enumerate(zip(percentiles, BACKEND.quantile(get('input'), percentiles))))
+    elif module == 'r.recode':
+        rules = [[None if v == '*' else float(v) for v in line.split(':')] for line in stdin.strip().splitlines()]
+        BACKEND.recode(get('input'), get('output'), [(low, high, int(value)) for low, high, value in rules])
+    elif module == 'r.univar':
+        return ''.join(f'{key}={value}\n' for key, value in BACKEND.univar(get('map')).items())
+    elif module == 'r.what':
+        coords = as_list(get('coordinates'))
+        points = [(x, y, i) for i, (x, y) in enumerate(zip(coords[0::2], coords[1::2]))]
+        values = BACKEND.what(get('map'), points)
+        return ''.join(f'{x}|{y}||{"*" if values[str(i)] is None else values[str(i)]}\n' for x, y, i in points)
+    elif module == 'g.remove':
+        element = get('type', 'raster')
+        storage = BACKEND.rasters if element == 'raster' else BACKEND.vectors
+        names = as_list(get('name')) if get('name') else [n for n in storage if fnmatch.fnmatch(n, get('pattern'))]
+        if 'f' in get('flags', ''):
+            BACKEND.remove(names, element)
+    elif module == 'g.rename':
+        BACKEND.rename(*as_list(get('raster')))
+    elif module == 'g.copy':
+        src, dst = as_list(get('raster'))
+        BACKEND.rasters[base(dst)] = BACKEND.rasters[base(src)].copy()
+    elif module == 'v.in.ascii':
+        BACKEND.points(get('output'), [line.split(',') for line in stdin.strip().splitlines()])
+    elif module == 'v.extract':
+        BACKEND.extract(get('input'), get('cats'), get('output'))
+    elif module == 'v.out.ascii':
+        return lines_ascii(get('input'))
+    elif module == 'g.proj':
+        return BACKEND.projection()
+    elif module != 'r.category':
+        raise CalledModuleError(f'Module {module} is not part of the stand-in.')
+    return ''
+
+
+class Proc:
+    '''
+    Finished module call, as returned by start_command() and pipe_command().
+    '''
+
+    def __init__(self, out):
+        self.out = out.encode()
+        self.stdout = io.BytesIO(self.out)
+        self.returncode = 0
+
+    def wait(self):
+        return 0
+
+    def communicate(self, input=None):
+        return self.out, b''
+
+
+def run_command(module, **kwargs):
+    dispatch(module, kwargs)
+    return 0
+
+
+def read_command(module, **kwargs):
+    return dispatch(module, kwargs)
+
+
+def write_command(module, **kwargs):
+    dispatch(module, kwargs)
+    return 0
+
+
+def parse_command(module, **kwargs):
+    out = dispatch(module, kwargs)
+    return dict(line.split('=', 1) for line in out.splitlines() if '=' in line)
+
+
+def start_command(module, **kwargs):
+    return Proc(dispatch(module, kwargs))
+
+
+def pipe_command(module, **kwargs):
+    return Proc(dispatch(module, kwargs))
+
+
+class array(np.ndarray):
+    '''
+    Stand-in for grass.script.array.array: an array of the size of the region, read from and written to the backend.
+    '''
+
+    def __new__(cls, mapname=None, null=None, dtype=np.double, **kwargs):
+        reg = BACKEND.region()
+        obj = np.ndarray.__new__(cls, shape=(reg['rows'], reg['cols']), dtype=dtype)
+        if mapname is not None:
+            obj[...] = BACKEND.read(mapname)
+        return obj
+
+    def read(self, mapname, null=None):
+        self[...] = BACKEND.read(mapname)
+
+    def write(self, mapname, title=None, null=None, overwrite=None, quiet=None):
+        values = np.asarray(self, dtype=np.float64)
+        if null is not None:
+            values[values == null] = np.nan
+        # The type of the raster follows the type of the array, as in grass.script.array.
+        mtype = {np.dtype(np.float32): 'FCELL', np.dtype(np.int32): 'CELL'}.get(self.dtype, 'DCELL')
+        BACKEND.write(mapname, values, mtype=mtype)
+
+
+# _____________INSTALL_____________
+def install():
+    '''
+    Registers the stand-in as grass.script (with core, array, setup and raster) and grass.exceptions.
+    :return: None
+    '''
+    me = sys.modules[__name__]
+    grass = types.ModuleType('grass')
+    script = types.ModuleType('grass.script')
+    arraymod = types.ModuleType('grass.script.array')
+    setup = types.ModuleType('grass.script.setup')
+    exceptions = types.ModuleType('grass.exceptions')
+
+    for name in ('run_command', 'read_command', 'write_command', 'parse_command', 'start_command',
+                 'pipe_command', 'list_strings', 'find_file', 'mapcalc', 'region', 'region_env', 'gisenv',
+                 'raster_info', 'ScriptError', 'CalledModuleError'):
+        setattr(script, name, getattr(me, name))
+    script.core = script
+    script.raster = script
+    script.array = arraymod
+    script.setup = setup
+    script.Popen = Proc
+    arraymod.array = array
+    setup.init = lambda *args, **kwargs: None
+    setup.finish = lambda *args, **kwargs: None
+    exceptions.ScriptError = ScriptError
+    exceptions.CalledModuleError = CalledModuleError
+    grass.script = script
+    grass.exceptions = exceptions
+
+    sys.modules.update({'grass': grass,
+                        'grass.script': script,
+                        'grass.script.core': script,
+                        'grass.script.raster': script,
+                        'grass.script.array': arraymod,
+                        'grass.script.setup': setup,
+                        'grass.exceptions': exceptions})
+    # GrassBackend then runs on the stand-in as well.
+    def_backend.gs = def_backend.gscore = script
+    def_backend.garray = arraymod
+    def_region.gs = script
@@ -0,0 +1,400 @@
+'''
+Tiled (out-of-core) corridor computation.
+corridor_perc() needs both cost distance raster fully in memory, which is not possible for cost distance raster of
+several GB each. Here the two cost distance raster are streamed in strips of 'tilerows' rows: (A + B)/2 and the
+threshold are calculated per strip and every strip is written straight to the output, so memory only depends on
+tilerows and the number of columns, not on the size of the raster. Several pairs can therefore run at the same time
+on one node (corridors_tiled()).
+
+Raster are read and written block-wise
+ - through GRASS (pygrass RasterRow, row by row in the computational region) for GRASS raster names, or
+ - through GDAL (ReadAsArray / WriteArray on windows) for paths of GeoTIFFs, e.g. exported or linked cost distance.
+
+The percentile is found as r.quantile does: a first pass counts the corridor values in 'bins' bins between the
+lowest and highest possible value (from the ranges of the inputs), a second pass collects the values of the bins
+holding the percentile and a third pass writes the thresholded corridor. The percentile is interpolated between the
+closest ranks, so the result is the same as that of corridor_perc() (numpy.percentile).
+Each input is read three times; memory holds a few strips plus the values of one or two bins.
+'''
+
+import math
+import os
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import grass.script as gs
+from def_catalog import RasterCatalog
+from def_corridors import corridor_name
+from def_precision import CELL_NULL
+from def_windows import pair_options
+
+
+# _____________BLOCK I/O_____________
+class GrassRaster:
+    '''
+    GRASS raster read or written row by row in the computational region of this process (pygrass RasterRow).
+    NULL cells are NaN.
+    :param name: Raster name.
+    :param mode: 'r' or 'w'. Rows have to be written in order.
+    :param mtype: Type of a new raster; 'DCELL', 'FCELL' or 'CELL' (see def_precision.py).
+    '''
+
+    def __init__(self, name, mode='r', mtype='DCELL'):
+        from grass.pygrass.raster import RasterRow
+        from grass.pygrass.gis.region import Region
+        region = Region()
+        self.shape = (region.rows, region.cols)
+        self.name = name
+        self.raster = RasterRow(name)
+        if mode == 'w':
+            self.raster.open('w', mtype=mtype, overwrite=True)
+        else:
+            self.raster.open('r')
+        self.null = CELL_NULL if self.raster.mtype == 'CELL' else None
+
+    def range(self):
+        info = gs.raster_info(self.name)
+        return info['min'], info['max']
+
+    def read(self, row0, nrows):
+        block = np.empty((nrows, self.shape[1]), dtype=np.float64)
+        for i in range(nrows):
+            block[i] = self.raster[row0 + i]
+        if self.null is not None:
+            block[block == self.null] = np.nan
+        return block
+
+    def write(self, block):
+        from grass.pygrass.raster.buffer import Buffer
+        row = Buffer((self.shape[1],), mtype=self.raster.mtype)
+        if self.null is not None:
+            block = np.where(np.isnan(block), self.null, block)
+        for values in block:
+            row[:] = values
+            self.raster.put_row(row)
+
+    def close(self):
+        self.raster.close()
+
+
+class GdalRaster:
+    '''
+    GeoTIFF read or written by windows of rows through GDAL. NULL (nodata) cells are NaN.
+    :param path: Path of the file.
+    :param mode: 'r' or 'w'.
+    :param like: GdalRaster the new file copies size, georeference and projection from (mode 'w').
+    :param mtype: Type of a new file as GRASS type; 'DCELL' (Float64), 'FCELL' (Float32) or 'CELL' (Int32).
+    '''
+
+    def __init__(self, path, mode='r', like=None, mtype='DCELL'):
+        from osgeo import gdal
+        self.null = None
+        if mode == 'w':
+            src = like.ds
+            datatype = {'DCELL': gdal.GDT_Float64, 'FCELL': gdal.GDT_Float32, 'CELL': gdal.GDT_Int32}[mtype]
+            self.ds = gdal.GetDriverByName('GTiff').Create(path, src.RasterXSize, src.RasterYSize, 1, datatype,
+                                                           options=['TILED=YES', 'COMPRESS=LZW',
+                                                                    f'PREDICTOR={2 if mtype == "CELL" else 3}',
+                                                                    'BIGTIFF=IF_SAFER'])
+            self.ds.SetGeoTransform(src.GetGeoTransform())
+            self.ds.SetProjection(src.GetProjection())
+            if mtype == 'CELL':
+                self.null = CELL_NULL
+                self.ds.GetRasterBand(1).SetNoDataValue(CELL_NULL)
+            else:
+                self.ds.GetRasterBand(1).SetNoDataValue(float('nan'))
+        else:
+            self.ds = gdal.Open(path)
+        self.band = self.ds.GetRasterBand(1)
+        self.shape = (self.ds.RasterYSize, self.ds.RasterXSize)
+        self.row = 0
+
+    def range(self):
+        # An approximate range is enough, values outside of it are counted in the first or last bin.
+        lo, hi = self.band.ComputeRasterMinMax(True)
+        return lo, hi
+
+    def read(self, row0, nrows):
+        block = self.band.ReadAsArray(0, row0, self.shape[1], nrows).astype(np.float64)
+        nodata = self.band.GetNoDataValue()
+        if nodata is not None and not math.isnan(nodata):
+            block[block == nodata] = np.nan
+        return block
+
+    def write(self, block):
+        if self.null is not None:
+            block = np.where(np.isnan(block), self.null, block)
+        self.band.WriteArray(block, 0, self.row)
+        self.row += block.shape[0]
+
+    def close(self):
+        self.band = None
+        self.ds = None
+
+
+def set_region(name, window=None):
+    '''
+    Sets the computational region of this process (not of the mapset) to a GRASS raster. Pairs running in parallel
+    processes therefore do not change each other's region, and a region changed by g.region since is not missed.
+    :param name: Raster name.
+    :param window: Optional dictionary with n, s, e and w (see def_windows.py). The region is clipped to it and
+    aligned to the grid of the raster, as g.region align= does.
+    :return: None
+    '''
+    from grass.pygrass.gis.region import Region
+    region = Region()
+    region.from_rast(name)
+    if window is not None:
+        # Whole cells of the raster that cover the window.
+        north = region.north - math.floor((region.north - min(window['n'], region.north)) / region.nsres) * region.nsres
+        south = region.south + math.floor((max(window['s'], region.south) - region.south) / region.nsres) * region.nsres
+        east = region.east - math.floor((region.east - min(window['e'], region.east)) / region.ewres) * region.ewres
+        west = region.west + math.floor((max(window['w'], region.west) - region.west) / region.ewres) * region.ewres
+        region.north, region.south, region.east, region.west = north, south, east, west
+        region.adjust()
+    region.set_raster_region()
+
+
+def open_raster(name, mode='r', like=None, mtype='DCELL'):
+    # Paths of files are read through GDAL, anything else is a GRASS raster.
+    if name.endswith('.tif'):
+        return GdalRaster(name, mode, like, mtype)
+    return GrassRaster(name, mode, mtype)
+
+
+def strips(nrows, tilerows):
+    for row0 in range(0, nrows, tilerows):
+        yield row0, min(tilerows, nrows - row0)
+
+
+def corridor_strip(a, b, row0, nrows, precision=None):
+    # (A + B)/2 of a strip, as stored in the precision.
+    values = a.read(row0, nrows)
+    values += b.read(row0, nrows)
+    values /= 2
+    if precision is not None:
+        values = precision.array(values)
+    return values
+
+
+# _____________STREAMING PERCENTILE_____________
+def tiled_percentile(a, b, percentile, tilerows=256, bins=65536, full=None, precision=None):
+    '''
+    Calculates the percentile of the corridor (A + B)/2 in two passes over the inputs.
+    :param a: Open raster (GrassRaster or GdalRaster) of the first cost distance.
+    :param b: Open raster of the second cost distance.
+    :param percentile: Percentile (0-100).
+    :param tilerows: Number of rows held in memory per input.
+    :param bins: Number of histogram bins of the first pass.
+    :param full: Optional open raster the full corridor is written to during the first pass.
+    :param precision: Optional Precision (see def_precision.py); the percentile is taken from the values as stored.
+    :return: The percentile, None if the corridor has no values.
+    '''
+    # All corridor values lie within the mean of the input ranges.
+    (amin, amax), (bmin, bmax) = a.range(), b.range()
+    lo, hi = (amin + bmin) / 2, (amax + bmax) / 2
+    scale = bins / (hi - lo) if hi > lo else 0.0
+
+    def corridor(row0, nrows):
+        return corridor_strip(a, b, row0, nrows, precision)
+
+    def binned(values):
+        return np.clip(((values - lo) * scale).astype(np.int64), 0, bins - 1)
+
+    # ________Pass 1: histogram________
+    counts = np.zeros(bins, dtype=np.int64)
+    for row0, nrows in strips(a.shape[0], tilerows):
+        values = corridor(row0, nrows)
+        if full is not None:
+            full.write(values)
+        values = values[~np.isnan(values)]
+        counts += np.bincount(binned(values), minlength=bins)
+
+    n = int(counts.sum())
+    if n == 0:
+        return None
+
+    # Ranks of the two values to interpolate between, as numpy.percentile (linear).
+    rank = percentile / 100 * (n - 1)
+    low, high = math.floor(rank), math.ceil(rank)
+    cumulative = np.cumsum(counts)
+    first = int(np.searchsorted(cumulative, low, side='right'))
+    last = int(np.searchsorted(cumulative, high, side='right'))
+    before = int(cumulative[first - 1]) if first > 0 else 0
+
+    # ________Pass 2: exact values of the bins holding the ranks________
+    selected = []
+    for row0, nrows in strips(a.shape[0], tilerows):
+        values = corridor(row0, nrows)
+        values = values[~np.isnan(values)]
+        index = binned(values)
+        selected.append(values[(index >= first) & (index <= last)])
+    selected = np.sort(np.concatenate(selected))
+    vlow, vhigh = selected[low - before], selected[high - before]
+    return vlow + (vhigh - vlow) * (rank - low)
+
+
+# _____________CORRIDORS_____________
+def corridor_tiled(site1, site2, percentile=10, keep_full=False, tilerows=256, bins=65536, precision=None,
+                   window=None):
+    '''
+    Creates the lower percentile of a corridor as corridor_perc() does, streaming both cost distance raster in strips
+    of rows instead of reading them into memory.
+    For GRASS raster the computational region of the process is set to site1; cost distance raster of the same cost
+    surface share its grid.
+    :param site1: A cost distance raster of pattern '[site]_[costdist]@[MAPSET]', or the path of a GeoTIFF of pattern
+    '[folder]/[site]_[costdist].tif'.
+    :param site2: A cost distance raster or GeoTIFF from another site, as site1.
+    :param percentile: Percentile at and above which cells are promoted to NULL. None writes the full corridor only.
+    :param keep_full: If True the full corridor is written as well.
+    :param tilerows: Number of rows held in memory per raster. Memory is about 4 * tilerows * columns * 8 bytes.
+    :param bins: Number of histogram bins used to find the percentile.
+    :param precision: Optional Precision (see def_precision.py) the corridors are written in, as in corridor_perc().
+    :param window: Optional window of the pair (dictionary with n, s, e and w, see def_windows.py); only its cells
+    are read and are part of the percentile. GRASS raster only.
+    :return: List of the created raster, or GeoTIFFs next to site1 for GeoTIFF inputs. Names as in corridor_perc():
+    'corridor_[a]_[b]_[root]_[percentile]perc' and 'corridor_[a]_[b]_[root]'.
+    '''
+    folder = os.path.dirname(site1) if site1.endswith('.tif') else None
+    name1, name2 = (os.path.splitext(os.path.basename(s))[0] if folder else s for s in (site1, site2))
+    rast = name1.split("_", 1)[1].split("@")[0]
+    corridor = corridor_name(name1.split("_")[0], name2.split("_")[0], rast)
+    outputs = []
+
+    def target(name):
+        return os.path.join(folder, f'{name}.tif') if folder else name
+
+    if not folder:
+        set_region(site1, window)
+    elif window is not None:
+        raise ValueError('Windows can only be used with GRASS raster, not with GeoTIFFs.')
+    a, b = open_raster(site1), open_raster(site2)
+    mtype = precision.mtype if precision is not None else 'DCELL'
+    full = None
+    if keep_full or percentile is None:
+        full = open_raster(target(corridor), 'w', like=a, mtype=mtype)
+        outputs.append(target(corridor))
+
+    begin_time = datetime.datetime.now()
+    if percentile is None:
+        # The full corridor in one pass.
+        for row0, nrows in strips(a.shape[0], tilerows):
+            full.write(corridor_strip(a, b, row0, nrows, precision))
+        perc = None
+    else:
+        perc = tiled_percentile(a, b, percentile, tilerows, bins, full, precision)
+    if full is not None:
+        full.close()
+
+    if perc is not None:
+        print(f'{percentile}th percentile of {corridor}: {perc}')
+        # ________Pass 3: write the thresholded corridor________
+        out = target(f'{corridor}_{percentile}perc')
+        sink = open_raster(out, 'w', like=a, mtype=mtype)
+        for row0, nrows in strips(a.shape[0], tilerows):
+            values = corridor_strip(a, b, row0, nrows, precision)
+            # Promote all cells at or above the percentile to NULL, as in tenperc().
+            values[values >= perc] = np.nan
+            sink.write(values)
+        sink.close()
+        outputs.append(out)
+
+    a.close()
+    b.close()
+    runtime = (datetime.datetime.now() - begin_time).total_seconds()
+    print(f'It took {runtime} seconds to create: \n', *outputs, sep='\n ')
+    return outputs
+
+
+def corridors_tiled(combos, percentile=10, keep_full=False, nprocs=1, tilerows=256, bins=65536, catalog=None,
+                    manifest=None, precision=None, windows=None):
+    '''
+    Creates the percentile corridors of many pairs with corridor_tiled(), nprocs pairs at the same time.
+    Memory per pair is bounded by tilerows, so nprocs can be chosen by the number of cores instead of the raster size.
+    The GRASS library is not thread-safe, so pairs run in separate processes.
+    :param combos: List of tuples of two cost distance raster (or GeoTIFFs), as for corridors_batch().
+    :param percentile: Percentile at and above which cells are promoted to NULL. None writes the full corridors
+    only, named as by corridors().
+    :param keep_full: If True the full corridors are written as well.
+    :param nprocs: Number of pairs at the same time.
+    :param tilerows: Number of rows held in memory per raster, see corridor_tiled().
+    :param bins: Number of histogram bins used to find the percentile.
+    :param catalog: RasterCatalog of PERMANENT shared by the pipeline. Listed once if not given.
+    :param manifest: Optional Manifest (see def_manifest.py). Uses the keys of corridor_perc(), as the outputs are the
+    same.
+    :param precision: Optional Precision (see def_precision.py) the corridors are written in, as in corridor_perc().
+    :param windows: Optional Windows (see def_windows.py); each corridor only covers the window of its pair, as in
+    corridor_perc(). GRASS raster only.
+    :return: Rasters (or GeoTIFFs) of the percentile corridors.
+    '''
+    if catalog is None:
+        catalog = RasterCatalog()
+
+    # ________Pairs still to be created________
+    todo = []
+    keys = {}
+    # Window of every pair to create
+    pairwindows = {}
+    for site1, site2 in combos:
+        if site1.endswith('.tif'):
+            if windows is not None:
+                raise ValueError('Windows can only be used with GRASS raster, not with GeoTIFFs.')
+            todo.append((site1, site2))
+            continue
+        roota = site1.split("_", 1)[1]
+        rootb = site2.split("_", 1)[1]
+        if roota != rootb:
+            # Don't do anything if the raster roots are not the same.
+            print(f'Cost distance raster do not have the same root! Nothing happens for: \n {site1} \n {site2}')
+            continue
+        rast = roota.split("@")[0]
+        corridor = corridor_name(site1.split("_")[0], site2.split("_")[0], rast)
+        if percentile is None:
+            # Only the full corridor, as corridor_tiled() writes it.
+            out = corridor
+            outputs = [corridor]
+        else:
+            out = f'{corridor}_{percentile}perc'
+            outputs = [out, corridor] if keep_full else [out]
+        if windows is not None:
+            pairwindows[(site1, site2)] = windows.pair(site1.split("_")[0], site2.split("_")[0])
+
+        # Remove outputs that are out of date, so that they are created again below.
+        if manifest is not None:
+            keys[(site1, site2)] = manifest.key('corridor_perc', [site1, site2], percentile=percentile,
+                                                **pair_options(site1, site2, windows),
+                                                **(precision.options() if precision is not None else {}))
+            manifest.needs(outputs, keys[(site1, site2)], catalog)
+
+        if all(output in catalog for output in outputs):
+            print(f'!!! {out}\n  already exists and will not be created.')
+            continue
+        todo.append((site1, site2))
+
+    def done(pair, outputs):
+        for output in outputs:
+            if not output.endswith('.tif'):
+                catalog.add(output)
+                if precision is not None:
+                    # The pairs may run in other processes, the errors are kept here.
+                    info = gs.raster_info(output)
+                    if info['min'] is None:
+                        print(f'{output} has no values, no expected error.')
+                    else:
+                        precision.report(output, max(abs(info['min']), abs(info['max'])),
+                                         steps=precision.inherited(*pair) + 1)
+                if manifest is not None:
+                    manifest.record(output, keys[pair], 'corridor_perc')
+
+    # ________Run________
+    if nprocs > 1:
+        with ProcessPoolExecutor(max_workers=nprocs) as pool:
+            futures = {pool.submit(corridor_tiled, site1, site2, percentile, keep_full, tilerows, bins, precision,
+                                   pairwindows.get((site1, site2))):
+                       (site1, site2) for site1, site2 in todo}
+            for future in as_completed(futures):
+                done(futures[future], future.result())
+    else:
+        for site1, site2 in todo:
+            done((site1, site2), corridor_tiled(site1, site2, percentile, keep_full, tilerows, bins, precision,
+                                                pairwindows.get((site1, site2))))
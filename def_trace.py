@@ -0,0 +1,223 @@
+'''
+Tracing of GRASS module calls and pipeline stages.
+Every GRASS module started through grass.script (run_command, read_command, write_command, parse_command,
+pipe_command, start_command and mapcalc all end up in grass.script.core.Popen) is recorded with
+ - the module and its parameters,
+ - the stage of the pipeline it was called in,
+ - the size of the computational region in cells (from GRASS_REGION or the WIND file of the mapset),
+ - wall time, CPU time (user + system) and peak memory (RSS) of the module process.
+CPU time and peak memory are taken from the process itself (os.wait4), so they are correct for parallel runs too.
+Records are written as JSON lines while the pipeline runs. At the end a Chrome trace file (open in
+chrome://tracing or https://ui.perfetto.dev) and a summary table per stage and module can be written.
+
+Usage:
+    tracer = Tracer('/path/trace.jsonl')
+    tracer.install()
+    with tracer.stage('costdist'):
+        costdist(...)
+    # or, in scripts where indenting is not practical
+    tracer.begin('corridors')
+    corridors_batch(...)
+    tracer.end()
+    tracer.chrome('/path/trace.json')
+    tracer.summary()
+'''
+
+import contextlib
+import json
+import os
+import threading
+import time
+import grass.script as gs
+from grass.script import core as gscore
+from grass.exceptions import ScriptError
+
+
+def region_cells(env=None):
+    '''
+    Number of cells of the computational region, read without calling g.region.
+    :param env: Environment of the module call, GRASS_REGION is used if set.
+    :return: Number of cells, None if the region could not be read.
+    '''
+    env = env if env is not None else os.environ
+    text = env.get('GRASS_REGION')
+    if text is None:
+        try:
+            genv = gs.gisenv()
+            wind = os.path.join(genv['GISDBASE'], genv['LOCATION_NAME'], genv['MAPSET'], 'WIND')
+            with open(wind) as f:
+                text = f.read()
+        except (OSError, KeyError, ScriptError):
+            return None
+    # Both formats use 'rows: 10' and 'cols: 10', separated by newlines (WIND) or ';' (GRASS_REGION).
+    values = {}
+    for item in text.replace(';', '\n').splitlines():
+        if ':' in item:
+            key, value = item.split(':', 1)
+            values[key.strip()] = value.strip()
+    try:
+        return int(values['rows']) * int(values['cols'])
+    except (KeyError, ValueError):
+        return None
+
+
+class Tracer:
+    '''
+    Records GRASS module calls and pipeline stages.
+    :param path: Path of the JSON lines file the records are written to.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self.lock = threading.Lock()
+        # Stack of (stage, begin) of the pipeline. Shared by all threads, so module calls of parallel runs are
+        # recorded with the stage that started them.
+        self.stages = []
+        self.start = time.time()
+        self.popen = None
+
+    # _____________STAGES_____________
+    def current_stage(self):
+        return self.stages[-1][0] if self.stages else ''
+
+    def begin(self, name):
+        '''
+        Marks the begin of a stage of the pipeline. Module calls until end() are recorded with this stage.
+        Stages can be nested.
+        :param name: Name of the stage; e.g. 'costdist'.
+        :return: None
+        '''
+        self.stages.append((name, time.time()))
+
+    def end(self):
+        '''
+        Marks the end of the stage started last by begin().
+        :return: None
+        '''
+        name, begin = self.stages.pop()
+        self.write({'type': 'stage',
+                    'stage': name,
+                    'begin': begin,
+                    'wall': time.time() - begin,
+                    'thread': threading.get_ident()})
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''
+        Context manager marking a stage of the pipeline, see begin().
+        :param name: Name of the stage; e.g. 'costdist'.
+        '''
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+
+    # _____________RECORDS_____________
+    def write(self, record):
+        with self.lock:
+            self.records.append(record)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+    def install(self):
+        '''
+        Replaces grass.script.core.Popen by a version that records each module call.
+        :return: None
+        '''
+        if self.popen is not None:
+            return
+        tracer = self
+        self.popen = gscore.Popen
+
+        class TracedPopen(self.popen):
+
+            def __init__(self, args, **kwargs):
+                self.trace = {'type': 'module',
+                              'module': os.path.basename(str(args[0])) if args else '',
+                              'params': [str(a) for a in args[1:]],
+                              'stage': tracer.current_stage(),
+                              'cells': region_cells(kwargs.get('env')),
+                              'begin': time.time(),
+                              'thread': threading.get_ident()}
+                super().__init__(args, **kwargs)
+
+            def wait(self, timeout=None):
+                # Reap the process ourselves to get its resource usage.
+                if self.returncode is None and timeout is None:
+                    try:
+                        pid, status, usage = os.wait4(self.pid, 0)
+                        self.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+                        self.trace.update({'cpu': usage.ru_utime + usage.ru_stime,
+                                           # ru_maxrss is in kilobytes on Linux
+                                           'maxrss_mb': usage.ru_maxrss / 1024})
+                    except ChildProcessError:
+                        pass
+                returncode = super().wait(timeout)
+                if 'wall' not in self.trace:
+                    self.trace.update({'wall': time.time() - self.trace['begin'],
+                                       'returncode': returncode})
+                    tracer.write(self.trace)
+                return returncode
+
+        gscore.Popen = TracedPopen
+
+    def uninstall(self):
+        '''
+        Restores the original grass.script.core.Popen.
+        :return: None
+        '''
+        if self.popen is not None:
+            gscore.Popen = self.popen
+            self.popen = None
+
+    # _____________OUTPUTS_____________
+    def chrome(self, path):
+        '''
+        Writes the records as Chrome trace (Trace Event Format), readable by chrome://tracing and Perfetto.
+        Stages and module calls are shown as nested slices per thread.
+        :param path: Path of the JSON file.
+        :return: None
+        '''
+        events = []
+        for record in self.records:
+            if 'wall' not in record:
+                continue
+            name = record['stage'] if record['type'] == 'stage' else record['module']
+            args = {key: value for key, value in record.items() if key not in ('begin', 'wall', 'thread')}
+            events.append({'name': name,
+                           'cat': record['type'],
+                           'ph': 'X',
+                           'ts': (record['begin'] - self.start) * 1e6,
+                           'dur': record['wall'] * 1e6,
+                           'pid': os.getpid(),
+                           'tid': record['thread'],
+                           'args': args})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self):
+        '''
+        Prints a table of calls, wall time, CPU time, peak memory and cells per stage and module.
+        :return: List of rows as dictionaries.
+        '''
+        rows = {}
+        for record in self.records:
+            if record['type'] != 'module':
+                continue
+            row = rows.setdefault((record['stage'], record['module']),
+                                  {'stage': record['stage'], 'module': record['module'], 'calls': 0,
+                                   'wall': 0.0, 'cpu': 0.0, 'maxrss_mb': 0.0, 'cells': 0})
+            row['calls'] += 1
+            row['wall'] += record.get('wall', 0.0)
+            row['cpu'] += record.get('cpu', 0.0)
+            row['maxrss_mb'] = max(row['maxrss_mb'], record.get('maxrss_mb', 0.0))
+            row['cells'] += record.get('cells') or 0
+
+        rows = sorted(rows.values(), key=lambda row: row['wall'], reverse=True)
+        print(f'{"stage":<20} {"module":<15} {"calls":>6} {"wall [s]":>10} {"cpu [s]":>10} {"peak RSS [MB]":>14} {"cells":>14}')
+        for row in rows:
+            print(f'{row["stage"]:<20} {row["module"]:<15} {row["calls"]:>6} {row["wall"]:>10.1f} '
+                  f'{row["cpu"]:>10.1f} {row["maxrss_mb"]:>14.1f} {row["cells"]:>14}')
+        return rows
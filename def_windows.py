@@ -0,0 +1,104 @@
+'''
+Cropped computational regions for cost distance and corridors.
+By default costdist() and the corridor functions set the region to the full cost surface, so a corridor between two
+nearby sites costs as much as one across the whole surface. Two ways to restrict the cells processed:
+ - Windows: the region of every r.cost run is the bounding box of the site and all sites it is paired with, plus a
+   buffer; the region of every corridor is the bounding box of its two sites plus the buffer. Paths leaving the
+   window are not considered, so the buffer has to be wide enough for the corridors of interest. With all pairs
+   every site is paired with all others and the r.cost windows cover all sites; only pairing nearby sites (see
+   near_pairs()) makes them smaller.
+ - max_cost (costdist()): r.cost stops at the given accumulated cost, cells beyond are NULL. With crop=True the
+   corridor functions then zoom the region to the cells that are not NULL in both cost distance raster.
+All regions are aligned to the grid of the cost surface, so the outputs line up with full-extent raster; r.mapcalc,
+r.quantile, r.out.gdal etc. of the following steps use the (smaller) extent of each output. Windows are clipped and
+aligned by def_region.window_params().
+'''
+
+from itertools import combinations
+
+
+class Windows:
+    '''
+    Bounding windows of the sites and of the pairs of sites.
+    :param cststart: List of sites of pattern [x, y, sid].
+    :param buffer: Buffer around the sites in map units.
+    :param pairs: Optional list of tuples (sid, sid) of the pairs corridors are created for. Default all pairs.
+    '''
+
+    def __init__(self, cststart, buffer, pairs=None):
+        self.coords = {str(sid): (float(x), float(y)) for x, y, sid in cststart}
+        self.buffer = buffer
+        if pairs is None:
+            pairs = combinations(self.coords, 2)
+        # Sites every site is paired with, incl. itself
+        self.partners = {sid: {sid} for sid in self.coords}
+        for a, b in pairs:
+            self.partners[str(a)].add(str(b))
+            self.partners[str(b)].add(str(a))
+
+    def bbox(self, sids):
+        xs = [self.coords[sid][0] for sid in sids]
+        ys = [self.coords[sid][1] for sid in sids]
+        return {'n': max(ys) + self.buffer,
+                's': min(ys) - self.buffer,
+                'e': max(xs) + self.buffer,
+                'w': min(xs) - self.buffer}
+
+    def site(self, sid):
+        '''
+        Window of the cost distance from a site: covers the windows of all its pairs.
+        :return: Dictionary with n, s, e and w.
+        '''
+        return self.bbox(self.partners[str(sid)])
+
+    def pair(self, a, b):
+        '''
+        Window of the corridor between two sites.
+        :return: Dictionary with n, s, e and w.
+        '''
+        return self.bbox([str(a), str(b)])
+
+
+def near_pairs(cststart, distance):
+    '''
+    Pairs of sites closer to each other than a distance, e.g. for Windows and the corridors to create.
+    :param cststart: List of sites of pattern [x, y, sid].
+    :param distance: Largest distance between the sites of a pair in map units.
+    :return: List of tuples (sid, sid).
+    '''
+    pairs = []
+    for (xa, ya, a), (xb, yb, b) in combinations(cststart, 2):
+        if (float(xa) - float(xb)) ** 2 + (float(ya) - float(yb)) ** 2 <= distance ** 2:
+            pairs.append((str(a), str(b)))
+    return pairs
+
+
+def pair_region(site1, site2, windows=None, crop=False, backend=None):
+    '''
+    Sets the region of a corridor between two cost distance raster, for the following calls of the backend.
+    The region is passed to the module calls through GRASS_REGION (see def_region.py), the region of the mapset is not
+    changed.
+    :param site1: A cost distance raster from one site of pattern '[site]_[costdist]@[MAPSET]'.
+    :param site2: A cost distance raster from another site.
+    :param windows: Optional Windows; the region is the window of the pair.
+    :param crop: If True the region is zoomed to the cells that are not NULL in both raster (g.region zoom=).
+    :param backend: Backend to set the region of (see def_backend.py).
+    :return: The region as dictionary.
+    '''
+    window = windows.pair(site1.split("_")[0], site2.split("_")[0]) if windows is not None else None
+    # zoom= shrinks the region, so zooming to both gives a region around the cells covered by both.
+    return backend.region([site1, site2], window=window, zoom=[site1, site2] if crop else None)
+
+
+def pair_options(site1, site2, windows=None, crop=False):
+    '''
+    Parameters of the region of a corridor for the manifest keys (see def_manifest.py). Empty if the full extent is
+    used, so that existing corridors keep their keys.
+    :return: Dictionary.
+    '''
+    options = {}
+    if windows is not None:
+        options['window'] = windows.pair(site1.split("_")[0], site2.split("_")[0])
+    if crop:
+        options['crop'] = True
+    return options
@@ -0,0 +1,14 @@
+'''
+The tests run without GRASS: the def_* modules are imported from the repository root and, where grass.script is not
+installed, grass.script is the stand-in of def_standin.py.
+'''
+
+import importlib.util
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if importlib.util.find_spec('grass') is None:
+    import def_standin
+    def_standin.install()
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from def_backend import ArrayBackend
+from def_network import network_join
+
+# _____________R.MAPCALC FIXTURES_____________
+# Results of r.mapcalc for the expressions of the pipeline, following the NULL rules of the r.mapcalc manual: NULL in
+# an operand or in the condition of if() gives NULL, except for isnull(), nmin(), nmax(), &&& and |||.
+N = np.nan
+A = np.array([[0.0, 1.0, 2.0, N]])
+B = np.array([[3.0, N, 0.0, 1.0]])
+# (a + b) / 2 of CELL raster is an integer division, (a + b) / 2.0 is DCELL.
+HALF_CELL = np.array([[1.0, N, 1.0, N]])
+HALF_DCELL = np.array([[1.5, N, 1.0, N]])
+
+
+@pytest.fixture
+def backend():
+    backend = ArrayBackend()
+    backend.grid = {'n': 100.0, 's': 0.0, 'e': 400.0, 'w': 0.0, 'nsres': 100.0, 'ewres': 100.0}
+    backend.write('a', A, mtype='CELL')
+    backend.write('b', B, mtype='CELL')
+    backend.write('f', A + 0.25, mtype='FCELL')
+    return backend
+
+
+def result(backend, expr):
+    backend.mapcalc(f'out = {expr}')
+    return backend.rasters['out'], backend.info('out')['datatype']
+
+
+@pytest.mark.parametrize('expr, values, datatype', [
+    ('if(a)', [[0, 1, 1, N]], 'CELL'),
+    ('if(a, b)', [[0, N, 0, N]], 'CELL'),
+    ('if(a, 5)', [[0, 5, 5, N]], 'CELL'),
+    ('if(a, 1, 2.5)', [[2.5, 1, 1, N]], 'DCELL'),
+    ('if(a - 1, 1, 2, 3)', [[3, 2, 1, N]], 'CELL'),
+    ('if(a >= 1, null(), a)', [[0, N, N, N]], 'CELL'),
+    ('!isnull(a) + !isnull(b)', [[2, 1, 2, 1]], 'CELL'),
+    ('!a', [[1, 0, 0, N]], 'CELL'),
+    ('isnull(b) ||| b != a', [[1, 1, 1, N]], 'CELL'),
+    ('isnull(a) &&& a', [[0, 0, 0, N]], 'CELL'),
+    ('a || b', [[1, N, 1, N]], 'CELL'),
+    ('nmin(a, b)', [[0, 1, 0, 1]], 'CELL'),
+    ('min(a, b)', [[0, N, 0, N]], 'CELL'),
+    ('b / a', [[N, N, 0, N]], 'CELL'),
+    ('-2 ^ 2 + 7 % 4 * 2', [[10, 10, 10, 10]], 'CELL'),
+    ('2 ^ -1', [[N, N, N, N]], 'CELL'),
+    ('round(f)', [[0, 1, 2, N]], 'CELL'),
+    ('float(a) / 3', [[0, np.float32(1 / 3), np.float32(2 / 3), N]], 'FCELL'),
+    ('double(f) * 2', [[0.5, 2.5, 4.5, N]], 'DCELL'),
+    ('a@PERMANENT * 1.5', [[0, 1.5, 3, N]], 'DCELL'),
+])
+def test_follows_rmapcalc(backend, expr, values, datatype):
+    out, outtype = result(backend, expr)
+    np.testing.assert_allclose(out, np.array(values, dtype=float), rtol=1e-7)
+    assert outtype == datatype
+
+
+def test_corridor_average(backend):
+    np.testing.assert_array_equal(result(backend, '(a + b)/2')[0], HALF_CELL)
+    np.testing.assert_array_equal(result(backend, '(a + b)/2.0')[0], HALF_DCELL)
+
+
+def test_network_join(backend):
+    # Stretch a to 1 + a * 127 and b to 1 + b * 254 / 3, keep the minimum where any corridor has a value.
+    network_join(['a', 'b'], 'joined', argmin='argmin', coverage='coverage', backend=backend)
+    np.testing.assert_array_equal(backend.rasters['joined'], [[100, 12800, 100, 8567]])
+    np.testing.assert_array_equal(backend.rasters['argmin'], [[1, 1, 2, 2]])
+    np.testing.assert_array_equal(backend.rasters['coverage'], [[2, 1, 2, 1]])
+    assert backend.info('joined')['datatype'] == 'CELL'
+
+
+def test_unsupported_operator(backend):
+    with pytest.raises(ValueError):
+        result(backend, 'a & b')
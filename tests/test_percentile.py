@@ -0,0 +1,87 @@
+import os
+import numpy as np
+import pytest
+from benchmark_corridor import synthetic_surface, synthetic_sites
+from def_bidir import bidir_percentile
+from def_multires import percentile_corridor
+from def_rcost_numpy import accumulate, coord_to_cell, moves
+from def_tiled import tiled_percentile
+
+SIZE = 40
+
+
+@pytest.fixture(params=[0, 1, 2])
+def pair(request):
+    # Cost surface and the (row, col) of two sites of it
+    cost, region = synthetic_surface(SIZE, seed=request.param)
+    region.update(rows=SIZE, cols=SIZE)
+    starts = [coord_to_cell(x, y, region) for x, y, sid in synthetic_sites(cost, region, 2, seed=request.param)]
+    return cost, starts
+
+
+class ArrayRaster:
+    # Open raster of def_tiled.py over an array
+    def __init__(self, values):
+        self.values = values
+        self.shape = values.shape
+
+    def range(self):
+        return np.nanmin(self.values), np.nanmax(self.values)
+
+    def read(self, row0, nrows):
+        return self.values[row0:row0 + nrows].copy()
+
+
+# _____________BIDIRECTIONAL SEARCH_____________
+@pytest.mark.parametrize('percentile', [1, 10, 50])
+def test_bidir_follows_full_search(pair, percentile):
+    cost, starts = pair
+    ncells = int(np.count_nonzero(~np.isnan(cost)))
+    perc, corridor = percentile_corridor(cost, starts, percentile, 100.0, 100.0, ncells=ncells)
+    start_a, start_b = (row * SIZE + col for row, col in starts)
+    bidir, cells, values, searched = bidir_percentile(cost.ravel().tolist(), start_a, start_b, percentile,
+                                                      cost.shape, 100.0, 100.0, moves(True), ncells)
+    assert bidir == pytest.approx(perc, rel=1e-12)
+    # The cells below the percentile and their values are those of the full corridor.
+    below = {cell: value for cell, value in zip(cells, values) if value < bidir}
+    assert sorted(below) == np.flatnonzero(~np.isnan(corridor.ravel())).tolist()
+    np.testing.assert_allclose([below[cell] for cell in sorted(below)], corridor.ravel()[sorted(below)])
+
+
+# _____________TILED PERCENTILE_____________
+@pytest.mark.parametrize('tilerows, bins', [(7, 16), (SIZE, 65536), (1, 1)])
+def test_tiled_follows_numpy(pair, tilerows, bins):
+    cost, starts = pair
+    a, b = (accumulate(cost, [start], 100.0, 100.0)[0] for start in starts)
+    corridor = (a + b) / 2
+    expected = np.percentile(corridor[~np.isnan(corridor)], 10)
+    assert tiled_percentile(ArrayRaster(a), ArrayRaster(b), 10, tilerows, bins) == pytest.approx(expected, rel=1e-12)
+
+
+def test_tiled_empty():
+    empty = ArrayRaster(np.full((3, 3), np.nan))
+    empty.range = lambda: (0.0, 0.0)
+    assert tiled_percentile(empty, empty, 10) is None
+
+
+# _____________SPARSE JOIN_____________
+def test_sparse_follows_network_join(pair, tmp_path):
+    # network_join_sparse() reads the GeoTIFFs written by GDAL, the stand-in writes .npz files.
+    pytest.importorskip('osgeo')
+    from benchmark_corridor import sparse_check
+    from def_backend import ArrayBackend
+    from def_catalog import RasterCatalog
+    from def_network import network_join
+
+    cost, starts = pair
+    backend = ArrayBackend()
+    backend.grid = {'n': SIZE * 100.0, 's': 0.0, 'e': SIZE * 100.0, 'w': 0.0, 'nsres': 100.0, 'ewres': 100.0}
+    percs = []
+    # Thresholded cost distances of the sites stand in for thresholded corridors.
+    for i, start in enumerate(starts):
+        dist = accumulate(cost, [start], 100.0, 100.0)[0]
+        backend.rasters[f'corridor_{i}_10perc'] = np.where(dist < np.nanpercentile(dist, 10), dist, np.nan)
+        percs.append(f'corridor_{i}_10perc')
+    network_join(percs, 'network', backend=backend)
+    # Raises ValueError if the networks differ
+    sparse_check(percs, 'network', os.fspath(tmp_path), RasterCatalog(backend=backend), backend)
@@ -0,0 +1,91 @@
+import math
+import numpy as np
+from benchmark_corridor import synthetic_surface, synthetic_sites
+from def_backend import ArrayBackend
+from def_catalog import RasterCatalog
+from def_rcost_numpy import accumulate, coord_to_cell, moves, step_length
+from def_rcost_run import costdist
+
+# _____________R.COST FIXTURES_____________
+# Cumulative cost of r.cost -k from the first cell. r.cost measures moves in cells of the east-west resolution
+# (EW_fac = 1, NS_fac = nsres / ewres, DIAG_fac = sqrt(NS_fac^2 + EW_fac^2), ...) and multiplies them with the
+# average cost of the cells crossed.
+ROW_COST = np.array([[1.0, 3.0, 2.0, 4.0]])
+ROW_RCOST = np.array([[0.0, 2.0, 4.5, 7.5]])
+# nsres = 50, ewres = 100: a north-south move is half a cell.
+COLUMN_COST = np.array([[1.0], [3.0], [2.0], [4.0]])
+COLUMN_RCOST = np.array([[0.0], [1.0], [2.25], [3.75]])
+# Constant cost 1, nsres = 50, ewres = 100: diagonal sqrt(1.25), knight's moves sqrt(2) and sqrt(4.25).
+UNIFORM_RCOST = np.array([[0.0, 1.0, 2.0],
+                          [0.5, math.sqrt(1.25), math.sqrt(4.25)],
+                          [1.0, math.sqrt(2.0), 2 * math.sqrt(1.25)]])
+
+
+
+def shifted(values, dr, dc):
+    # values[row + dr, col + dc] for every cell, NaN outside of the array.
+    out = np.full(values.shape, np.nan)
+    rows, cols = values.shape
+    out[max(0, -dr):rows - max(0, dr), max(0, -dc):cols - max(0, dc)] = \
+        values[max(0, dr):rows - max(0, -dr), max(0, dc):cols - max(0, -dc)]
+    return out
+
+
+def reference(cost, start, nsres, ewres):
+    '''
+    Accumulated cost by relaxing all moves of r.cost -k over the whole array until nothing changes (Bellman-Ford).
+    A move costs the mean cost of the cells it crosses times its length.
+    '''
+    steps = []
+    for dr, dc, via, degree in moves(knight=True):
+        # Cells crossed, relative to the cell reached
+        crossed = [(-dr, -dc), (0, 0)] + [(vr - dr, vc - dc) for vr, vc in via]
+        move = np.mean([shifted(cost, r, c) for r, c in crossed], axis=0) * step_length(dr, dc, nsres, ewres)
+        steps.append((dr, dc, move))
+    dist = np.full(cost.shape, np.inf)
+    dist[start] = 0.0
+    while True:
+        relaxed = dist.copy()
+        for dr, dc, move in steps:
+            relaxed = np.fmin(relaxed, shifted(dist, -dr, -dc) + move)
+        if np.array_equal(relaxed, dist):
+            break
+        dist = relaxed
+    dist[np.isinf(dist) | np.isnan(cost)] = np.nan
+    return dist
+
+
+def test_row_follows_rcost():
+    dist, direction = accumulate(ROW_COST, [(0, 0)], 100.0, 100.0)
+    np.testing.assert_allclose(dist, ROW_RCOST)
+
+
+def test_column_follows_rcost():
+    dist, direction = accumulate(COLUMN_COST, [(0, 0)], 50.0, 100.0)
+    np.testing.assert_allclose(dist, COLUMN_RCOST)
+
+
+def test_uniform_follows_rcost():
+    dist, direction = accumulate(np.ones((3, 3)), [(0, 0)], 50.0, 100.0)
+    np.testing.assert_allclose(dist, UNIFORM_RCOST)
+
+
+def test_synthetic_follows_reference():
+    cost, region = synthetic_surface(24, seed=3)
+    region.update(rows=24, cols=24)
+    for x, y, sid in synthetic_sites(cost, region, 2, seed=3):
+        start = coord_to_cell(x, y, region)
+        # Rectangular cells, nsres = 50 and ewres = 100
+        dist, direction = accumulate(cost, [start], 50.0, 100.0)
+        np.testing.assert_allclose(dist, reference(cost, start, 50.0, 100.0), rtol=1e-9)
+
+
+def test_costdist_skips_start_outside_region():
+    backend = ArrayBackend()
+    backend.grid = {'n': 300.0, 's': 0.0, 'e': 300.0, 'w': 0.0, 'nsres': 100.0, 'ewres': 100.0}
+    backend.rasters['costsurf_test'] = np.ones((3, 3))
+    catalog = RasterCatalog(backend=backend)
+    costdist(['costsurf_test'], [['50', '250', '1'], ['950', '950', '2']], engine='numpy', catalog=catalog,
+             backend=backend)
+    assert '1_costdist_test' in catalog and '1_movdir_test' in catalog
+    assert '2_costdist_test' not in catalog and '2_movdir_test' not in catalog